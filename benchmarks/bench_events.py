@@ -0,0 +1,75 @@
+"""
+Benchmark of the event hooks on the preprocessor hot loop.
+
+Usage:
+    python benchmarks/bench_events.py [number of macro calls]
+
+Preprocesses an in-memory document with one macro call per line, without subscribers and with a no-op handler
+on every event. The cost of the disabled hooks is estimated from the cost of the enabled check times the number
+of checks in a run.
+"""
+
+import sys
+import time
+import timeit as timeit_
+from types import ModuleType
+
+from texenv import events, TeXPreprocessor
+
+
+def timeit(func, repeat=5):
+    best = None
+    for i in range(repeat):
+        t_start = time.perf_counter()
+        func()
+        t = time.perf_counter() - t_start
+        best = t if best is None else min(best, t)
+    return best
+
+
+def noop(**kwargs):
+    pass
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    module = ModuleType("bench_macros")
+    module.add = lambda a, b: str(int(a) + int(b))
+
+    text = "".join(
+        "Line {} of the document, with a macro \\m\\add[{}, 1].\n".format(i, i)
+        for i in range(n)
+    )
+    texpp = TeXPreprocessor.from_string(text, modules=dict(m=module))
+
+    print(f"{n} macro calls, {len(text) / 1e3:.0f} kB")
+
+    t_disabled = timeit(texpp.process)
+    print(f"no subscribers:        {t_disabled * 1e3:8.1f} ms")
+
+    for name in events.EVENTS:
+        events.subscribe(name, noop)
+    t_enabled = timeit(texpp.process)
+    for name in events.EVENTS:
+        events.unsubscribe(name, noop)
+
+    print(
+        f"no-op subscribers:     {t_enabled * 1e3:8.1f} ms ({(t_enabled / t_disabled - 1) * 100:+.1f}%)"
+    )
+
+    # one check per macro call
+    checks = n
+    t_check = (
+        min(
+            timeit_.repeat(
+                "events.enabled", globals=dict(events=events), number=1000000
+            )
+        )
+        / 1e6
+    )
+    t_hooks = checks * t_check
+    print(
+        f"disabled hook checks:  {t_hooks * 1e3:8.3f} ms ({checks} checks, {t_check * 1e9:.0f} ns each, "
+        f"{t_hooks / t_disabled * 100:.3f}% of the run)"
+    )
@@ -0,0 +1,60 @@
+"""
+Benchmark of figure rendering in Presentation.
+
+Usage:
+    python benchmarks/bench_slides.py [number of figures]
+
+Adds slides with two figures each and renders the figures inline (while adding the slides), and deferred to
+save() in a thread pool and a process pool. pdflatex is not run.
+"""
+
+import sys
+import os
+import time
+import tempfile
+from pathlib import Path
+import numpy as np
+from matplotlib import pyplot as plt
+
+from texenv import Presentation, utils
+
+
+def make_figure(i):
+    rng = np.random.default_rng(i)
+    fig, axes = plt.subplots(1, 2, figsize=(6, 3))
+    axes[0].scatter(*rng.normal(size=(2, 5000)), s=2)
+    axes[1].plot(np.cumsum(rng.normal(size=(2000, 5)), axis=0))
+    axes[1].set_title("figure {}".format(i))
+    return fig
+
+
+def build(n, name, **kwargs):
+    """Returns the time to add n figures to a presentation and render them."""
+    figures = [make_figure(i) for i in range(n)]
+    pres = Presentation(Path(tempfile.mkdtemp()) / (name + ".pdf"), **kwargs)
+
+    t_start = time.perf_counter()
+    for i in range(0, n, 2):
+        pres.add_slide(figures[i : i + 2], title="slide {}".format(i // 2))
+    pres.render_figures()
+    t = time.perf_counter() - t_start
+
+    plt.close("all")
+    return t
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    plt.rcParams["figure.max_open_warning"] = 0
+    print(f"{n} figures, {os.cpu_count()} cpus")
+
+    t_inline = build(n, "inline")
+    print(f"inline:              {t_inline:6.2f} s")
+
+    writer = utils.FigureWriter(processes=False)
+    t_threads = build(n, "threads", deferred=True, figure_writer=writer)
+    writer.close()
+    print(f"deferred, threads:   {t_threads:6.2f} s ({t_inline / t_threads:.1f}x)")
+
+    t_processes = build(n, "processes", deferred=True)
+    print(f"deferred, processes: {t_processes:6.2f} s ({t_inline / t_processes:.1f}x)")
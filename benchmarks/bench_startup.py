@@ -0,0 +1,76 @@
+"""
+Benchmark of the startup time of the texenv command line.
+
+Usage:
+    python benchmarks/bench_startup.py [number of runs]
+
+Runs "texenv list" in a new interpreter, in an environment with the test package database, and compares the
+time to an interpreter that only starts up. The minimum over all runs is reported.
+"""
+
+import sys
+import os
+import json
+import time
+import tempfile
+import shutil
+import subprocess
+from pathlib import Path
+
+SCRIPT = """
+import sys
+from texenv.runner import cli
+
+cli(["list"], standalone_mode=False)
+print(len(sys.modules))
+"""
+
+
+def run(args, env, n):
+    """Returns the minimum time of n runs of the interpreter with args, and the output of the last run."""
+    times = []
+    for _ in range(n):
+        t_start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable] + args, env=env, stdout=subprocess.PIPE, check=True
+        )
+        times.append(time.perf_counter() - t_start)
+    return min(times), proc.stdout.decode("utf-8")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    root = Path(__file__).parents[1]
+
+    # environment created by texenv init, with a config file so the PATH is not searched
+    tmp = Path(tempfile.mkdtemp())
+    venv = tmp / "venv"
+    (venv / "tex/tlpkg").mkdir(parents=True)
+    shutil.copyfile(
+        root / "tests/test_tlpdb/texlive.tlpdb", venv / "tex/tlpkg/texlive.tlpdb"
+    )
+    with open(venv / "tex/texenv.json", "w") as f:
+        json.dump(
+            dict(
+                base_texpath="/usr/local/texlive/2024",
+                platform="x86_64-linux",
+                env_texpath=str(venv / "tex/bin/x86_64-linux"),
+            ),
+            f,
+        )
+
+    env = dict(os.environ)
+    env["VIRTUAL_ENV"] = str(venv)
+    env["TEXENV_CACHE_DIR"] = str(tmp / "cache")
+    env["PYTHONPATH"] = str(root) + os.pathsep + env.get("PYTHONPATH", "")
+
+    try:
+        t_base, _ = run(["-c", "pass"], env, n)
+        t_list, output = run(["-c", SCRIPT], env, n)
+    finally:
+        shutil.rmtree(tmp)
+
+    modules = output.split()[-1]
+    print(f"{n} runs")
+    print(f"python:      {t_base:6.3f} s")
+    print(f"texenv list: {t_list:6.3f} s (+{t_list - t_base:.3f} s, {modules} modules)")
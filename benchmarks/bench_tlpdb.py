@@ -0,0 +1,96 @@
+"""
+Benchmark of the TeXLive package database parser on a real texlive.tlpdb.
+
+Usage:
+    python benchmarks/bench_tlpdb.py [path/to/texlive.tlpdb]
+
+Defaults to the database of the system TeXLive installation.
+"""
+
+import sys
+import os
+import time
+import tempfile
+from pathlib import Path
+
+from texenv import tlpdb, utils
+
+
+def legacy_parse(pdb_path: Path):
+    """The original parser, kept for comparison."""
+    pkg_listings = {}
+
+    with open(pdb_path, "r", encoding="utf-8") as f:
+        ln = 1
+        while ln:
+            ln = f.readline()
+            if ln[:4] == "name" and ln[4:].strip():
+                pkg_name = ln[4:].strip()
+                pkg_listings[pkg_name] = ""
+
+                ln = f.readline()
+                while ln and ln != "\n":
+                    pkg_listings[pkg_name] += ln
+                    ln = f.readline()
+
+    pkg_files = {}
+    curlisting = ""
+    for k, v in pkg_listings.items():
+        pkg_files[k] = {}
+        pkg_files[k]["runfiles"] = []
+        pkg_files[k]["binfiles"] = []
+        pkg_files[k]["srcfiles"] = []
+        for ln in v.split("\n"):
+            if ln[:8] in ["runfiles", "binfiles", "srcfiles"]:
+                curlisting = ln[:8]
+                continue
+            elif not len(ln) or ln[0] != " ":
+                curlisting = ""
+                continue
+
+            if curlisting and len(ln):
+                pkg_files[k][curlisting].append(ln.strip())
+
+    return pkg_listings, pkg_files
+
+
+def timeit(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        t_start = time.perf_counter()
+        func()
+        t = time.perf_counter() - t_start
+        best = t if best is None else min(best, t)
+    return best
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        pdb_path = Path(sys.argv[1])
+    else:
+        pdb_path = utils.get_base_texpath()[0] / "tlpkg/texlive.tlpdb"
+
+    # use an empty cache so the first load parses the database
+    os.environ["TEXENV_CACHE_DIR"] = tempfile.mkdtemp()
+
+    size_mb = pdb_path.stat().st_size / 1e6
+    print(f"{pdb_path} ({size_mb:.1f} MB, {len(tlpdb.parse(pdb_path))} packages)")
+
+    print(
+        f"legacy parser:        {timeit(lambda: legacy_parse(pdb_path)) * 1e3:8.1f} ms"
+    )
+    print(
+        f"single pass parser:   {timeit(lambda: tlpdb.parse(pdb_path)) * 1e3:8.1f} ms"
+    )
+
+    tlpdb._indexes.clear()
+    print(
+        f"first load (parse):   {timeit(lambda: tlpdb.load(pdb_path), 1) * 1e3:8.1f} ms"
+    )
+
+    def load_disk():
+        tlpdb._indexes.clear()
+        tlpdb.load(pdb_path)
+
+    print(f"load from disk cache: {timeit(load_disk) * 1e3:8.1f} ms")
+    print(f"load from memory:     {timeit(lambda: tlpdb.load(pdb_path)) * 1e3:8.1f} ms")
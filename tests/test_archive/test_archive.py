@@ -0,0 +1,108 @@
+import unittest
+from pathlib import Path
+import os
+import json
+import shutil
+import tarfile
+import tempfile
+from texenv import archive
+
+
+class TestArchive(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp())
+        self.texdir = self.tmp / "venv1/tex"
+
+        (self.texdir / "bin/x86_64-linux").mkdir(parents=True)
+        (self.texdir / "texmf-dist/tex/latex/pkg").mkdir(parents=True)
+        (self.texdir / "texmf-dist/scripts").mkdir(parents=True)
+
+        (self.texdir / "bin/x86_64-linux/pdftex").write_text("binary")
+        os.chmod(self.texdir / "bin/x86_64-linux/pdftex", 0o755)
+        (self.texdir / "texmf-dist/tex/latex/pkg/pkg.sty").write_text("style")
+        # same content as pkg.sty, and a hard link
+        (self.texdir / "texmf-dist/tex/latex/pkg/copy.sty").write_text("style")
+        os.link(
+            self.texdir / "texmf-dist/tex/latex/pkg/pkg.sty",
+            self.texdir / "texmf-dist/tex/latex/pkg/link.sty",
+        )
+
+        (self.texdir / "texmf-dist/scripts/tool.pl").write_text("perl")
+        os.symlink(
+            "../../texmf-dist/scripts/tool.pl", self.texdir / "bin/x86_64-linux/tool"
+        )
+
+        # symlink out of the environment is replaced by the file
+        (self.tmp / "base.sty").write_text("base")
+        os.symlink(
+            self.tmp / "base.sty", self.texdir / "texmf-dist/tex/latex/pkg/base.sty"
+        )
+
+        with open(self.texdir / "texenv.json", "w") as f:
+            json.dump(dict(env_texpath=str(self.texdir / "bin/x86_64-linux")), f)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp)
+
+    def roundtrip(self, name):
+        archive_path = self.tmp / name
+        manifest = archive.export(self.texdir, archive_path)
+
+        self.assertEqual(manifest["files"], 8)
+        self.assertEqual(manifest["duplicates"], 2)
+        self.assertEqual(manifest["fixups"], ["texenv.json"])
+
+        newdir = self.tmp / "venv2/tex"
+        archive.import_(archive_path, newdir, max_workers=2)
+
+        with open(newdir / "texenv.json") as f:
+            self.assertEqual(
+                json.load(f)["env_texpath"], str(newdir.resolve() / "bin/x86_64-linux")
+            )
+
+        sty = newdir / "texmf-dist/tex/latex/pkg"
+        self.assertEqual((sty / "copy.sty").read_text(), "style")
+        self.assertEqual(
+            os.stat(sty / "pkg.sty").st_ino, os.stat(sty / "copy.sty").st_ino
+        )
+        self.assertEqual(
+            os.stat(sty / "pkg.sty").st_ino, os.stat(sty / "link.sty").st_ino
+        )
+
+        self.assertFalse((sty / "base.sty").is_symlink())
+        self.assertEqual((sty / "base.sty").read_text(), "base")
+
+        tool = newdir / "bin/x86_64-linux/tool"
+        self.assertTrue(tool.is_symlink())
+        self.assertEqual(tool.read_text(), "perl")
+        self.assertTrue(os.stat(newdir / "bin/x86_64-linux/pdftex").st_mode & 0o100)
+
+        return archive_path
+
+    def test_xz(self):
+        archive_path = self.roundtrip("env.tar.xz")
+
+        # the manifest is the first member
+        with tarfile.open(archive_path) as tar:
+            self.assertEqual(tar.getnames()[0], archive.MANIFEST)
+
+    def test_gz(self):
+        self.roundtrip("env.tar.gz")
+
+    @unittest.skipIf(archive.zstandard is None, "zstandard is not installed")
+    def test_zst(self):
+        self.roundtrip("env.tar.zst")
+
+    def test_existing(self):
+        archive_path = self.tmp / "env.tar"
+        archive.export(self.texdir, archive_path)
+        with self.assertRaises(RuntimeError):
+            archive.import_(archive_path, self.texdir)
+
+    def test_unknown_type(self):
+        with self.assertRaises(ValueError):
+            archive.export(self.texdir, self.tmp / "env.zip")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,10 @@
+def title(text):
+    return r"\section{" + text + "}"
+
+
+def product(a, b):
+    return str(int(a) * int(b))
+
+
+def fail(*args):
+    raise ValueError("macro failed")
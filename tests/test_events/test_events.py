@@ -0,0 +1,133 @@
+import unittest
+from pathlib import Path
+import gzip
+import re
+import shutil
+import subprocess
+import tempfile
+from unittest import mock
+from texenv import events, TeXPreprocessor
+from texenv.runner import build_document
+
+dir_ = Path(__file__).parent
+
+
+def fake_pdflatex(command, cwd=None, timeout=None):
+    """Writes the PDF and synctex file where pdflatex would, without running it."""
+    build_dir = Path(re.search(r'--output-directory="([^"]+)"', command).group(1))
+    (build_dir / "doc.pdf").write_bytes(b"%PDF-1.5")
+    with gzip.open(build_dir / "doc.synctex.gz", "wt") as f:
+        f.write(
+            "SyncTeX Version:1\nInput:1:{}\n".format((build_dir / "doc.tex").as_posix())
+        )
+    return subprocess.CompletedProcess(command, 0, b"")
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp())
+        shutil.copyfile(dir_ / "doc.tex", self.tmp / "doc.tex")
+        shutil.copyfile(dir_ / "macros_events.py", self.tmp / "macros_events.py")
+        shutil.copytree(dir_ / "chapters", self.tmp / "chapters")
+
+        # records the name and arguments of every event
+        self.log = []
+        self.handlers = {}
+        for name in events.EVENTS:
+            self.handlers[name] = events.subscribe(
+                name, lambda name=name, **kwargs: self.log.append((name, kwargs))
+            )
+
+    def tearDown(self) -> None:
+        for name, handler in self.handlers.items():
+            events.unsubscribe(name, handler)
+        shutil.rmtree(self.tmp)
+
+    def test_subscribe(self):
+        self.assertTrue(events.enabled)
+
+        for name, handler in self.handlers.items():
+            events.unsubscribe(name, handler)
+        self.assertFalse(events.enabled)
+
+        with self.assertRaises(ValueError):
+            events.subscribe("on_nothing", print)
+        with self.assertRaises(ValueError):
+            events.unsubscribe("on_write", print)
+
+        # no events are emitted without handlers
+        TeXPreprocessor(self.tmp / "doc.tex").run()
+        self.assertEqual(self.log, [])
+
+        self.handlers = {}
+
+    def test_preprocessor_events(self):
+        TeXPreprocessor(self.tmp / "doc.tex").run()
+
+        self.assertEqual(
+            [name for name, _ in self.log],
+            [
+                "on_import",
+                "on_macro_start",
+                "on_macro_end",
+                "on_macro_start",
+                "on_macro_end",
+                "on_write",
+                "on_write",
+            ],
+        )
+
+        _, kwargs = self.log[0]
+        self.assertEqual(
+            (kwargs["alias"], kwargs["module"], kwargs["line"]),
+            ("pym", "macros_events", 3),
+        )
+
+        _, kwargs = self.log[3]
+        self.assertEqual((kwargs["method"], kwargs["args"]), ("product", ["6", "7"]))
+        self.assertEqual(kwargs["file"], self.tmp.resolve() / "chapters/ch1.tex")
+
+        _, kwargs = self.log[4]
+        self.assertEqual((kwargs["output"], kwargs["error"]), ("42", None))
+        self.assertGreaterEqual(kwargs["seconds"], 0)
+
+        # included files are written before the top level file
+        self.assertEqual(
+            self.log[5][1]["source"], self.tmp.resolve() / "chapters/ch1.tex"
+        )
+        self.assertEqual(self.log[6][1]["path"], self.tmp.resolve() / "build/doc.tex")
+
+    def test_macro_error(self):
+        texpp = TeXPreprocessor.from_string(
+            r"\pym\fail[]", modules=dict(pym="macros_events"), module_paths=[dir_]
+        )
+
+        with self.assertRaises(ValueError):
+            texpp.process()
+
+        name, kwargs = self.log[-1]
+        self.assertEqual(name, "on_macro_end")
+        self.assertIsInstance(kwargs["error"], ValueError)
+        self.assertIsNone(kwargs["file"])
+
+    def test_build_events(self):
+        with mock.patch("texenv.utils.run_command", fake_pdflatex), mock.patch(
+            "texenv.utils.preflight"
+        ):
+            build_document(self.tmp / "doc.tex", self.tmp)
+
+        names = [name for name, _ in self.log]
+        self.assertEqual(
+            names[-3:], ["on_compile_start", "on_compile_end", "on_synctex_rewrite"]
+        )
+
+        _, kwargs = self.log[-2]
+        self.assertEqual(kwargs["returncode"], 0)
+        self.assertIn("pdflatex", kwargs["command"])
+
+        _, kwargs = self.log[-1]
+        self.assertEqual(kwargs["out_syn"], self.tmp / "doc.synctex.gz")
+
+
+if __name__ == "__main__":
+    unittest.main()
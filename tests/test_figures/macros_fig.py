@@ -0,0 +1,14 @@
+from matplotlib import pyplot as plt
+from texenv.macros import DeferredFigure
+
+
+def line_plot(n="10"):
+    fig, ax = plt.subplots(1, 1, figsize=(3, 2))
+    ax.plot(range(int(n)))
+    return fig
+
+
+def captioned_plot(caption, width="3in"):
+    fig, ax = plt.subplots(1, 1, figsize=(3, 2))
+    ax.plot(range(5))
+    return DeferredFigure(fig, file="captioned.pdf", caption=caption, width=width)
@@ -0,0 +1,127 @@
+import unittest
+from pathlib import Path
+import shutil
+import tempfile
+from matplotlib import pyplot as plt
+from matplotlib.ticker import FuncFormatter
+from texenv import TeXPreprocessor, preprocess, utils
+
+
+class TestFigures(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_ = Path(__file__).parent
+        self.build_dir = self.dir_ / "build"
+
+        if self.build_dir.exists():
+            shutil.rmtree(self.build_dir)
+
+    def tearDown(self) -> None:
+        if self.build_dir.exists():
+            shutil.rmtree(self.build_dir)
+
+    def test_figures(self):
+        """
+        Figures returned from macros are replaced with includegraphics, and saved before run returns.
+        """
+        texpp = TeXPreprocessor(self.dir_ / "figures.tex")
+        texpp.run()
+
+        with open(self.build_dir / "figures.tex") as f:
+            pp_text = f.read()
+
+        self.assertIn(
+            r"\includegraphics{build/figures/figures-8.pdf} \includegraphics{build/figures/figures-8-1.pdf}",
+            pp_text,
+        )
+        self.assertIn(
+            r"\includegraphics[width=3in]{build/figures/captioned.pdf}", pp_text
+        )
+        self.assertIn(r"\caption{\small{Example caption}", pp_text)
+
+        for name in ["figures-8.pdf", "figures-8-1.pdf", "captioned.pdf"]:
+            self.assertTrue((self.build_dir / "figures" / name).stat().st_size > 0)
+
+        # saved figures are closed
+        self.assertEqual(len(plt.get_fignums()), 0)
+
+    def test_name_collision(self):
+        """
+        Figures with the same file name raise an error, also if one of them is in an included file from the cache.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            doc = Path(tmp_dir) / "doc.tex"
+            (Path(tmp_dir) / "chapter.tex").write_text(
+                "\\pym\\captioned_plot{In chapter}\n"
+            )
+
+            doc.write_text(
+                "\\import\\macros_fig as \\pym\n\\pym\\captioned_plot{First}\n\\pym\\captioned_plot{Second}\n"
+            )
+            with self.assertRaises(SyntaxError) as cm:
+                TeXPreprocessor(doc, module_paths=[self.dir_]).run()
+            self.assertIn("captioned.pdf", str(cm.exception))
+
+            doc.write_text("\\import\\macros_fig as \\pym\n\\include{chapter}\n")
+            TeXPreprocessor(doc, module_paths=[self.dir_]).run()
+
+            # the included file is read from the cache and its figure is not saved again
+            doc.write_text(
+                "\\import\\macros_fig as \\pym\n\\include{chapter}\n\\pym\\captioned_plot{Main}\n"
+            )
+            with self.assertRaises(SyntaxError):
+                TeXPreprocessor(doc, module_paths=[self.dir_]).run()
+
+        plt.close("all")
+
+    def test_figure_writer(self):
+        """
+        Figures are saved in a process pool by default, figures that can't be pickled are saved in a thread.
+        """
+        fig, ax = plt.subplots(1, 1, figsize=(3, 2))
+        ax.plot(range(5))
+        fig_lambda, ax = plt.subplots(1, 1, figsize=(3, 2))
+        ax.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: str(x)))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = utils.FigureWriter(max_workers=2)
+            # no workers are started until a figure is submitted
+            self.assertIsNone(writer._processes)
+            self.assertIsNone(writer._threads)
+
+            writer.submit(fig, Path(tmp_dir) / "a.pdf")
+            writer.submit(fig_lambda, Path(tmp_dir) / "b.pdf")
+            self.assertEqual(writer._processes._mp_context.get_start_method(), "spawn")
+            self.assertIsNotNone(writer._threads)
+            writer.close()
+
+            for name in ["a.pdf", "b.pdf"]:
+                self.assertTrue((Path(tmp_dir) / name).stat().st_size > 0)
+
+    def test_in_memory(self):
+        """
+        In-memory documents need a figure directory to return figures.
+        """
+        in_text = "\\import\\macros_fig as \\pym\n\\pym\\line_plot"
+
+        with self.assertRaises(SyntaxError):
+            preprocess(in_text, module_paths=[self.dir_])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = utils.FigureWriter(max_workers=2)
+
+            texpp = TeXPreprocessor.from_string(
+                in_text,
+                module_paths=[self.dir_],
+                figure_dir=tmp_dir,
+                figure_writer=writer,
+            )
+            text, _ = texpp.process()
+            writer.close()
+
+            filepath = Path(tmp_dir) / "fig-2.pdf"
+            self.assertEqual(text, "\n\\includegraphics{" + filepath.as_posix() + "}")
+            self.assertTrue(filepath.stat().st_size > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from pathlib import Path
+import os
+import shutil
+import tempfile
+from texenv import fileops
+
+
+class TestFileOps(unittest.TestCase):
+    def setUp(self) -> None:
+        self.src = Path(tempfile.mkdtemp())
+        self.dst = Path(tempfile.mkdtemp())
+
+        (self.src / "bin/x86_64-linux").mkdir(parents=True)
+        (self.src / "texmf-dist/tex/latex/pkg").mkdir(parents=True)
+
+        (self.src / "bin/x86_64-linux/pdftex").write_text("binary")
+        (self.src / "texmf-dist/tex/latex/pkg/pkg.sty").write_text("style")
+        (self.src / "texmf-dist/tex/latex/pkg/pkg.cls").write_text("class")
+
+        self.plan = fileops.plan_files(
+            self.src, self.dst, ["bin/x86_64-linux/pdftex"], binary=True
+        ) + fileops.plan_files(
+            self.src, self.dst, ["texmf-dist/tex/latex/pkg", "missing.sty"]
+        )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.src)
+        shutil.rmtree(self.dst)
+
+    def test_plan(self):
+        self.assertEqual(len(self.plan), 3)
+
+        dsts = sorted(str(d.relative_to(self.dst)) for _, d, _ in self.plan)
+        self.assertEqual(
+            dsts,
+            [
+                "bin/x86_64-linux/pdftex",
+                "texmf-dist/tex/latex/pkg/pkg.cls",
+                "texmf-dist/tex/latex/pkg/pkg.sty",
+            ],
+        )
+
+        binary = [b for _, d, b in self.plan if d.name == "pdftex"]
+        self.assertEqual(binary, [True])
+
+    def test_copy(self):
+        stats = fileops.execute(self.plan, mode="copy")
+
+        self.assertEqual(stats["files"], 3)
+        self.assertEqual(stats["bytes"], len("binary") + len("style") + len("class"))
+        self.assertEqual(stats["fallbacks"], 0)
+
+        sty = self.dst / "texmf-dist/tex/latex/pkg/pkg.sty"
+        self.assertEqual(sty.read_text(), "style")
+        self.assertNotEqual(
+            os.stat(sty).st_ino,
+            os.stat(self.src / "texmf-dist/tex/latex/pkg/pkg.sty").st_ino,
+        )
+
+    def test_hard(self):
+        stats = fileops.execute(self.plan, mode="hard")
+
+        self.assertEqual(stats["fallbacks"], 0)
+        for src, dst, _ in self.plan:
+            self.assertEqual(os.stat(src).st_ino, os.stat(dst).st_ino)
+
+    def test_symlink(self):
+        fileops.execute(self.plan, mode="symlink")
+
+        # binaries are always copied
+        self.assertFalse((self.dst / "bin/x86_64-linux/pdftex").is_symlink())
+        self.assertEqual((self.dst / "bin/x86_64-linux/pdftex").read_text(), "binary")
+
+        sty = self.dst / "texmf-dist/tex/latex/pkg/pkg.sty"
+        self.assertTrue(sty.is_symlink())
+        self.assertEqual(sty.read_text(), "style")
+
+    def test_reflink(self):
+        # reflinks are only supported on copy-on-write filesystems, otherwise files are copied
+        stats = fileops.execute(self.plan, mode="reflink")
+
+        self.assertIn(stats["fallbacks"], [0, 3])
+        for src, dst, _ in self.plan:
+            self.assertEqual(Path(dst).read_text(), Path(src).read_text())
+
+    def test_overwrite(self):
+        fileops.execute(self.plan, mode="symlink")
+        # running again replaces the existing files, i.e. when init is run twice
+        fileops.execute(self.plan, mode="copy")
+
+        sty = self.dst / "texmf-dist/tex/latex/pkg/pkg.sty"
+        self.assertFalse(sty.is_symlink())
+        self.assertEqual(sty.read_text(), "style")
+        self.assertEqual(
+            (self.src / "texmf-dist/tex/latex/pkg/pkg.sty").read_text(), "style"
+        )
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            fileops.execute(self.plan, mode="move")
+
+    def test_format_stats(self):
+        s = fileops.format_stats(dict(files=10, bytes=2e6, fallbacks=2, seconds=2))
+        self.assertEqual(
+            s,
+            "10 files (2.0 MB) in 2.00 s (5 files/s, 1.0 MB/s), 2 files copied instead of linked",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import numpy as np
+import unittest
+from pathlib import Path
+from io import StringIO, BytesIO
+from texenv import TeXPreprocessor, preprocess
+import texenv
+
+import macros_mem
+
+in_text = r"""\documentclass{article}
+\pydef\KW kw1-pydef
+
+\begin{document}
+
+	Test macro with kwargs \pym\macro_kwargs{arg1}{arg2}[kw1=\KW] end
+	Test macro with kwargs \pym\macro_kwargs[arg1, arg2] end
+
+\end{document}"""
+
+truth_text = r"""\documentclass{article}
+
+
+\begin{document}
+
+	Test macro with kwargs arg1 + arg2 KW: kw1-pydef + kw2-default end
+	Test macro with kwargs arg1 + arg2 KW: kw1-default + kw2-default end
+
+\end{document}"""
+
+
+class TestInMemory(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_ = Path(__file__).parent
+        self.modules = dict(pym=macros_mem)
+
+    def test_preprocess(self):
+        """
+        Preprocessing a string should not create a build directory.
+        """
+        text, line_map = preprocess(in_text, modules=self.modules)
+
+        self.assertEqual(text, truth_text)
+        np.testing.assert_array_equal(line_map, np.arange(1, 10))
+        self.assertFalse((self.dir_ / "build").exists())
+
+    def test_stream(self):
+        """
+        Output can be written to text or binary streams.
+        """
+        t_stream = StringIO()
+        text, line_map = preprocess(in_text, modules=self.modules, stream=t_stream)
+
+        self.assertIsNone(text)
+        self.assertEqual(t_stream.getvalue(), truth_text)
+
+        b_stream = BytesIO()
+        TeXPreprocessor.from_string(in_text, self.modules).process(b_stream)
+        self.assertEqual(b_stream.getvalue().decode("utf-8"), truth_text)
+
+    def test_module_names(self):
+        """
+        Modules can be given by name or module object, and macro calls can end the document.
+        """
+        text, line_map = preprocess(
+            "\\pym\\table{a | b}\n\\tx\\table{a | b}",
+            modules={"pym": texenv, "tx": "texenv"},
+        )
+
+        table = texenv.table("a | b")
+        self.assertEqual(text, table + "\n" + table)
+
+    def test_run_requires_file(self):
+        texpp = TeXPreprocessor.from_string(in_text)
+
+        with self.assertRaises(ValueError):
+            texpp.run()
+
+
+if __name__ == "__main__":
+    unittest.main()
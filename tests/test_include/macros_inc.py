@@ -0,0 +1,7 @@
+# number of times each macro was called, used to check that cached files are not preprocessed again
+calls = dict(emb_args=0)
+
+
+def emb_args(arg1, arg2):
+    calls["emb_args"] += 1
+    return arg1 + "|E|" + arg2
@@ -0,0 +1,150 @@
+import numpy as np
+import unittest
+from pathlib import Path
+import shutil
+import pickle
+import gzip
+from texenv import TeXPreprocessor, utils
+from texenv.preprocessor import load_module
+
+
+class TestInclude(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_ = Path(__file__).parent
+        self.build_dir = self.dir_ / "build"
+
+        if self.build_dir.exists():
+            shutil.rmtree(self.build_dir)
+
+    def tearDown(self) -> None:
+        if self.build_dir.exists():
+            shutil.rmtree(self.build_dir)
+
+    def read_build(self, name):
+        with open(self.build_dir / name) as f:
+            return f.read()
+
+    def test_include(self):
+        """
+        Files included with \\input and \\include are preprocessed into the build directory with their own line map.
+        """
+        texpp = TeXPreprocessor(self.dir_ / "include.tex")
+        texpp.run()
+
+        root_text = self.read_build("include.tex")
+
+        self.assertIn("Root macro 1|E|2", root_text)
+        self.assertIn(r"\input{build/chapters/ch1}", root_text)
+        # pydefs in included files are visible to the parent
+        self.assertIn("Defined in chapter: chapter-def", root_text)
+        self.assertIn(r"\include{build/chapters/ch2}", root_text)
+        # files that are not found next to the document are left alone
+        self.assertIn(r"\input{article.cls}", root_text)
+
+        self.assertEqual(
+            self.read_build("chapters/ch1.tex"),
+            "\nChapter 1 macro 3|E|4\n\n\\input{build/chapters/ch2}\n",
+        )
+        self.assertEqual(
+            self.read_build("chapters/ch2.tex"), "Chapter 2 macro 5|E|\n\t6\nend\n"
+        )
+
+        processed = texpp._processed
+        ch2_out = self.build_dir / "chapters/ch2.tex"
+        self.assertEqual(len(processed), 3)
+        self.assertEqual(processed[ch2_out][0], self.dir_ / "chapters/ch2.tex")
+        np.testing.assert_array_equal(processed[ch2_out][1], [1, 2, 3, 4])
+
+        with open(self.build_dir / "chapters/ch2.syncmap", "rb") as f:
+            np.testing.assert_array_equal(pickle.load(f), [1, 2, 3, 4])
+
+    def test_include_cache(self):
+        """
+        Included files are not preprocessed again if they have not changed.
+        """
+        # the module object that is used by the preprocessor
+        macros_inc = load_module("macros_inc", [self.dir_])
+
+        TeXPreprocessor(self.dir_ / "include.tex").run()
+        calls = macros_inc.calls["emb_args"]
+
+        texpp = TeXPreprocessor(self.dir_ / "include.tex")
+        texpp.run()
+
+        # only the macro in the top level file was called again
+        self.assertEqual(macros_inc.calls["emb_args"], calls + 1)
+        self.assertIn("Defined in chapter: chapter-def", self.read_build("include.tex"))
+        self.assertEqual(len(texpp._processed), 3)
+
+        # changing the definitions visible to a file invalidates the cache
+        with open(self.dir_ / "include.tex") as f:
+            text = f.read()
+
+        texpp = TeXPreprocessor(self.dir_ / "include.tex")
+        texpp._source = text.replace(
+            r"\begin{document}", "\\pydef\\NEW new\n\\begin{document}"
+        ).encode()
+        texpp.run()
+
+        # the top level file, and both chapters are processed again. The second include of chapter 2 has the same
+        # definitions as the first one and is still cached.
+        self.assertEqual(macros_inc.calls["emb_args"], calls + 4)
+
+    def test_synctex(self):
+        """
+        Synctex records for every preprocessed file are mapped back to the original file and line.
+        """
+        self.build_dir.mkdir()
+        processed = {
+            self.build_dir
+            / "include.tex": (self.dir_ / "include.tex", list(range(1, 15))),
+            self.build_dir
+            / "chapters/ch1.tex": (self.dir_ / "chapters/ch1.tex", [1, 1, 1, 3, 5]),
+        }
+
+        gen_syn = self.build_dir / "include.synctex.gz"
+        out_syn = self.build_dir / "include_out.synctex.gz"
+
+        synctex = "\n".join(
+            [
+                "SyncTeX Version:1",
+                "Input:1:{}".format((self.build_dir / "include.tex").as_posix()),
+                "Input:2:./build/chapters/ch1.tex",
+                "Input:3:/usr/share/texmf/article.cls",
+                "Content:",
+                "(1,8:100,200:300,400,500",
+                "h2,4:100,200:300,400,500",
+                "x3,4:100,200",
+                "",
+            ]
+        )
+        with gzip.open(gen_syn, "wt") as f:
+            f.write(synctex)
+
+        utils.rewrite_synctex(gen_syn, out_syn, processed, self.dir_)
+
+        with gzip.open(out_syn, "rt") as f:
+            lines = f.read().split("\n")
+
+        self.assertEqual(
+            lines[1], "Input:1:{}".format((self.dir_ / "include.tex").as_posix())
+        )
+        self.assertEqual(
+            lines[2], "Input:2:{}".format((self.dir_ / "chapters/ch1.tex").as_posix())
+        )
+        self.assertEqual(lines[3], "Input:3:/usr/share/texmf/article.cls")
+        self.assertEqual(lines[5], "(1,8:100,200:300,400,500")
+        # line 4 of the output maps to line 3 of the chapter
+        self.assertEqual(lines[6], "h2,3:100,200:300,400,500")
+        self.assertEqual(lines[7], "x3,4:100,200")
+
+    def test_recursive_include(self):
+        texpp = TeXPreprocessor(self.dir_ / "include.tex")
+        texpp._source = b"\\input{include}"
+
+        with self.assertRaises(SyntaxError):
+            texpp.run()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import unittest
+from pathlib import Path
+import io
+import os
+import lzma
+import shutil
+import tarfile
+import tempfile
+from texenv import localrepo, tlpdb
+
+MIRROR_TLPDB = """name collection-foo
+category Collection
+revision 3
+depend foo
+
+name foo
+category Package
+revision 12
+relocated 1
+runfiles size=1
+ RELOC/tex/latex/foo/foo.sty
+ RELOC/tex/latex/foo/foo.cfg
+
+name foo.x86_64-linux
+category Package
+revision 12
+binfiles arch=x86_64-linux size=1
+ bin/x86_64-linux/foo
+
+"""
+
+
+class TestLocalRepo(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp())
+        self.env_cache = os.environ.get("TEXENV_CACHE_DIR")
+        os.environ["TEXENV_CACHE_DIR"] = str(self.tmp / "cache")
+        tlpdb._indexes.clear()
+
+        # mirror with a compressed database and the archives of a relocated package and a binary package. Like
+        # in tlnet, the archive of the relocated package stores its files relative to texmf-dist.
+        self.mirror = self.tmp / "tlnet"
+        (self.mirror / "tlpkg").mkdir(parents=True)
+        (self.mirror / "archive").mkdir()
+
+        with lzma.open(self.mirror / "tlpkg/texlive.tlpdb.xz", "wb") as f:
+            f.write(MIRROR_TLPDB.encode("utf-8"))
+
+        archives = {
+            "foo": [
+                ("tex/latex/foo/foo.sty", b"\\ProvidesPackage{foo}"),
+                ("tex/latex/foo/foo.cfg", b"% config"),
+                ("tlpkg/tlpobj/foo.tlpobj", b"name foo\n"),
+            ],
+            "foo.x86_64-linux": [
+                ("bin/x86_64-linux/foo", b"#!/bin/sh"),
+                ("tlpkg/tlpobj/foo.x86_64-linux.tlpobj", b"name foo.x86_64-linux\n"),
+            ],
+        }
+        for k, contents in archives.items():
+            with tarfile.open(self.mirror / "archive" / (k + ".tar.xz"), "w:xz") as tar:
+                for name, data in contents:
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+
+        # environment with one installed package
+        self.texdir = self.tmp / "venv/tex"
+        (self.texdir / "tlpkg").mkdir(parents=True)
+        (self.texdir / "tlpkg/texlive.tlpdb").write_text("name bar\nrevision 1\n\n")
+
+    def tearDown(self) -> None:
+        if self.env_cache is None:
+            del os.environ["TEXENV_CACHE_DIR"]
+        else:
+            os.environ["TEXENV_CACHE_DIR"] = self.env_cache
+
+        tlpdb._indexes.clear()
+        shutil.rmtree(self.tmp)
+
+    def test_install(self):
+        files, removed = localrepo.install(
+            self.mirror,
+            ["collection-foo", "foo", "foo.x86_64-linux"],
+            self.texdir,
+            max_workers=2,
+        )
+
+        self.assertEqual(
+            sorted(files),
+            [
+                "bin/x86_64-linux/foo",
+                "texmf-dist/tex/latex/foo/foo.cfg",
+                "texmf-dist/tex/latex/foo/foo.sty",
+            ],
+        )
+        self.assertEqual(removed, [])
+        self.assertEqual(
+            (self.texdir / "texmf-dist/tex/latex/foo/foo.sty").read_bytes(),
+            b"\\ProvidesPackage{foo}",
+        )
+        self.assertEqual(
+            (self.texdir / "bin/x86_64-linux/foo").read_bytes(), b"#!/bin/sh"
+        )
+        self.assertFalse((self.texdir / "tex").exists())
+        self.assertFalse((self.texdir / "tlpkg/tlpobj").exists())
+        self.assertFalse((self.texdir / "texmf-dist/tlpkg").exists())
+
+        installed = tlpdb.load(self.texdir / "tlpkg/texlive.tlpdb")
+        self.assertEqual(
+            sorted(installed), ["bar", "collection-foo", "foo", "foo.x86_64-linux"]
+        )
+        self.assertEqual(installed["foo"].revision, 12)
+        self.assertFalse(installed["foo"].relocated)
+        self.assertEqual(
+            installed["foo"].runfiles,
+            ["texmf-dist/tex/latex/foo/foo.sty", "texmf-dist/tex/latex/foo/foo.cfg"],
+        )
+        self.assertEqual(installed["collection-foo"].depends, ("foo",))
+
+    def test_upgrade(self):
+        """
+        Files of the installed revision that are not in the new revision are removed.
+        """
+        old_file = self.texdir / "texmf-dist/tex/latex/foo/foo-old.sty"
+        old_file.parent.mkdir(parents=True)
+        old_file.write_text("old")
+        (self.texdir / "tlpkg/texlive.tlpdb").write_text(
+            "name foo\nrevision 11\nrunfiles size=1\n texmf-dist/tex/latex/foo/foo-old.sty\n texmf-dist/tex/latex/foo/foo.sty\n\n"
+        )
+
+        files, removed = localrepo.install(self.mirror, ["foo"], self.texdir)
+
+        self.assertEqual(removed, ["texmf-dist/tex/latex/foo/foo-old.sty"])
+        self.assertFalse(old_file.exists())
+        self.assertEqual(
+            tlpdb.load(self.texdir / "tlpkg/texlive.tlpdb")["foo"].revision, 12
+        )
+
+    def test_linked_files(self):
+        """
+        Installed files replace hard links to the base installation instead of writing through them.
+        """
+        base_file = self.tmp / "base/foo.sty"
+        base_file.parent.mkdir()
+        base_file.write_text("base")
+
+        env_file = self.texdir / "texmf-dist/tex/latex/foo/foo.sty"
+        env_file.parent.mkdir(parents=True)
+        os.link(base_file, env_file)
+
+        localrepo.install(self.mirror, ["foo"], self.texdir)
+
+        self.assertEqual(base_file.read_text(), "base")
+        self.assertEqual(env_file.read_bytes(), b"\\ProvidesPackage{foo}")
+        self.assertEqual(os.stat(env_file).st_nlink, 1)
+
+    def test_unknown_package(self):
+        with self.assertRaises(ValueError):
+            localrepo.install(self.mirror, ["nopkg"], self.texdir)
+
+    def test_unrelocate(self):
+        self.assertEqual(
+            localrepo.unrelocate(
+                "revision 1\nrelocated 1\nrunfiles size=1\n RELOC/tex/a.sty\n"
+            ),
+            "revision 1\nrunfiles size=1\n texmf-dist/tex/a.sty\n",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
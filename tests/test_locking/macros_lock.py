@@ -0,0 +1,6 @@
+def title(text):
+    return r"\section{" + text + "}"
+
+
+def value(a, b):
+    return str(int(a) * int(b))
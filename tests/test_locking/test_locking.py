@@ -0,0 +1,138 @@
+import unittest
+from pathlib import Path
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from texenv import TeXPreprocessor
+from texenv.locking import FileLock, publish
+
+dir_ = Path(__file__).parent
+
+
+def _hold_lock(lock_path, log_path, n):
+    """Appends start and end markers to the log while holding the lock, runs in a separate process."""
+    for _ in range(n):
+        with FileLock(lock_path):
+            with open(log_path, "a") as f:
+                f.write("start\n")
+                f.flush()
+                time.sleep(0.005)
+                f.write("end\n")
+
+
+def _build(doc_path, build_dir, lock_path):
+    """Preprocesses the document while holding the build lock, runs in a separate process."""
+    with FileLock(lock_path):
+        texpp = TeXPreprocessor(doc_path, build_dir=build_dir)
+        outfile = texpp.run()
+        return (
+            Path(outfile).read_text(),
+            (Path(build_dir) / "chapters/ch1.tex").read_text(),
+        )
+
+
+class TestLocking(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp())
+        self.scratch = Path(tempfile.mkdtemp())
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp)
+        shutil.rmtree(self.scratch)
+
+    def test_lock_processes(self):
+        lock_path = self.tmp / "build/.texenv.lock"
+        log_path = self.tmp / "log.txt"
+
+        ctx = multiprocessing.get_context("spawn")
+        procs = [
+            ctx.Process(target=_hold_lock, args=(lock_path, log_path, 5))
+            for _ in range(4)
+        ]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+
+        # markers never interleave
+        lines = log_path.read_text().split()
+        self.assertEqual(lines, ["start", "end"] * 20)
+
+    def test_lock_timeout(self):
+        lock_path = self.tmp / ".texenv.lock"
+
+        with FileLock(lock_path):
+            with self.assertRaises(TimeoutError):
+                FileLock(lock_path, timeout=0.1).acquire()
+
+        # available again after release
+        with FileLock(lock_path, timeout=0.1):
+            pass
+
+    def test_publish(self):
+        """
+        Readers see either the old or the new file while many writers publish.
+        """
+        dst = self.tmp / "out.pdf"
+        contents = [bytes([i]) * 200000 for i in range(8)]
+        srcs = []
+        for i, data in enumerate(contents):
+            srcs.append(self.tmp / "src{}.pdf".format(i))
+            srcs[-1].write_bytes(data)
+
+        publish(srcs[0], dst)
+
+        done = threading.Event()
+        seen = []
+
+        def read():
+            while not done.is_set():
+                seen.append(dst.read_bytes())
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda src: publish(src, dst), srcs * 10))
+        done.set()
+        reader.join()
+
+        self.assertTrue(all(data in contents for data in seen))
+        self.assertEqual(list(self.tmp.glob(".*.tmp")), [])
+
+    def test_concurrent_builds(self):
+        """
+        Concurrent builds of the same document, serialized on the shared build directory or isolated in scratch
+        directories, all produce the complete output.
+        """
+        doc_path = self.tmp / "doc.tex"
+        shutil.copyfile(dir_ / "doc.tex", doc_path)
+        shutil.copyfile(dir_ / "macros_lock.py", self.tmp / "macros_lock.py")
+        shutil.copytree(dir_ / "chapters", self.tmp / "chapters")
+
+        lock_path = self.tmp / "build/.texenv.lock"
+        build_dirs = [self.tmp / "build"] * 6 + [
+            self.scratch / "doc-{}".format(i) for i in range(6)
+        ]
+
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(6) as pool:
+            results = pool.starmap(
+                _build, [(doc_path, d, lock_path) for d in build_dirs]
+            )
+
+        for (text, chapter), build_dir in zip(results, build_dirs):
+            self.assertIn(r"\section{Report}", text)
+            self.assertEqual(chapter.strip(), "Chapter one, 42.")
+
+            # includes are relative to the document folder, or absolute for scratch directories outside of it
+            if build_dir == self.tmp / "build":
+                self.assertIn(r"\input{build/chapters/ch1}", text)
+            else:
+                self.assertIn((build_dir / "chapters/ch1").resolve().as_posix(), text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from pathlib import Path
+import shutil
+import tempfile
+from texenv import lsr
+
+
+class TestLsR(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_ = Path(__file__).parent
+        self.tmp = Path(tempfile.mkdtemp())
+        self.lsr_path = self.tmp / "ls-R"
+        shutil.copyfile(self.dir_.parent / "test_preflight/ls-R", self.lsr_path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp)
+
+    def test_update(self):
+        db = lsr.read(self.lsr_path)
+        lsr.update(
+            db,
+            added=[
+                "tex/latex/foo/foo.sty",
+                "tex/latex/foo/foo.cfg",
+                "fonts/tfm/foo/foo.tfm",
+            ],
+        )
+
+        self.assertEqual(db["./tex/latex/foo"], ["foo.sty", "foo.cfg"])
+        self.assertIn("foo", db["./tex/latex"])
+        self.assertEqual(db["./fonts/tfm"], ["foo"])
+        self.assertEqual(db["./"], ["ls-R", "tex", "fonts"])
+
+        # adding an existing file doesn't duplicate it
+        lsr.update(db, added=["tex/latex/foo/foo.sty"])
+        self.assertEqual(db["./tex/latex/foo"], ["foo.sty", "foo.cfg"])
+
+        # empty directories are removed up to the root
+        lsr.update(
+            db,
+            removed=[
+                "fonts/tfm/foo/foo.tfm",
+                "tex/latex/foo/foo.cfg",
+                "tex/latex/missing.sty",
+            ],
+        )
+        self.assertNotIn("./fonts", db)
+        self.assertNotIn("./fonts/tfm/foo", db)
+        self.assertEqual(db["./"], ["ls-R", "tex"])
+        self.assertEqual(db["./tex/latex/foo"], ["foo.sty"])
+
+    def test_write(self):
+        lsr.update_file(
+            self.lsr_path,
+            added=["tex/latex/foo/foo.sty"],
+            removed=["tex/latex/base/size11.clo"],
+        )
+
+        with open(self.lsr_path) as f:
+            text = f.read()
+        self.assertTrue(text.startswith(lsr.HEADER + "\n./:\nls-R\ntex\n\n"))
+
+        db = lsr.read(self.lsr_path)
+        self.assertEqual(db["./tex/latex/base"], ["article.cls"])
+        self.assertEqual(db["./tex/latex/foo"], ["foo.sty"])
+
+    def test_create(self):
+        lsr_path = self.tmp / "new/ls-R"
+        lsr_path.parent.mkdir()
+        lsr.update_file(lsr_path, added=["tex/a.sty"])
+        self.assertEqual(lsr.read(lsr_path), {"./": ["tex"], "./tex": ["a.sty"]})
+
+    def test_verify(self):
+        db = lsr.read(self.lsr_path)
+        missing = lsr.verify(
+            db, ["tex/latex/base/article.cls", "tex/latex/foo/foo.sty", "ls-R"]
+        )
+        self.assertEqual(missing, ["tex/latex/foo/foo.sty"])
+
+
+if __name__ == "__main__":
+    unittest.main()
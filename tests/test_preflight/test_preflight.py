@@ -0,0 +1,120 @@
+import unittest
+from pathlib import Path
+import os
+import platform
+import shutil
+import tempfile
+from texenv import tlpdb, utils, lsr
+
+
+class TestPreflight(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_ = Path(__file__).parent
+        self.tmp = Path(tempfile.mkdtemp())
+
+        # environment with the packages of the test database available from tlmgr's copy of the remote database
+        self.venv = self.tmp / "venv"
+        (self.venv / "tex/tlpkg").mkdir(parents=True)
+        (self.venv / "tex/texmf-dist").mkdir(parents=True)
+        pdb_path = self.dir_.parent / "test_tlpdb/texlive.tlpdb"
+        shutil.copyfile(pdb_path, self.venv / "tex/tlpkg/texlive.tlpdb")
+        shutil.copyfile(pdb_path, self.venv / "tex/tlpkg/texlive.tlpdb.main.0123abcd")
+        shutil.copyfile(self.dir_ / "ls-R", self.venv / "tex/texmf-dist/ls-R")
+
+        self.env = dict(os.environ)
+        os.environ["TEXENV_CACHE_DIR"] = str(self.tmp / "cache")
+        os.environ["VIRTUAL_ENV"] = str(self.venv)
+        os.environ["PATH"] = (
+            "/usr/local/texlive/2024/bin/x86_64-linux" + os.pathsep + self.env["PATH"]
+        )
+        tlpdb._indexes.clear()
+
+    def tearDown(self) -> None:
+        os.environ.clear()
+        os.environ.update(self.env)
+        tlpdb._indexes.clear()
+        shutil.rmtree(self.tmp)
+
+    def test_requirements(self):
+        names = utils.find_tex_requirements([self.dir_ / "doc.tex"])
+        self.assertEqual(
+            names,
+            [
+                "article.cls",
+                "geometry.sty",
+                "amsmath.sty",
+                "amssymb.sty",
+                "iftex.sty",
+                "tikz.sty",
+            ],
+        )
+
+    def test_lsr_read(self):
+        db = lsr.read(self.dir_ / "ls-R")
+        self.assertEqual(db["./tex/latex/geometry"], ["geometry.sty", "geometry.cfg"])
+        self.assertEqual(db["./"], ["ls-R", "tex"])
+        self.assertIn("article.cls", lsr.names(db))
+
+    def test_preflight(self):
+        with self.assertRaises(RuntimeError) as cm:
+            utils.preflight([self.dir_ / "doc.tex"])
+
+        msg = str(cm.exception)
+        self.assertIn("amsmath.sty: texenv install amsmath", msg)
+        self.assertIn("iftex.sty: texenv install iftex", msg)
+        self.assertIn("amssymb.sty: texenv install amsfonts", msg)
+        self.assertIn("tikz.sty: not found", msg)
+        self.assertNotIn("geometry", msg)
+
+    def test_preflight_local_files(self):
+        """
+        Packages next to the document and files found by kpsewhich (i.e. on TEXMFHOME) are not reported.
+        """
+        doc_dir = self.tmp / "doc"
+        doc_dir.mkdir()
+        (doc_dir / "mystyle.sty").write_text("\\ProvidesPackage{mystyle}")
+        (doc_dir / "myclass.cls").write_text("\\ProvidesClass{myclass}")
+
+        # the preprocessed file is in the build folder, the local files are next to the source file
+        build_dir = doc_dir / "build"
+        build_dir.mkdir()
+        (build_dir / "doc.tex").write_text(
+            "\\documentclass{myclass}\n\\usepackage{geometry}\n\\usepackage{mystyle}\n\\usepackage{homestyle}\n"
+        )
+
+        with self.assertRaises(RuntimeError) as cm:
+            utils.preflight([build_dir / "doc.tex"], search_dirs=[doc_dir])
+
+        self.assertIn("homestyle.sty: not found", str(cm.exception))
+        self.assertNotIn("mystyle", str(cm.exception))
+        self.assertNotIn("myclass", str(cm.exception))
+
+        if platform.system() == "Windows":
+            return
+
+        # kpsewhich of the environment that finds homestyle.sty on TEXMFHOME
+        kpsewhich = utils.get_env_texpath() / "kpsewhich"
+        kpsewhich.parent.mkdir(parents=True)
+        kpsewhich.write_text(
+            "#!/bin/sh\n"
+            'for f in "$@"; do\n'
+            '  [ "$f" = homestyle.sty ] && echo /home/user/texmf/tex/latex/homestyle.sty\n'
+            "done\n"
+            "exit 1\n"
+        )
+        os.chmod(kpsewhich, 0o755)
+
+        utils.preflight([build_dir / "doc.tex"], search_dirs=[doc_dir])
+
+    def test_preflight_no_lsr(self):
+        os.remove(self.venv / "tex/texmf-dist/ls-R")
+        utils.preflight([self.dir_ / "doc.tex"])
+
+    def test_providers(self):
+        index = tlpdb.parse(self.dir_.parent / "test_tlpdb/texlive.tlpdb")
+        self.assertEqual(index.providers("geometry.sty"), ["geometry"])
+        self.assertEqual(index.providers("missing.sty"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
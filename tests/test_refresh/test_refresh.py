@@ -0,0 +1,151 @@
+import unittest
+from unittest import mock
+from pathlib import Path
+import os
+import platform
+import shutil
+import tempfile
+from texenv import fileops, lsr, packages, tlpdb, utils
+
+BASE_TLPDB = """name a
+revision 2
+runfiles size=1
+ texmf-dist/tex/latex/a/a.sty
+ texmf-dist/tex/latex/a/a2.sty
+
+name b
+revision 1
+runfiles size=1
+ texmf-dist/tex/latex/b/b.sty
+
+"""
+
+ENV_TLPDB = """name a
+revision 1
+runfiles size=1
+ texmf-dist/tex/latex/a/a.sty
+ texmf-dist/tex/latex/a/a-old.sty
+
+name b
+revision 1
+runfiles size=1
+ texmf-dist/tex/latex/b/b.sty
+
+name user
+revision 5
+runfiles size=1
+ texmf-dist/tex/latex/user/user.sty
+
+"""
+
+
+class TestRefresh(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp())
+        self.base = self.tmp / "texlive/2024"
+        self.texdir = self.tmp / "venv/tex"
+
+        self.env = dict(os.environ)
+        os.environ["TEXENV_CACHE_DIR"] = str(self.tmp / "cache")
+        os.environ["VIRTUAL_ENV"] = str(self.tmp / "venv")
+        tlpdb._indexes.clear()
+
+        for root, files in [
+            (self.base, {"a/a.sty": "a v2", "a/a2.sty": "a2", "b/b.sty": "b"}),
+            (
+                self.texdir,
+                {
+                    "a/a.sty": "a v1",
+                    "a/a-old.sty": "old",
+                    "b/b.sty": "b",
+                    "user/user.sty": "user",
+                },
+            ),
+        ]:
+            (root / "tlpkg").mkdir(parents=True)
+            (root / "texmf-var/web2c").mkdir(parents=True)
+            for name, text in files.items():
+                (root / "texmf-dist/tex/latex" / name).parent.mkdir(
+                    parents=True, exist_ok=True
+                )
+                (root / "texmf-dist/tex/latex" / name).write_text(text)
+
+        (self.base / "tlpkg/texlive.tlpdb").write_text(BASE_TLPDB)
+        (self.texdir / "tlpkg/texlive.tlpdb").write_text(ENV_TLPDB)
+        (self.base / "texmf-var/web2c/pdftex.fmt").write_text("format")
+
+        # b is unchanged in the environment
+        shutil.copy2(
+            self.base / "texmf-dist/tex/latex/b/b.sty",
+            self.texdir / "texmf-dist/tex/latex/b/b.sty",
+        )
+
+        files = [
+            p.relative_to(self.texdir / "texmf-dist").as_posix()
+            for p in self.texdir.rglob("*.sty")
+        ]
+        lsr.update_file(self.texdir / "texmf-dist/ls-R", files)
+
+    def tearDown(self) -> None:
+        os.environ.clear()
+        os.environ.update(self.env)
+        tlpdb._indexes.clear()
+        shutil.rmtree(self.tmp)
+
+    def test_refresh(self):
+        with mock.patch.dict(packages.install_pkgs, {platform.system(): ["a", "b"]}):
+            result = utils.texenv_refresh(self.base, "x86_64-linux", self.texdir)
+
+        self.assertEqual(result, dict(packages=["a"], copied=2, removed=1))
+
+        latex = self.texdir / "texmf-dist/tex/latex"
+        self.assertEqual((latex / "a/a.sty").read_text(), "a v2")
+        self.assertEqual((latex / "a/a2.sty").read_text(), "a2")
+        self.assertFalse((latex / "a/a-old.sty").exists())
+        # user packages are kept
+        self.assertEqual((latex / "user/user.sty").read_text(), "user")
+        self.assertEqual(
+            (self.texdir / "texmf-var/web2c/pdftex.fmt").read_text(), "format"
+        )
+
+        installed = tlpdb.load(self.texdir / "tlpkg/texlive.tlpdb")
+        self.assertEqual(sorted(installed), ["a", "b", "user"])
+        self.assertEqual(installed["a"].revision, 2)
+        self.assertEqual(installed["user"].revision, 5)
+
+        db = lsr.read(self.texdir / "texmf-dist/ls-R")
+        self.assertEqual(sorted(db["./tex/latex/a"]), ["a.sty", "a2.sty"])
+        self.assertEqual(utils.read_env_config()["base_texpath"], str(self.base))
+
+        # nothing changes on a second refresh
+        with mock.patch.dict(packages.install_pkgs, {platform.system(): ["a", "b"]}):
+            result = utils.texenv_refresh(self.base, "x86_64-linux", self.texdir)
+
+        self.assertEqual(result, dict(packages=[], copied=0, removed=0))
+
+    def test_refresh_link_mode(self):
+        # init --refresh uses the link mode the environment was created with
+        utils.write_env_config(dict(link="symlink"))
+
+        with mock.patch.object(
+            utils, "get_base_texpath", return_value=(self.base, "x86_64-linux")
+        ), mock.patch.object(utils, "texenv_refresh") as refresh:
+            utils.texenv_init(refresh=True)
+            refresh.assert_called_once_with(
+                self.base, "x86_64-linux", self.texdir, "symlink"
+            )
+
+            refresh.reset_mock()
+            utils.texenv_init(link="hard", refresh=True)
+            refresh.assert_called_once_with(
+                self.base, "x86_64-linux", self.texdir, "hard"
+            )
+
+    def test_changed_files(self):
+        plan = fileops.plan_files(self.base, self.texdir, ["texmf-dist/tex/latex"])
+        changed = [dst.name for _, dst, _ in fileops.changed_files(plan)]
+        self.assertEqual(sorted(changed), ["a.sty", "a2.sty"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,340 @@
+import unittest
+from pathlib import Path
+import shutil
+import subprocess
+import tempfile
+from unittest import mock
+import numpy as np
+from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
+from click.testing import CliRunner
+from texenv import Presentation, utils, telemetry
+from texenv.runner import cli
+
+
+def make_figure(i):
+    fig, ax = plt.subplots(figsize=(4, 3))
+    ax.plot(np.arange(10), np.arange(10) * i)
+    ax.set_title("figure {}".format(i))
+    return fig
+
+
+def make_unpicklable_figure():
+    fig, ax = plt.subplots(figsize=(4, 3))
+    ax.plot(np.arange(10))
+    ax.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: "{:.0f} s".format(x)))
+    return fig
+
+
+class FakeTeX(object):
+    """Records the pdflatex and pdftex runs and writes a PDF for each, without running TeX."""
+
+    def __init__(self):
+        self.runs = []
+
+    def __call__(self, command, cwd=None, timeout=None):
+        program, texname = command.split("//")[1].split()[0], command.split()[-1]
+        self.runs.append((program, texname))
+
+        with open(Path(cwd) / texname) as f:
+            tex = f.read()
+        (Path(cwd) / texname).with_suffix(".pdf").write_text("%PDF-" + tex)
+        return subprocess.CompletedProcess(command, 0, b"")
+
+    def compiled(self):
+        # slides are compiled in parallel, so the order of the runs is not fixed
+        return sorted(
+            texname for program, texname in self.runs if program == "pdflatex"
+        )
+
+
+class TestSlides(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp())
+
+    def tearDown(self) -> None:
+        plt.close("all")
+        shutil.rmtree(self.tmp)
+
+    def figure_files(self, pres):
+        return sorted(
+            p.relative_to(pres.build_dir).as_posix()
+            for p in pres.build_dir.rglob("*.pdf")
+        )
+
+    def test_deferred_figures(self):
+        """
+        Deferred figures are rendered by save() with the same file names as figures saved by add_slide.
+        """
+        inline = Presentation(self.tmp / "inline.pdf")
+        deferred = Presentation(self.tmp / "deferred.pdf", deferred=True)
+
+        for pres in (inline, deferred):
+            pres.add_slide([make_figure(0), make_figure(1)], title="first")
+            pres.add_slide([[make_figure(2)], ["text"]], title="second")
+
+        # figures are saved in the cache by their fingerprint
+        self.assertEqual(len(self.figure_files(inline)), 3)
+        self.assertTrue(
+            all(name.startswith("cache/figures/") for name in self.figure_files(inline))
+        )
+        self.assertEqual(self.figure_files(deferred), [])
+        # the slide data doesn't depend on the mode
+        self.assertEqual(inline.data, deferred.data)
+
+        deferred.render_figures()
+        self.assertEqual(self.figure_files(deferred), self.figure_files(inline))
+
+        for name in self.figure_files(deferred):
+            self.assertEqual((deferred.build_dir / name).read_bytes()[:5], b"%PDF-")
+
+        # figures are only rendered once
+        deferred.render_figures()
+        self.assertEqual(deferred._pending_figures, [])
+
+    def test_figure_writer(self):
+        """
+        Deferred figures are rendered with the given pool, which stays open for the next presentation.
+        """
+        writer = utils.FigureWriter(max_workers=2)
+        try:
+            for n in range(2):
+                pres = Presentation(
+                    self.tmp / "pres{}.pdf".format(n),
+                    deferred=True,
+                    figure_writer=writer,
+                )
+                pres.add_slide([make_figure(i) for i in range(3)])
+                pres.render_figures()
+
+                self.assertEqual(len(self.figure_files(pres)), 3)
+        finally:
+            writer.close()
+
+    def test_figure_cache(self):
+        """
+        Figures that are unchanged since the last run are not saved again.
+        """
+        saved = []
+        savefig = Figure.savefig
+
+        def count_savefig(fig, *args, **kwargs):
+            saved.append(fig)
+            return savefig(fig, *args, **kwargs)
+
+        tex = FakeTeX()
+        with mock.patch("texenv.utils.run_command", tex), mock.patch(
+            "texenv.utils.get_env_texpath", lambda: self.tmp
+        ):
+            with mock.patch.object(Figure, "savefig", count_savefig):
+                # only the figure that can't be pickled is saved again by the later runs
+                for deferred, n_saved in [(False, 3), (True, 1), (False, 1)]:
+                    saved.clear()
+                    pres = Presentation(
+                        self.tmp / "deck.pdf",
+                        deferred=deferred,
+                        figure_writer=utils.FigureWriter(),
+                    )
+                    # the same figure twice, and a figure that can't be pickled
+                    pres.add_slide([make_figure(1), make_figure(2)])
+                    pres.add_slide([make_figure(1), make_unpicklable_figure()])
+                    pres.save()
+
+                    self.assertEqual(len(saved), n_saved)
+
+                # a changed figure is saved, figures that are no longer used are removed after the save
+                saved.clear()
+                pres = Presentation(self.tmp / "deck.pdf")
+                pres.add_slide([make_figure(1), make_figure(3)])
+                self.assertEqual(len(saved), 1)
+
+                cached = sorted((self.tmp / "deck_build/cache/figures").glob("*.pdf"))
+                self.assertEqual(len(cached), 3)
+                pres.save()
+                cached = sorted((self.tmp / "deck_build/cache/figures").glob("*.pdf"))
+                self.assertEqual(len(cached), 2)
+
+        # the cache and the stats survive clean
+        self.assertEqual(
+            sorted(p.name for p in (self.tmp / "deck_build").iterdir()),
+            ["cache", telemetry.STATS_NAME],
+        )
+
+    def test_image_dedup(self):
+        """
+        Images with the same content are copied to the build directory once and referenced from every slide.
+        """
+        plt.imsave(self.tmp / "logo.png", np.eye(8))
+        plt.imsave(self.tmp / "other.png", np.ones((8, 8)))
+        shutil.copyfile(self.tmp / "logo.png", self.tmp / "logo_copy.png")
+
+        pres = Presentation(self.tmp / "deck.pdf")
+        for name in ["logo.png", "logo.png", "logo_copy.png", "other.png"]:
+            pres.add_slide([self.tmp / name, "text"])
+
+        images = sorted(
+            p.name for p in (self.tmp / "deck_build/cache/images").iterdir()
+        )
+        self.assertEqual(len(images), 2)
+        self.assertTrue(all(name.endswith(".png") for name in images))
+
+        references = [
+            s[s.index("\\includegraphics") :].split("}")[0] for s in pres._slides
+        ]
+        self.assertEqual(len(set(references[:3])), 1)
+        self.assertNotEqual(references[0], references[3])
+
+        # images that are no longer used are removed after the save
+        tex = FakeTeX()
+        with mock.patch("texenv.utils.run_command", tex), mock.patch(
+            "texenv.utils.get_env_texpath", lambda: self.tmp
+        ):
+            pres = Presentation(self.tmp / "deck.pdf")
+            pres.add_slide([self.tmp / "other.png"])
+            pres.save(clean=False)
+
+        self.assertEqual(len(list((self.tmp / "deck_build/cache/images").iterdir())), 1)
+
+    def test_image_downsampling(self):
+        """
+        Images with more pixels than the slide resolution are downsampled to the size of their minipage by save().
+        """
+        from PIL import Image
+
+        Image.new("RGB", (4000, 3000), "red").save(self.tmp / "photo.jpg")
+        Image.new("RGB", (40, 30), "blue").save(self.tmp / "icon.png")
+
+        tex = FakeTeX()
+        with mock.patch("texenv.utils.run_command", tex), mock.patch(
+            "texenv.utils.get_env_texpath", lambda: self.tmp
+        ):
+            pres = Presentation(self.tmp / "deck.pdf", image_dpi=100)
+            pres.add_slide([self.tmp / "photo.jpg", "text"])
+            pres.add_slide([self.tmp / "photo.jpg", self.tmp / "icon.png"])
+            pres.save(clean=False)
+
+        sizes = {}
+        for filepath in (self.tmp / "deck_build/cache/images").iterdir():
+            with Image.open(filepath) as img:
+                sizes[filepath.name] = img.size
+
+        # one downsampled copy of the photo, which is shown at the same size on both slides, and the icon as it is
+        self.assertEqual(len(sizes), 2)
+        (photo,) = [name for name in sizes if name.endswith(".jpg")]
+        (icon,) = [name for name in sizes if name.endswith(".png")]
+        self.assertEqual(sizes[icon], (40, 30))
+        self.assertIn("-{}x{}.jpg".format(*sizes[photo]), photo)
+        self.assertLess(sizes[photo][0], 4000)
+        self.assertAlmostEqual(sizes[photo][0] / sizes[photo][1], 4 / 3, places=2)
+
+        # the photo fills the width of its column at 100 pixels per inch
+        references = [
+            s[s.index("\\includegraphics") :].split("}")[0] for s in pres._slides
+        ]
+        width = float(references[0].split("width=")[1].split("in")[0])
+        self.assertEqual(sizes[photo][0], round(width * 100))
+
+        # downsampling can be turned off
+        pres = Presentation(self.tmp / "deck.pdf", image_dpi=None)
+        pres.add_slide([self.tmp / "photo.jpg", "text"])
+        reference = pres._slides[0].split("{cache/images/")[1].split("}")[0]
+        with Image.open(
+            self.tmp / "deck_build/cache/images" / (reference + ".jpg")
+        ) as img:
+            self.assertEqual(img.size, (4000, 3000))
+
+    def test_stats(self):
+        """
+        The phase timings are kept in the build folder of the presentation, also when it is cleaned.
+        """
+        tex = FakeTeX()
+        with mock.patch("texenv.utils.run_command", tex), mock.patch(
+            "texenv.utils.get_env_texpath", lambda: self.tmp
+        ):
+            for n in range(2):
+                pres = Presentation(self.tmp / "deck.pdf")
+                pres.add_slide([make_figure(1), "text"])
+                pres.save(clean=True)
+
+        records = telemetry.read_stats(
+            self.tmp / "deck_build" / telemetry.STATS_NAME, "deck"
+        )
+        self.assertEqual(len(records), 2)
+        self.assertIn("pdflatex", records[-1]["phases"])
+        self.assertFalse((self.tmp / "build").exists())
+        self.assertEqual(
+            sorted(p.name for p in (self.tmp / "deck_build").iterdir()),
+            ["cache", telemetry.STATS_NAME],
+        )
+
+        # texenv stats finds the stats of presentations in the folder
+        result = CliRunner().invoke(cli, ["stats", str(self.tmp)])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("deck: 2 builds, 0 failed", result.output)
+
+    def make_presentation(self, titles, figure_scale=1):
+        pres = Presentation(self.tmp / "deck.pdf", incremental=True, max_workers=2)
+        for i, title in enumerate(titles):
+            pres.add_slide(
+                [make_figure(i * figure_scale), "text {}".format(i)], title=title
+            )
+        return pres
+
+    def test_incremental(self):
+        """
+        Only slides whose LaTeX code or figures changed are compiled again, the cache survives clean.
+        """
+        tex = FakeTeX()
+        with mock.patch("texenv.utils.run_command", tex), mock.patch(
+            "texenv.utils.get_env_texpath", lambda: self.tmp
+        ):
+            self.make_presentation(["a", "b", "c"]).save()
+
+            self.assertEqual(
+                tex.compiled(),
+                ["deck-slide0.tex", "deck-slide1.tex", "deck-slide2.tex"],
+            )
+            self.assertEqual(tex.runs[-1], ("pdftex", "deck.tex"))
+            self.assertEqual(
+                len(list((self.tmp / "deck_build/cache/slides").glob("*.pdf"))), 3
+            )
+            # clean keeps only the cache and the stats
+            self.assertEqual(
+                sorted(p.name for p in (self.tmp / "deck_build").iterdir()),
+                ["cache", telemetry.STATS_NAME],
+            )
+
+            # the output joins the pages of the slides in order
+            output = (self.tmp / "deck.pdf").read_text()
+            slides = [ln for ln in output.splitlines() if ln.startswith("\\slide{")]
+            self.assertEqual(len(slides), 3)
+            self.assertTrue(output.strip().endswith("\\bye"))
+
+            # nothing changed
+            tex.runs = []
+            self.make_presentation(["a", "b", "c"]).save(clean=False)
+            self.assertEqual(tex.compiled(), [])
+
+            # a new title on the second slide, and a new figure on the third slide
+            tex.runs = []
+            pres = Presentation(self.tmp / "deck.pdf", incremental=True)
+            pres.add_slide([make_figure(0), "text 0"], title="a")
+            pres.add_slide([make_figure(1), "text 1"], title="changed")
+            pres.add_slide([make_figure(5), "text 2"], title="c")
+            pres.save()
+            self.assertEqual(tex.compiled(), ["deck-slide1.tex", "deck-slide2.tex"])
+
+            # slides that are no longer used are removed from the cache
+            self.assertEqual(
+                len(list((self.tmp / "deck_build/cache/slides").glob("*.pdf"))), 3
+            )
+
+            # each slide is numbered as in the full presentation
+            slide_tex = pres._slide_tex(2)
+            self.assertIn("\\setcounter{page}{3}", slide_tex)
+            self.assertTrue(slide_tex.endswith("\\end{document}"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from pathlib import Path
+import os
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# the startup time is measured by benchmarks/bench_startup.py
+SCRIPT = """
+import sys
+from texenv.runner import cli
+
+cli(["list"], standalone_mode=False)
+print("matplotlib" in sys.modules)
+"""
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_ = Path(__file__).parent
+        self.tmp = Path(tempfile.mkdtemp())
+
+        # environment created by texenv init, with a config file so the PATH is not searched
+        self.venv = self.tmp / "venv"
+        (self.venv / "tex/tlpkg").mkdir(parents=True)
+        shutil.copyfile(
+            self.dir_.parent / "test_tlpdb/texlive.tlpdb",
+            self.venv / "tex/tlpkg/texlive.tlpdb",
+        )
+
+        with open(self.venv / "tex/texenv.json", "w") as f:
+            json.dump(
+                dict(
+                    base_texpath="/usr/local/texlive/2024",
+                    platform="x86_64-linux",
+                    env_texpath=str(self.venv / "tex/bin/x86_64-linux"),
+                ),
+                f,
+            )
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp)
+
+    def test_list(self):
+        env = dict(os.environ)
+        env["VIRTUAL_ENV"] = str(self.venv)
+        env["TEXENV_CACHE_DIR"] = str(self.tmp / "cache")
+        env["PYTHONPATH"] = (
+            str(self.dir_.parents[1]) + os.pathsep + env.get("PYTHONPATH", "")
+        )
+
+        proc = subprocess.run(
+            [sys.executable, "-c", SCRIPT],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+        )
+        lines = proc.stdout.decode("utf-8").split()
+
+        # packages of the test database that are not base packages
+        self.assertIn("pdftex.windows", lines[:-1])
+
+        # heavy modules are only imported by the commands that use them
+        self.assertEqual(lines[-1], "False")
+
+
+if __name__ == "__main__":
+    unittest.main()
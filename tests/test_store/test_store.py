@@ -0,0 +1,104 @@
+import unittest
+from pathlib import Path
+import os
+import shutil
+import tempfile
+from texenv import fileops
+from texenv.store import Store
+
+
+class TestStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp())
+        self.src = self.tmp / "base"
+        self.store = Store(self.tmp / "store")
+
+        (self.src / "bin/x86_64-linux").mkdir(parents=True)
+        (self.src / "texmf-dist/tex/latex/pkg").mkdir(parents=True)
+
+        (self.src / "bin/x86_64-linux/pdftex").write_text("binary")
+        os.chmod(self.src / "bin/x86_64-linux/pdftex", 0o755)
+        (self.src / "texmf-dist/tex/latex/pkg/pkg.sty").write_text("style")
+        # same content as pkg.sty, stored once
+        (self.src / "texmf-dist/tex/latex/pkg/copy.sty").write_text("style")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp)
+
+    def populate(self, name):
+        dst = self.tmp / name
+        plan = fileops.plan_files(
+            self.src, dst, ["bin/x86_64-linux/pdftex"], binary=True
+        ) + fileops.plan_files(self.src, dst, ["texmf-dist"])
+        return dst, fileops.execute(plan, mode="store", store=self.store)
+
+    def objects(self):
+        return sorted(p for p in self.store.objects.rglob("*") if p.is_file())
+
+    def test_populate(self):
+        env1, stats = self.populate("env1")
+        env2, _ = self.populate("env2")
+
+        self.assertEqual(stats["files"], 3)
+        self.assertEqual(stats["fallbacks"], 0)
+        self.assertEqual(len(self.objects()), 2)
+
+        sty1 = env1 / "texmf-dist/tex/latex/pkg/pkg.sty"
+        sty2 = env2 / "texmf-dist/tex/latex/pkg/copy.sty"
+        self.assertEqual(sty1.read_text(), "style")
+        self.assertEqual(os.stat(sty1).st_ino, os.stat(sty2).st_ino)
+
+        # the executable bit is kept, write permissions are removed from shared objects
+        mode = os.stat(env2 / "bin/x86_64-linux/pdftex").st_mode
+        self.assertTrue(mode & 0o100)
+        self.assertFalse(mode & 0o222)
+
+    def test_hash_cache(self):
+        self.populate("env1")
+        self.assertTrue(self.store._hashes_path.exists())
+
+        # a new store instance reuses the saved hashes of unchanged files
+        store = Store(self.store.root)
+        key = str((self.src / "texmf-dist/tex/latex/pkg/pkg.sty").resolve())
+        self.assertIn(key, store._load_hashes())
+
+        # changed files are hashed again
+        (self.src / "texmf-dist/tex/latex/pkg/pkg.sty").write_text("changed style")
+        self.assertNotEqual(
+            store.file_hash(self.src / "texmf-dist/tex/latex/pkg/pkg.sty"),
+            store.file_hash(self.src / "texmf-dist/tex/latex/pkg/copy.sty"),
+        )
+
+    def test_gc(self):
+        env1, _ = self.populate("env1")
+        env2, _ = self.populate("env2")
+
+        stats = self.store.gc()
+        self.assertEqual(stats["removed"], 0)
+        self.assertEqual(stats["remaining"], 2)
+
+        shutil.rmtree(env1)
+        self.assertEqual(self.store.gc()["removed"], 0)
+
+        shutil.rmtree(env2)
+        stats = self.store.gc()
+        self.assertEqual(stats["removed"], 2)
+        self.assertEqual(stats["bytes"], len("binary") + len("style"))
+        self.assertEqual(self.objects(), [])
+
+    def test_absorb(self):
+        env = self.tmp / "env"
+        shutil.copytree(self.src, env)
+        (env / "texmf-dist/tex/latex/pkg/new.sty").write_text("new")
+
+        self.assertEqual(self.store.absorb(env), 4)
+        self.assertEqual(len(self.objects()), 3)
+        self.assertEqual((env / "texmf-dist/tex/latex/pkg/new.sty").read_text(), "new")
+        self.assertEqual(os.stat(env / "texmf-dist/tex/latex/pkg/new.sty").st_nlink, 2)
+
+        # linked files are skipped
+        self.assertEqual(self.store.absorb(env), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+from pathlib import Path
+import os
+import json
+import shutil
+import tempfile
+from unittest import mock
+from texenv import tlpdb, utils
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_ = Path(__file__).parent
+        self.tmp = Path(tempfile.mkdtemp())
+
+        # environment with all packages of the test database installed
+        self.venv = self.tmp / "venv"
+        (self.venv / "tex/tlpkg").mkdir(parents=True)
+        pdb_path = self.dir_.parent / "test_tlpdb/texlive.tlpdb"
+        shutil.copyfile(pdb_path, self.venv / "tex/tlpkg/texlive.tlpdb")
+        shutil.copyfile(pdb_path, self.venv / "tex/tlpkg/texlive.tlpdb.main.0123abcd")
+
+        self.env = dict(os.environ)
+        os.environ["TEXENV_CACHE_DIR"] = str(self.tmp / "cache")
+        os.environ["VIRTUAL_ENV"] = str(self.venv)
+        os.environ["PATH"] = (
+            "/usr/local/texlive/2024/bin/x86_64-linux" + os.pathsep + self.env["PATH"]
+        )
+        tlpdb._indexes.clear()
+
+        self.requirements = self.tmp / "texrequirements.txt"
+        self.requirements.write_text("geometry\npdftex.windows 73848 12kB\n")
+        self.lockfile = self.tmp / "texrequirements.lock"
+
+    def tearDown(self) -> None:
+        os.environ.clear()
+        os.environ.update(self.env)
+        tlpdb._indexes.clear()
+        shutil.rmtree(self.tmp)
+
+    def test_lockfile(self):
+        output = utils.sync_from_file(self.requirements, lockfile=self.lockfile)
+        self.assertEqual(output, "All packages are already installed.")
+
+        with open(self.lockfile) as f:
+            lock = json.load(f)
+
+        # the lock has the revisions of the dependency closure
+        self.assertEqual(lock["packages"]["geometry"], 61719)
+        self.assertIn("atbegshi", lock["packages"])
+        self.assertIn("pdftex.windows", lock["packages"])
+
+        # unchanged requirements and environment
+        output = utils.sync_from_file(self.requirements, lockfile=self.lockfile)
+        self.assertEqual(output, "Environment is up to date.")
+
+        # the order of the requirements doesn't matter
+        self.requirements.write_text("pdftex.windows\ngeometry\n")
+        output = utils.sync_from_file(self.requirements, lockfile=self.lockfile)
+        self.assertEqual(output, "Environment is up to date.")
+
+        # changed requirements are synced again
+        self.requirements.write_text("geometry\n")
+        output = utils.sync_from_file(self.requirements, lockfile=self.lockfile)
+        self.assertEqual(output, "All packages are already installed.")
+
+        # packages that are not required don't change the sync, unless they are pruned
+        with open(self.venv / "tex/tlpkg/texlive.tlpdb", "a") as f:
+            f.write("\nname newpkg\nrevision 1\n")
+        output = utils.sync_from_file(self.requirements, lockfile=self.lockfile)
+        self.assertEqual(output, "Environment is up to date.")
+
+        with mock.patch("texenv.utils.run_tlmgr", return_value="removed") as run_tlmgr:
+            output = utils.sync_from_file(
+                self.requirements, lockfile=self.lockfile, prune=True
+            )
+        self.assertIn("newpkg", run_tlmgr.call_args[0][0].split())
+
+    def test_lockfile_other_machine(self):
+        """
+        A lockfile written on another machine matches an environment with the same package revisions.
+        """
+        utils.sync_from_file(self.requirements, lockfile=self.lockfile)
+
+        # a fresh environment with the same packages, i.e. on a CI runner
+        pdb_path = self.venv / "tex/tlpkg/texlive.tlpdb"
+        pdb_path.write_text(pdb_path.read_text() + "\n")
+        tlpdb._indexes.clear()
+
+        output = utils.sync_from_file(self.requirements, lockfile=self.lockfile)
+        self.assertEqual(output, "Environment is up to date.")
+
+        # a locked package at a different revision is synced again
+        with open(self.lockfile) as f:
+            lock = json.load(f)
+        lock["packages"]["geometry"] = 1
+        with open(self.lockfile, "w") as f:
+            json.dump(lock, f)
+
+        output = utils.sync_from_file(self.requirements, lockfile=self.lockfile)
+        self.assertEqual(output, "All packages are already installed.")
+
+
+if __name__ == "__main__":
+    unittest.main()
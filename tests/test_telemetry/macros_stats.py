@@ -0,0 +1,2 @@
+def title(text):
+    return r"\section{" + text + "}"
@@ -0,0 +1,165 @@
+import unittest
+from pathlib import Path
+import contextlib
+import gzip
+import re
+import shutil
+import subprocess
+import tempfile
+from unittest import mock
+from texenv import telemetry
+from texenv.runner import build_document
+
+dir_ = Path(__file__).parent
+
+
+def fake_pdflatex(command, cwd=None, timeout=None):
+    """Writes the PDF and synctex file where pdflatex would, without running it."""
+    build_dir = Path(re.search(r'--output-directory="([^"]+)"', command).group(1))
+    (build_dir / "doc.pdf").write_bytes(b"%PDF-1.5")
+    with gzip.open(build_dir / "doc.synctex.gz", "wt") as f:
+        f.write(
+            "SyncTeX Version:1\nInput:1:{}\n".format((build_dir / "doc.tex").as_posix())
+        )
+    return subprocess.CompletedProcess(command, 0, b"")
+
+
+class TestTelemetry(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp())
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp)
+
+    def test_timeline(self):
+        spans = []
+
+        @contextlib.contextmanager
+        def hook(name, attributes):
+            spans.append(("start", name, attributes))
+            try:
+                yield
+            finally:
+                spans.append(("end", name))
+
+        telemetry.add_span_hook(hook)
+        try:
+            timeline = telemetry.Timeline("doc")
+            with timeline.phase("figures", slide=1):
+                pass
+            with timeline.phase("figures", slide=2):
+                pass
+            with self.assertRaises(RuntimeError):
+                with timeline.phase("pdflatex"):
+                    raise RuntimeError("failed")
+        finally:
+            telemetry.remove_span_hook(hook)
+
+        # repeated phases are added up
+        self.assertEqual(list(timeline.phases), ["figures", "pdflatex"])
+        self.assertEqual(timeline.status, "error")
+
+        self.assertEqual(spans[0], ("start", "figures", dict(slide=1, document="doc")))
+        self.assertEqual(
+            [s[:2] for s in spans[1:]],
+            [
+                ("end", "figures"),
+                ("start", "figures"),
+                ("end", "figures"),
+                ("start", "pdflatex"),
+                ("end", "pdflatex"),
+            ],
+        )
+
+        timeline.write(self.tmp)
+        with open(self.tmp / telemetry.STATS_NAME, "a") as f:
+            # interrupted write
+            f.write('{"time": 1')
+
+        records = telemetry.read_stats(self.tmp / telemetry.STATS_NAME)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]["status"], "error")
+        self.assertEqual(
+            telemetry.read_stats(self.tmp / telemetry.STATS_NAME, "other"), []
+        )
+
+    def test_regressions(self):
+        records = [
+            dict(
+                document="doc",
+                status="ok",
+                total=1.0 + 0.01 * i,
+                phases=dict(preprocess=0.2, pdflatex=0.8),
+            )
+            for i in range(12)
+        ]
+        self.assertEqual(telemetry.regressions(records), [])
+
+        # failed builds are not compared
+        records.append(
+            dict(
+                document="doc",
+                status="error",
+                total=9.0,
+                phases=dict(preprocess=0.2, pdflatex=8.8),
+            )
+        )
+        self.assertEqual(telemetry.regressions(records), [])
+
+        records.append(
+            dict(
+                document="doc",
+                status="ok",
+                total=1.6,
+                phases=dict(preprocess=0.2, pdflatex=1.4),
+            )
+        )
+        found = telemetry.regressions(records)
+        self.assertEqual([name for name, _, _ in found], ["pdflatex", "total"])
+        self.assertAlmostEqual(found[0][2], 0.8)
+
+        text = telemetry.format_stats(records)
+        self.assertIn("14 builds, 1 failed", text)
+        self.assertRegex(text, r"pdflatex .* regressed, 75% slower than median")
+        self.assertNotRegex(text, r"preprocess .* regressed")
+
+    def test_build_stats(self):
+        """
+        Each build appends the phase timings to the stats file in the build directory.
+        """
+        filepath = self.tmp / "doc.tex"
+        shutil.copyfile(dir_ / "doc.tex", filepath)
+        shutil.copyfile(dir_ / "macros_stats.py", self.tmp / "macros_stats.py")
+
+        with mock.patch("texenv.utils.run_command", fake_pdflatex), mock.patch(
+            "texenv.utils.preflight"
+        ):
+            for isolated in (False, True):
+                timeline = telemetry.Timeline("doc")
+                out_pdf = build_document(
+                    filepath, self.tmp, isolated=isolated, timeline=timeline
+                )
+                timeline.write(self.tmp / "build")
+
+                self.assertEqual(out_pdf.read_bytes(), b"%PDF-1.5")
+
+        records = telemetry.read_stats(self.tmp / "build" / telemetry.STATS_NAME, "doc")
+        self.assertEqual(len(records), 2)
+        for rec in records:
+            self.assertEqual(rec["status"], "ok")
+            self.assertEqual(
+                list(rec["phases"]),
+                [
+                    "lock_wait",
+                    "preprocess",
+                    "preflight",
+                    "pdflatex",
+                    "synctex",
+                    "publish",
+                ],
+            )
+            self.assertGreaterEqual(rec["total"], sum(rec["phases"].values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
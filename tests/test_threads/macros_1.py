@@ -0,0 +1,7 @@
+import time
+
+
+def macro_kwargs(arg1, arg2, kw1="kw1-default", kw2="kw2-default"):
+    # give up the GIL so runs in other threads interleave with this one
+    time.sleep(0.001)
+    return arg1 + " + " + arg2 + " KW: " + kw1 + " + " + kw2
@@ -0,0 +1,113 @@
+import numpy as np
+import unittest
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from texenv import TeXPreprocessor, preprocess
+
+
+class TestThreads(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_ = Path(__file__).parent
+        self.kwargs_dir = self.dir_.parent / "test_kwargs"
+        self.build_dir = self.dir_ / "build"
+
+        with open(self.kwargs_dir / "kwargs.tex", newline="") as f:
+            self.in_text = f.read()
+
+        with open(self.kwargs_dir / "kwargs_truth.tex", newline="") as f:
+            self.truth_text = f.read()
+
+    def tearDown(self) -> None:
+        if self.build_dir.exists():
+            shutil.rmtree(self.build_dir)
+
+    def test_parallel_documents(self):
+        """
+        Preprocess hundreds of documents in parallel threads, each document should have identical output.
+        """
+        sys_path = list(sys.path)
+
+        def run(i):
+            # append the document index so each output is unique
+            in_text = self.in_text + "\n% {}".format(i)
+            return preprocess(in_text, module_paths=[self.dir_])
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(run, range(400)))
+
+        for i, (text, line_map) in enumerate(results):
+            self.assertEqual(text, self.truth_text + "\n% {}".format(i))
+            np.testing.assert_array_equal(line_map, np.arange(1, 15))
+
+        # the preprocessor should never modify the global module search path
+        self.assertEqual(sys.path, sys_path)
+
+    def test_shared_preprocessor(self):
+        """
+        A single preprocessor instance can be run from several threads at once.
+        """
+        texpp = TeXPreprocessor.from_string(self.in_text, module_paths=[self.dir_])
+
+        def run(i):
+            text, line_map = texpp.process()
+            return text, list(texpp._syntex_map)
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(run, range(100)))
+
+        for text, line_map in results:
+            self.assertEqual(text, self.truth_text)
+            np.testing.assert_array_equal(line_map, np.arange(1, 14))
+
+    def test_isolated_modules(self):
+        """
+        Modules with the same name in different document folders are loaded into separate namespaces.
+        """
+        multiline_dir = self.dir_.parent / "test_multiline"
+
+        in_text = "\\import\\macros_1 as \\pym\n\\pym\\emb_args[1, 2]"
+
+        text, _ = preprocess(in_text, module_paths=[multiline_dir])
+        self.assertEqual(text, "\n1|E|2")
+
+        # the macros_1 module in this folder does not define emb_args
+        with self.assertRaises(AttributeError):
+            preprocess(in_text, module_paths=[self.dir_])
+
+    def test_sibling_import(self):
+        """
+        Modules can import helper files from their own folder. Helpers with the same name in different document
+        folders are isolated like the modules themselves, and sys.path and sys.modules are never changed.
+        """
+        sys_path = list(sys.path)
+        in_text = "\\import\\macros_sibling as \\pym\n\\pym\\greet[world] \\pym\\greet_later[world]"
+
+        # the test folder is on sys.path when run with pytest, so the modules are written to new folders
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            texts = []
+            for greeting in ["hello", "goodbye"]:
+                folder = Path(tmp_dir) / greeting
+                folder.mkdir()
+                (folder / "helper_sibling.py").write_text(
+                    "def greeting(name):\n    return '{} ' + name\n".format(greeting)
+                )
+                (folder / "macros_sibling.py").write_text(
+                    "from helper_sibling import greeting\n\n\n"
+                    "def greet(name):\n    return greeting(name)\n\n\n"
+                    "def greet_later(name):\n    import helper_sibling\n\n    return helper_sibling.greeting(name)\n"
+                )
+
+                texts.append(preprocess(in_text, module_paths=[folder])[0])
+
+        self.assertEqual(
+            texts, ["\nhello world hello world", "\ngoodbye world goodbye world"]
+        )
+        self.assertEqual(sys.path, sys_path)
+        self.assertNotIn("helper_sibling", sys.modules)
+
+
+if __name__ == "__main__":
+    unittest.main()
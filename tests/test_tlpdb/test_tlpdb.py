@@ -0,0 +1,190 @@
+import unittest
+from pathlib import Path
+import os
+import shutil
+import tempfile
+from texenv import tlpdb, utils, packages
+import platform
+
+
+class TestTLPDB(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir_ = Path(__file__).parent
+        self.pdb_path = self.dir_ / "texlive.tlpdb"
+
+        # keep the cached indexes out of the user cache directory
+        self.cache_dir = tempfile.mkdtemp()
+        self.env_cache = os.environ.get("TEXENV_CACHE_DIR")
+        os.environ["TEXENV_CACHE_DIR"] = self.cache_dir
+        tlpdb._indexes.clear()
+
+    def tearDown(self) -> None:
+        if self.env_cache is None:
+            del os.environ["TEXENV_CACHE_DIR"]
+        else:
+            os.environ["TEXENV_CACHE_DIR"] = self.env_cache
+
+        shutil.rmtree(self.cache_dir)
+        tlpdb._indexes.clear()
+
+    def test_parse(self):
+        index = tlpdb.parse(self.pdb_path)
+
+        self.assertEqual(len(index), 13)
+
+        amsmath = index["amsmath"]
+        self.assertEqual(amsmath.revision, 63514)
+        self.assertEqual(
+            amsmath.docfiles,
+            [
+                "texmf-dist/doc/latex/amsmath/README.md",
+                "texmf-dist/doc/latex/amsmath/amsldoc.pdf",
+            ],
+        )
+        self.assertEqual(len(amsmath.runfiles), 3)
+        self.assertEqual(
+            amsmath.sizes, dict(containersize=21044, docfiles=28, runfiles=3)
+        )
+
+        self.assertEqual(
+            index["collection-latex"].depends,
+            ("amsmath", "collection-basic", "geometry"),
+        )
+        self.assertTrue(index["collection-basic"].relocated)
+        self.assertEqual(
+            index["pdftex.x86_64-linux"].binfiles,
+            ["bin/x86_64-linux/pdftex", "bin/x86_64-linux/pdflatex"],
+        )
+        self.assertEqual(
+            index["pdftex"].srcfiles, ["texmf-dist/source/pdftex/pdftex.ch"]
+        )
+        self.assertEqual(index["00texlive.config"].runfiles, [])
+
+        # the listing holds all lines after the name, and can be written back to a database file
+        with open(self.pdb_path) as f:
+            text = f.read()
+        listings = "".join("name {}\n{}\n".format(k, index.listing(k)) for k in index)
+        self.assertEqual(listings.strip(), text.strip())
+
+    def test_no_trailing_blank_line(self):
+        pdb_path = Path(self.cache_dir) / "texlive.tlpdb"
+        with open(pdb_path, "w") as f:
+            f.write("name a\nrevision 2\nrunfiles size=1\n tex/a.sty")
+
+        index = tlpdb.parse(pdb_path)
+        self.assertEqual(index["a"].runfiles, ["tex/a.sty"])
+        self.assertEqual(
+            index.listing("a"), "revision 2\nrunfiles size=1\n tex/a.sty\n"
+        )
+
+    def test_cache(self):
+        """
+        The parsed index is cached on disk and in memory, and invalidated when the database changes.
+        """
+        pdb_path = Path(self.cache_dir) / "texlive.tlpdb"
+        shutil.copyfile(self.pdb_path, pdb_path)
+
+        index = tlpdb.load(pdb_path)
+        self.assertIs(tlpdb.load(pdb_path), index)
+        self.assertEqual(
+            len(list((Path(self.cache_dir) / "tlpdb").glob("*.pickle"))), 1
+        )
+
+        # loading in a new process reads the disk cache
+        tlpdb._indexes.clear()
+        cached = tlpdb.load(pdb_path)
+        self.assertIsNot(cached, index)
+        self.assertEqual(cached._packages, index._packages)
+
+        with open(pdb_path, "a") as f:
+            f.write("\nname newpkg\nrevision 1\n")
+
+        self.assertIn("newpkg", tlpdb.load(pdb_path))
+
+    def test_tlpdb_parse(self):
+        pkg_listings, pkg_files = utils.tlpdb_parse(self.pdb_path)
+
+        self.assertEqual(
+            pkg_files["geometry"]["runfiles"],
+            [
+                "texmf-dist/tex/latex/geometry/geometry.cfg",
+                "texmf-dist/tex/latex/geometry/geometry.sty",
+            ],
+        )
+        self.assertEqual(pkg_files["geometry"]["binfiles"], [])
+        self.assertTrue(
+            pkg_listings["geometry"].startswith("category Package\nrevision 61719\n")
+        )
+
+    def test_closure(self):
+        index = tlpdb.parse(self.pdb_path)
+
+        closure, unknown = tlpdb.closure(index, ["collection-latex"], "x86_64-linux")
+        self.assertEqual(
+            closure,
+            [
+                "collection-latex",
+                "amsmath",
+                "collection-basic",
+                "geometry",
+                "amsfonts",
+                "pdftex",
+                "texlive.infra",
+                "atbegshi",
+                "iftex",
+                "pdftex.x86_64-linux",
+                "texlive.infra.x86_64-linux",
+            ],
+        )
+        self.assertEqual(unknown, [])
+
+        # dependencies that are not packages are skipped, unknown requested packages are returned
+        closure, unknown = tlpdb.closure(
+            index, ["00texlive.config", "pdftex", "nopkg"], "windows"
+        )
+        self.assertEqual(closure, ["00texlive.config", "pdftex", "pdftex.windows"])
+        self.assertEqual(unknown, ["nopkg"])
+
+    def test_find_remote(self):
+        texdir = Path(self.cache_dir)
+        (texdir / "tlpkg").mkdir()
+        self.assertIsNone(tlpdb.find_remote(texdir))
+
+        shutil.copyfile(self.pdb_path, texdir / "tlpkg/texlive.tlpdb")
+        shutil.copyfile(self.pdb_path, texdir / "tlpkg/texlive.tlpdb.main.0123abcd")
+        (texdir / "tlpkg/texlive.tlpdb.main.0123abcd.xz").write_bytes(b"")
+
+        self.assertEqual(
+            tlpdb.find_remote(texdir), texdir / "tlpkg/texlive.tlpdb.main.0123abcd"
+        )
+
+    def test_installed_packages(self):
+        """
+        freeze/list read the environment's database directly.
+        """
+        venv = Path(self.cache_dir) / "venv"
+        (venv / "tex/tlpkg").mkdir(parents=True)
+        shutil.copyfile(self.pdb_path, venv / "tex/tlpkg/texlive.tlpdb")
+
+        env = dict(os.environ)
+        os.environ["VIRTUAL_ENV"] = str(venv)
+        os.environ["PATH"] = (
+            "/usr/local/texlive/2024/bin/x86_64-linux" + os.pathsep + env["PATH"]
+        )
+        try:
+            installed = utils.installed_packages()
+        finally:
+            os.environ.clear()
+            os.environ.update(env)
+
+        base = packages.install_pkgs[platform.system()]
+        expected = sorted(k for k in tlpdb.parse(self.pdb_path) if k not in base)
+        self.assertEqual([p.name for p in installed], expected)
+        self.assertNotIn("amsfonts", expected)
+        self.assertEqual(
+            installed[0].revision, tlpdb.parse(self.pdb_path)[expected[0]].revision
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,19 @@
+import time
+
+
+def emb_args(arg1, arg2):
+    return arg1 + "|E|" + arg2
+
+
+def sleep(seconds):
+    time.sleep(float(seconds))
+    return "done"
+
+
+def allocate(mb):
+    data = bytearray(int(mb) * 1024 * 1024)
+    return str(len(data))
+
+
+def fail():
+    raise ValueError("macro failed")
@@ -0,0 +1,90 @@
+import unittest
+from pathlib import Path
+import platform
+import time
+from texenv import preprocess, utils
+from texenv.worker import MacroWorker
+
+header = "\\import\\macros_worker as \\pym\n\n"
+
+
+class TestWorker(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.dir_ = Path(__file__).parent
+        memory_limit = 1024 if platform.system() != "Windows" else None
+        cls.worker = MacroWorker(timeout=10, memory_limit=memory_limit)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.worker.close()
+
+    def run_text(self, text):
+        return preprocess(
+            header + text, module_paths=[self.dir_], macro_worker=self.worker
+        )[0]
+
+    def test_worker(self):
+        """
+        Macros run in the worker give the same output as macros run in the current process.
+        """
+        text = "\\pym\\emb_args[1, 2] \\pym\\emb_args{a}{\\pym\\emb_args[b, c]}"
+        self.assertEqual(
+            self.run_text(text), preprocess(header + text, module_paths=[self.dir_])[0]
+        )
+
+    def test_timeout(self):
+        """
+        Runaway macros are stopped after the timeout, and the error shows the line of the macro.
+        """
+        self.worker.timeout = 0.5
+        try:
+            t_start = time.time()
+            with self.assertRaisesRegex(
+                TimeoutError, "Error on line 4. Macro .*sleep did not finish"
+            ):
+                self.run_text("\n\\pym\\sleep{30}")
+            self.assertLess(time.time() - t_start, 10)
+        finally:
+            self.worker.timeout = 10
+
+        # the worker is restarted for the next call
+        self.assertEqual(self.run_text("\\pym\\sleep{0}"), "\n\ndone")
+
+    def test_cold_start(self):
+        """
+        The startup of the worker process does not count against the timeout of the first call.
+        """
+        with MacroWorker(timeout=0.1) as worker:
+            text = preprocess(
+                header + "\\pym\\sleep{0}",
+                module_paths=[self.dir_],
+                macro_worker=worker,
+            )[0]
+            self.assertEqual(text, "\n\ndone")
+
+    @unittest.skipIf(platform.system() == "Windows", "memory limits require unix")
+    def test_memory_limit(self):
+        with self.assertRaisesRegex(
+            RuntimeError, "Error on line 3. .*memory limit of 1024 MB"
+        ):
+            self.run_text("\\pym\\allocate{4096}")
+
+        self.assertEqual(self.run_text("\\pym\\allocate{1}"), "\n\n" + str(1024 * 1024))
+
+    def test_exception(self):
+        with self.assertRaisesRegex(
+            RuntimeError, "(?s)Error on line 3. .*ValueError: macro failed"
+        ):
+            self.run_text("\\pym\\fail")
+
+    def test_command_timeout(self):
+        with self.assertRaises(TimeoutError):
+            utils.run_command("sleep 10", timeout=0.2)
+
+        proc = utils.run_command("echo done", timeout=10)
+        self.assertEqual(proc.stdout.decode().strip(), "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,29 @@
-from .preprocessor import TeXPreprocessor
-from .runner import cli
-from .slides import Presentation, datatable
 from . import macros
 from .macros import *
+
+# submodules with heavy dependencies (matplotlib, numpy, PIL) are imported on first use, so the command line
+# interface starts quickly.
+_lazy_attrs = dict(
+    TeXPreprocessor="preprocessor",
+    preprocess="preprocessor",
+    cli="runner",
+    Presentation="slides",
+    datatable="slides",
+)
+
+
+def __getattr__(name):
+    if name in _lazy_attrs:
+        import importlib
+
+        value = getattr(
+            importlib.import_module("." + _lazy_attrs[name], __name__), name
+        )
+        globals()[name] = value
+        return value
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_attrs))
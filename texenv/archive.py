@@ -0,0 +1,294 @@
+from pathlib import Path
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    # zstd archives are optional, .tar.xz and .tar.gz archives are always supported
+    zstandard = None
+
+# first member of every archive
+MANIFEST = "texenv-manifest.json"
+MANIFEST_VERSION = 1
+
+# files that may hold the absolute path of the environment, relative to the tex folder
+FIXUP_NAMES = ("texenv.json", "texlive.tlpdb", "texmf.cnf", "fmtutil.cnf", "updmap.cfg")
+FIXUP_MAX_SIZE = 50 * 1024 * 1024
+
+# maximum number of file writes queued while the archive is read
+MAX_PENDING = 256
+
+
+def _open_stream(archive_path: Path, mode: str):
+    """
+    Returns a tarfile opened in streaming mode and the underlying file objects, with the compression chosen by the
+    file extension: .tar.zst (requires the zstandard package), .tar.xz, .tar.gz or .tar.
+    """
+    name = str(archive_path)
+
+    if name.endswith((".zst", ".zstd")):
+        if zstandard is None:
+            raise RuntimeError(
+                "zstd archives require the zstandard package: pip install zstandard. Use a .tar.xz archive instead."
+            )
+
+        f = open(archive_path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(f)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(f)
+        return tarfile.open(fileobj=stream, mode=mode + "|"), [stream, f]
+
+    for ext, comp in [(".xz", "xz"), (".gz", "gz"), (".tgz", "gz"), (".tar", "")]:
+        if name.endswith(ext):
+            f = open(archive_path, mode + "b")
+            return tarfile.open(fileobj=f, mode=mode + "|" + comp), [f]
+
+    raise ValueError(
+        f"Unknown archive type: {archive_path}. Expected .tar.zst, .tar.xz, .tar.gz or .tar"
+    )
+
+
+def _content_hash(filepath: Path) -> str:
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def export(texdir: Path, archive_path: Path) -> dict:
+    """
+    Packs a TeX environment into a relocatable archive. Files with the same content (hard links, or copies) are
+    stored once as tar hard links, symlinks into the environment are made relative and symlinks out of the
+    environment are replaced with the files they point to. The archive starts with a manifest that lists the
+    files holding the absolute path of the environment, which are fixed up on import.
+
+    Parameters:
+    -----------
+    texdir: Path
+        tex folder of the environment.
+    archive_path: Path
+        archive file, .tar.zst, .tar.xz, .tar.gz or .tar.
+
+    Returns:
+    --------
+    dict:
+        manifest of the archive.
+    """
+    texdir = Path(texdir).resolve()
+    root = str(texdir).encode("utf-8")
+
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(texdir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            entries.append(Path(dirpath) / name)
+
+    # files that have the same size are hashed to find copies with the same content
+    by_size = {}
+    for filepath in entries:
+        if not filepath.is_symlink():
+            by_size.setdefault(os.stat(filepath).st_size, []).append(filepath)
+
+    duplicate_of = {}
+    by_inode = {}
+    by_content = {}
+    for size, files in by_size.items():
+        if len(files) < 2:
+            continue
+
+        for filepath in files:
+            st = os.stat(filepath)
+            inode = (st.st_dev, st.st_ino)
+
+            # hard links of a file that was already seen are found without hashing
+            if inode in by_inode:
+                duplicate_of[filepath] = by_inode[inode]
+                continue
+
+            key = (size, _content_hash(filepath))
+            if key in by_content:
+                duplicate_of[filepath] = by_content[key]
+            else:
+                by_content[key] = filepath
+            by_inode[inode] = by_content[key]
+
+    fixups = []
+    for filepath in entries:
+        if filepath.name in FIXUP_NAMES and not filepath.is_symlink():
+            if (
+                os.stat(filepath).st_size < FIXUP_MAX_SIZE
+                and root in filepath.read_bytes()
+            ):
+                fixups.append(filepath.relative_to(texdir).as_posix())
+
+    manifest = dict(
+        version=MANIFEST_VERSION,
+        root=str(texdir),
+        files=len(entries),
+        duplicates=len(duplicate_of),
+        bytes=sum(os.stat(p).st_size for p in entries if p not in duplicate_of),
+        fixups=fixups,
+        created=time.time(),
+    )
+
+    tar, streams = _open_stream(archive_path, "w")
+    try:
+        data = json.dumps(manifest, indent=2).encode("utf-8")
+        info = tarfile.TarInfo(MANIFEST)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+        for filepath in entries:
+            arcname = filepath.relative_to(texdir).as_posix()
+
+            if filepath in duplicate_of:
+                info = tar.gettarinfo(str(filepath), arcname)
+                info.type = tarfile.LNKTYPE
+                info.linkname = duplicate_of[filepath].relative_to(texdir).as_posix()
+                info.size = 0
+                tar.addfile(info)
+                continue
+
+            if filepath.is_symlink():
+                target = Path(os.path.realpath(filepath))
+                if texdir in target.parents:
+                    info = tar.gettarinfo(str(filepath), arcname)
+                    info.linkname = os.path.relpath(target, filepath.parent)
+                    tar.addfile(info)
+                    continue
+                elif not target.is_file():
+                    # dangling links and links to folders outside of the environment are not relocatable
+                    continue
+
+            # regular files, and symlinks out of the environment are stored as the file they point to
+            info = tar.gettarinfo(str(filepath.resolve()), arcname)
+            with open(filepath, "rb") as f:
+                tar.addfile(info, f)
+    finally:
+        tar.close()
+        for stream in streams:
+            stream.close()
+
+    return manifest
+
+
+def _check_member(member: tarfile.TarInfo):
+    """Rejects members that would be written outside of the destination folder."""
+    names = [member.name] + ([member.linkname] if member.islnk() else [])
+    for name in names:
+        if name.startswith(("/", "\\")) or ".." in Path(name).parts:
+            raise RuntimeError(f"Unsafe path in archive: {name}")
+
+
+def import_(archive_path: Path, texdir: Path, max_workers: int = None) -> dict:
+    """
+    Unpacks an archive written by export() into the tex folder of an environment. The archive is decompressed as
+    a stream while a thread pool writes the files, and the files listed in the manifest are updated with the new
+    path of the environment.
+
+    Parameters:
+    -----------
+    archive_path: Path
+        archive file.
+    texdir: Path
+        tex folder of the environment, must not exist.
+    max_workers: int, optional
+        number of threads writing files. Defaults to the executor default.
+
+    Returns:
+    --------
+    dict:
+        manifest of the archive.
+    """
+    texdir = Path(texdir).resolve()
+    if texdir.exists():
+        raise RuntimeError(f"TeX installation already exists at {texdir}")
+
+    texdir.mkdir(parents=True)
+
+    def write_file(filepath: Path, data: bytes, mode: int, mtime: float):
+        with open(filepath, "wb") as f:
+            f.write(data)
+        os.chmod(filepath, mode)
+        os.utime(filepath, (mtime, mtime))
+
+    links = []
+    pending = threading.BoundedSemaphore(MAX_PENDING)
+    futures = []
+    manifest = None
+
+    tar, streams = _open_stream(archive_path, "r")
+    try:
+        with ThreadPoolExecutor(max_workers) as pool:
+            for member in tar:
+                if member.name == MANIFEST:
+                    manifest = json.loads(
+                        tar.extractfile(member).read().decode("utf-8")
+                    )
+                    continue
+
+                _check_member(member)
+                filepath = texdir / member.name
+
+                if member.isdir():
+                    filepath.mkdir(parents=True, exist_ok=True)
+                elif member.isfile():
+                    filepath.parent.mkdir(parents=True, exist_ok=True)
+                    data = tar.extractfile(member).read()
+
+                    # limit the number of files held in memory while the writes are queued
+                    pending.acquire()
+                    future = pool.submit(
+                        write_file, filepath, data, member.mode, member.mtime
+                    )
+                    future.add_done_callback(lambda _: pending.release())
+                    futures.append(future)
+                elif member.islnk() or member.issym():
+                    # links are created after all files are written
+                    links.append(member)
+
+            for future in futures:
+                future.result()
+    finally:
+        tar.close()
+        for stream in streams:
+            stream.close()
+
+    if manifest is None:
+        raise RuntimeError(f"Archive was not created by texenv export: {archive_path}")
+
+    for member in links:
+        filepath = texdir / member.name
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        if member.islnk():
+            os.link(texdir / member.linkname, filepath)
+        else:
+            target = os.path.normpath(os.path.join(filepath.parent, member.linkname))
+            if not target.startswith(str(texdir) + os.sep):
+                raise RuntimeError(
+                    f"Unsafe link in archive: {member.name} -> {member.linkname}"
+                )
+            os.symlink(member.linkname, filepath)
+
+    # replace the path of the exported environment with the new path
+    old_root, new_root = manifest["root"].encode("utf-8"), str(texdir).encode("utf-8")
+    for name in manifest["fixups"]:
+        filepath = texdir / name
+        data = filepath.read_bytes().replace(old_root, new_root)
+        mode = os.stat(filepath).st_mode
+
+        # hard linked copies must not change with the fixed up file
+        os.unlink(filepath)
+        filepath.write_bytes(data)
+        os.chmod(filepath, mode)
+
+    return manifest
@@ -0,0 +1,70 @@
+from typing import Callable
+
+# events emitted by the preprocessor and the build, handlers are called with keyword arguments:
+#   on_import: alias, module, file, line. An \import statement was read.
+#   on_macro_start: module, method, args, kwargs, file, line. A python macro is about to be called.
+#   on_macro_end: module, method, output, error, seconds, file, line. A python macro returned or raised error.
+#   on_write: path, source. A preprocessed file was written to the build directory.
+#   on_compile_start: command, cwd. pdflatex is about to run.
+#   on_compile_end: command, cwd, returncode, seconds. pdflatex finished.
+#   on_synctex_rewrite: gen_syn, out_syn. The synctex file was rewritten to point to the original files.
+EVENTS = (
+    "on_import",
+    "on_macro_start",
+    "on_macro_end",
+    "on_write",
+    "on_compile_start",
+    "on_compile_end",
+    "on_synctex_rewrite",
+)
+
+# handlers of each event. The tuples are replaced instead of modified, so emit() never sees a partial update from
+# another thread.
+_handlers = {name: () for name in EVENTS}
+
+# True if any handler is subscribed. Checked before emitting, so unused events cost a single global lookup.
+enabled = False
+
+
+def subscribe(event: str, handler: Callable) -> Callable:
+    """
+    Calls handler with the keyword arguments of the event each time it is emitted. Returns the handler.
+
+    Parameters:
+    -----------
+    event: str
+        name of the event, one of EVENTS.
+    handler: Callable
+        function called with the keyword arguments of the event. Exceptions raised by the handler are not caught
+        and stop the build.
+    """
+    global enabled
+
+    if event not in _handlers:
+        raise ValueError(f"Unknown event: {event}. Expected one of {EVENTS}.")
+
+    _handlers[event] = _handlers[event] + (handler,)
+    enabled = True
+    return handler
+
+
+def unsubscribe(event: str, handler: Callable):
+    """Removes a handler added with subscribe(). Raises ValueError if the handler is not subscribed."""
+    global enabled
+
+    if event not in _handlers or handler not in _handlers[event]:
+        raise ValueError(f"Handler is not subscribed to {event}.")
+
+    handlers = list(_handlers[event])
+    handlers.remove(handler)
+    _handlers[event] = tuple(handlers)
+    enabled = any(_handlers.values())
+
+
+def emit(event: str, **kwargs):
+    """
+    Calls the handlers of an event. Callers check the enabled flag first, so the keyword arguments are not built
+    when nothing is subscribed.
+    """
+    for handler in _handlers[event]:
+        handler(**kwargs)
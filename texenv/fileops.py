@@ -0,0 +1,225 @@
+from pathlib import Path
+import os
+import shutil
+import time
+import errno
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+from .store import Store
+
+try:
+    import fcntl
+except ImportError:
+    # reflinks are only supported on linux
+    fcntl = None
+
+# modes for populating files in the environment
+LINK_MODES = ("copy", "hard", "symlink", "reflink", "store")
+
+# ioctl request to clone a file on copy-on-write filesystems (btrfs, xfs), from linux/fs.h
+FICLONE = 0x40049409
+
+
+def plan_files(
+    src_root: Path, dst_root: Path, relative_paths: List[str], binary: bool = False
+) -> List[Tuple[Path, Path, bool]]:
+    """
+    Returns the list of file operations needed to populate dst_root with the relative paths from src_root. Paths
+    that are directories are expanded to all files inside them, missing paths are skipped.
+
+    Parameters:
+    -----------
+    src_root: Path
+        source directory, i.e. the base TeXLive installation.
+    dst_root: Path
+        destination directory.
+    relative_paths: list
+        file or directory paths relative to both roots.
+    binary: bool, default: False
+        marks the files as executables, which are never symlinked (see execute()).
+
+    Returns:
+    --------
+    list:
+        tuples of the source path, destination path and the binary flag.
+    """
+    plan = []
+    for rel in relative_paths:
+        src = Path(src_root) / rel
+
+        if src.is_dir():
+            for dirpath, _, filenames in os.walk(src):
+                rel_dir = Path(dirpath).relative_to(src_root)
+                for name in filenames:
+                    plan.append(
+                        (Path(dirpath) / name, Path(dst_root) / rel_dir / name, binary)
+                    )
+
+        elif src.exists():
+            plan.append((src, Path(dst_root) / rel, binary))
+
+    return plan
+
+
+def changed_files(plan: List[Tuple[Path, Path, bool]]) -> List[Tuple[Path, Path, bool]]:
+    """
+    Returns the operations of a plan whose destination is missing or differs from the source. Destinations that
+    are links to the source, or copies with the same size and modification time, are up to date.
+    """
+    changed = []
+    for src, dst, binary in plan:
+        try:
+            st_dst = os.stat(dst)
+        except OSError:
+            changed.append((src, dst, binary))
+            continue
+
+        st_src = os.stat(src)
+        if (st_src.st_dev, st_src.st_ino) == (st_dst.st_dev, st_dst.st_ino):
+            continue
+        if (
+            st_src.st_size == st_dst.st_size
+            and st_src.st_mtime_ns == st_dst.st_mtime_ns
+        ):
+            continue
+
+        changed.append((src, dst, binary))
+
+    return changed
+
+
+class _Linker(object):
+    """
+    Creates a single file with the given mode. Falls back to copying the file, and stops trying the link mode
+    after the first failure since it will fail for every file on the same filesystem.
+    """
+
+    def __init__(self, mode: str, store: Store = None):
+        if mode not in LINK_MODES:
+            raise ValueError(
+                f"Unknown link mode: {mode}. Expected one of {LINK_MODES}."
+            )
+
+        self.mode = mode
+        self.store = (
+            store if store is not None else (Store() if mode == "store" else None)
+        )
+        self.supported = mode != "reflink" or fcntl is not None
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def _reflink(self, src: Path, dst: Path):
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+
+    def link(self, src: Path, dst: Path, binary: bool) -> int:
+        """
+        Populates dst from src and returns the size of the file in bytes.
+        """
+        size = os.stat(src).st_size
+
+        if os.path.lexists(dst):
+            os.unlink(dst)
+
+        # binaries are resolved by kpathsea relative to their real location, so a symlinked binary would use the
+        # base installation instead of the environment.
+        mode = "copy" if (self.mode == "symlink" and binary) else self.mode
+
+        if mode != "copy":
+            if self.supported:
+                try:
+                    if mode == "hard":
+                        os.link(src, dst)
+                    elif mode == "symlink":
+                        os.symlink(src, dst)
+                    elif mode == "reflink":
+                        self._reflink(src, dst)
+                    elif mode == "store":
+                        self.store.link(src, dst)
+                    return size
+
+                except OSError as e:
+                    # not supported across filesystems or by the filesystem, copy instead
+                    if e.errno in (
+                        errno.EXDEV,
+                        errno.EPERM,
+                        errno.EOPNOTSUPP,
+                        errno.EINVAL,
+                        errno.ENOTTY,
+                    ):
+                        self.supported = False
+
+                    if os.path.lexists(dst):
+                        os.unlink(dst)
+
+            with self._lock:
+                self.fallbacks += 1
+
+        shutil.copy2(src, dst)
+        return size
+
+
+def execute(
+    plan: List[Tuple[Path, Path, bool]],
+    mode: str = "copy",
+    max_workers: int = None,
+    store: Store = None,
+) -> dict:
+    """
+    Executes the file operations from plan_files() in a thread pool.
+
+    Parameters:
+    -----------
+    plan: list
+        tuples of the source path, destination path and the binary flag.
+    mode: str, default: "copy"
+        one of "copy", "hard", "symlink", "reflink" or "store". Hard links and reflinks fall back to copying if
+        they are not supported, i.e. across filesystems. Binaries are copied in symlink mode. "store" adds files to
+        the content-addressed store and hard links them from there (see store.Store).
+    max_workers: int, optional
+        number of threads. Defaults to the executor default.
+    store: Store, optional
+        store used in "store" mode. Defaults to the per-user store.
+
+    Returns:
+    --------
+    dict:
+        statistics with the number of files, bytes, fallback copies and elapsed seconds.
+    """
+    linker = _Linker(mode, store)
+    t_start = time.perf_counter()
+
+    # create all directories up front so the workers only create files
+    for dirpath in sorted(set(dst.parent for _, dst, _ in plan)):
+        os.makedirs(dirpath, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        sizes = list(pool.map(lambda op: linker.link(*op), plan))
+
+    if linker.store is not None:
+        linker.store.save()
+
+    return dict(
+        files=len(plan),
+        bytes=sum(sizes),
+        fallbacks=linker.fallbacks,
+        seconds=time.perf_counter() - t_start,
+    )
+
+
+def format_stats(stats: dict) -> str:
+    """Returns a one line summary of the statistics from execute()."""
+    seconds = max(stats["seconds"], 1e-6)
+    mbytes = stats["bytes"] / 1e6
+
+    s = "{} files ({:.1f} MB) in {:.2f} s ({:.0f} files/s, {:.1f} MB/s)".format(
+        stats["files"], mbytes, seconds, stats["files"] / seconds, mbytes / seconds
+    )
+
+    if stats["fallbacks"]:
+        s += ", {} files copied instead of linked".format(stats["fallbacks"])
+
+    return s
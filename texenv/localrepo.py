@@ -0,0 +1,185 @@
+from pathlib import Path
+import hashlib
+import lzma
+import os
+import shutil
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from . import utils, tlpdb
+
+# relocatable packages list their files under this prefix in the package database, which is replaced by the
+# texmf-dist tree on install. Their archives store the files relative to texmf-dist.
+RELOC = "RELOC/"
+
+
+def database_path(repository: Path) -> Path:
+    """
+    Returns the path of the package database of a local repository (a mirror of the TeXLive "tlnet" folder).
+    Mirrors often only have the compressed database, which is decompressed once into the texenv cache directory.
+    """
+    repository = Path(repository)
+    pdb_path = repository / "tlpkg/texlive.tlpdb"
+
+    if pdb_path.exists():
+        return pdb_path
+
+    xz_path = pdb_path.with_name("texlive.tlpdb.xz")
+    if not xz_path.exists():
+        raise RuntimeError(f"Package database not found in repository: {repository}")
+
+    path_hash = hashlib.sha256(str(xz_path.resolve()).encode("utf-8")).hexdigest()[:16]
+    cache_path = utils.cache_dir() / "repository" / (path_hash + ".tlpdb")
+
+    if not cache_path.exists() or cache_path.stat().st_mtime < xz_path.stat().st_mtime:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".{}.tmp".format(os.getpid()))
+
+        with lzma.open(xz_path, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+            shutil.copyfileobj(fsrc, fdst)
+        os.replace(tmp_path, cache_path)
+
+    return cache_path
+
+
+def unrelocate(listing: str) -> str:
+    """
+    Returns the listing of a relocated package as it appears in the database of an installation, with file paths
+    relative to the installation directory.
+    """
+    lines = []
+    for ln in listing.splitlines(True):
+        if ln.startswith(" " + RELOC):
+            ln = " texmf-dist/" + ln[len(RELOC) + 1 :]
+        elif ln.rstrip("\n") == "relocated 1":
+            continue
+        lines.append(ln)
+
+    return "".join(lines)
+
+
+def _unlink(root: Path, name: str):
+    """
+    Removes the file an archive member is extracted to. tarfile writes into existing files, which would change the
+    base installation or the file store through the hard links and symlinks of an environment created with
+    init --link.
+    """
+    dst = os.path.join(root, name)
+    # members outside of the extraction root are rejected by the extraction filter, they are never removed
+    real_root = os.path.realpath(root)
+    if (
+        os.path.commonpath([real_root, os.path.realpath(os.path.dirname(dst))])
+        != real_root
+    ):
+        return
+
+    if os.path.lexists(dst) and not os.path.isdir(dst):
+        os.unlink(dst)
+
+
+def _extract(archive: Path, texdir: Path, relocated: bool = False) -> List[str]:
+    """
+    Extracts a package archive into the installation directory, runs in a worker process of install(). Archives of
+    relocated packages are extracted into the texmf-dist tree, like tlmgr does. Returns the paths of the extracted
+    files relative to texdir.
+    """
+    files = []
+    root = Path(texdir) / "texmf-dist" if relocated else Path(texdir)
+    prefix = "texmf-dist/" if relocated else ""
+
+    def members(tar):
+        for member in tar:
+            # the package listing is already written to the database of the environment
+            if member.name.startswith("tlpkg/tlpobj/"):
+                continue
+            if not member.isdir():
+                files.append(prefix + member.name)
+                _unlink(root, member.name)
+            yield member
+
+    with tarfile.open(archive, "r:xz") as tar:
+        if hasattr(tarfile, "data_filter"):
+            # rejects absolute paths and links outside of the extraction root
+            tar.extractall(root, members=members(tar), filter="data")
+        else:
+            tar.extractall(root, members=members(tar))
+
+    return files
+
+
+def install(
+    repository: Path, names: List[str], texdir: Path, max_workers: int = None
+) -> Tuple[List[str], List[str]]:
+    """
+    Installs packages from a local repository without tlmgr. The package archives are extracted in a process
+    pool, since xz decompression is CPU-bound, and the package listings are added to the database of the
+    installation afterwards. Files of older revisions of the packages that are no longer part of the package are
+    removed. Post-install actions of the packages (formats and font maps) are not run.
+
+    Parameters:
+    -----------
+    repository: Path
+        local mirror of the TeXLive "tlnet" folder, with the package database in tlpkg/ and the package archives
+        in archive/.
+    names: list
+        names of the packages to install. Dependencies are not resolved, see utils.resolve_install().
+    texdir: Path
+        TeXLive installation directory of the environment.
+    max_workers: int, optional
+        number of worker processes. Defaults to the number of processors.
+
+    Returns:
+    --------
+    tuple:
+        paths of the installed files and paths of the removed files, relative to texdir.
+    """
+    repository = Path(repository)
+    texdir = Path(texdir)
+    index = tlpdb.load(database_path(repository))
+
+    archives, relocated = [], []
+    for k in names:
+        if k not in index:
+            raise ValueError(f"Package {k} not found in repository {repository}.")
+
+        archive = repository / "archive" / (k + ".tar.xz")
+        # packages without files, i.e. collections, have no archive
+        if archive.exists():
+            archives.append(archive)
+            relocated.append(index[k].relocated)
+
+    files = []
+    if archives:
+        with ProcessPoolExecutor(max_workers) as pool:
+            for extracted in pool.map(
+                _extract, archives, [texdir] * len(archives), relocated
+            ):
+                files += extracted
+
+    # write the new database with the listings of the installed packages, replacing older revisions
+    pdb_path = texdir / "tlpkg/texlive.tlpdb"
+    installed = tlpdb.load(pdb_path)
+
+    listings = {k: installed.listing(k) for k in installed if k not in names}
+    for k in names:
+        listing = index.listing(k)
+        listings[k] = unrelocate(listing) if index[k].relocated else listing
+
+    # files of the installed revisions that are not in the new revisions
+    added = set(files)
+    removed = []
+    for k in names:
+        if k in installed:
+            for path in installed[k].runfiles + installed[k].binfiles:
+                if path not in added and (texdir / path).exists():
+                    os.remove(texdir / path)
+                    removed.append(path)
+
+    tmp_path = pdb_path.with_suffix(".{}.tmp".format(os.getpid()))
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for k in sorted(listings):
+            f.write(f"name {k}\n" + listings[k] + "\n")
+    os.replace(tmp_path, pdb_path)
+
+    return files, removed
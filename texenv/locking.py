@@ -0,0 +1,105 @@
+from pathlib import Path
+import os
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock(object):
+    """
+    Exclusive lock on a file, shared between processes and threads. Used to serialize builds that write to the
+    same build directory. The lock is released when the process exits, so a crashed build never leaves a stale
+    lock behind.
+    """
+
+    def __init__(self, path: Path, timeout: float = None, poll_interval: float = 0.05):
+        """
+        Parameters:
+        -----------
+        path: Path
+            lock file, created if it doesn't exist.
+        timeout: float, optional
+            maximum time in seconds to wait for the lock. Defaults to waiting forever.
+        poll_interval: float, default: 0.05
+            time in seconds between attempts to take the lock.
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._file = None
+
+    def _try_lock(self) -> bool:
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self):
+        """
+        Waits until the lock is available and takes it. Raises TimeoutError if the lock is not available within the
+        timeout.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a+")
+
+        t_start = time.monotonic()
+        while not self._try_lock():
+            if self.timeout is not None and time.monotonic() - t_start > self.timeout:
+                self._file.close()
+                self._file = None
+                raise TimeoutError(
+                    "Could not lock {} within {} seconds, another build is running.".format(
+                        self.path, self.timeout
+                    )
+                )
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        if self._file is None:
+            return
+
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def publish(src: Path, dst: Path):
+    """
+    Copies src to dst atomically. The file is copied next to dst first and then renamed, so readers (i.e. a PDF
+    viewer) never see a partially written file, even if src is on a different filesystem like a tmpfs scratch
+    directory.
+    """
+    dst = Path(dst)
+    tmp_path = dst.with_name(
+        ".{}.{}.{}.tmp".format(dst.name, os.getpid(), threading.get_ident())
+    )
+
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        if tmp_path.exists():
+            os.unlink(tmp_path)
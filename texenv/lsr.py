@@ -0,0 +1,142 @@
+from pathlib import Path
+import os
+from typing import Dict, List, Set
+
+# first line of every ls-R file, kpathsea ignores databases without it
+HEADER = "% ls-R -- filename database for kpathsea; do not change this line."
+
+
+def read(lsr_path: Path) -> Dict[str, List[str]]:
+    """
+    Reads a kpathsea filename database (ls-R). Returns a dictionary that maps each directory, relative to the
+    folder of the database and starting with "./", to the names of the files and folders in it.
+    """
+    db = {}
+    entries = None
+
+    with open(lsr_path, "r", encoding="utf-8", errors="surrogateescape") as f:
+        for ln in f:
+            ln = ln.rstrip("\n")
+
+            if not ln or ln.startswith("%"):
+                continue
+
+            if ln.endswith(":"):
+                directory = ln[:-1].rstrip("/")
+                entries = db.setdefault(directory if directory != "." else "./", [])
+            elif entries is not None:
+                entries.append(ln)
+
+    return db
+
+
+def names(db: Dict[str, List[str]]) -> Set[str]:
+    """Returns the set of all file and folder names in a database from read()."""
+    return set(name for entries in db.values() for name in entries)
+
+
+def _split(path: str) -> tuple:
+    """Splits a path relative to the database root into the directory key and the file name."""
+    parent, _, name = path.strip("/").rpartition("/")
+    return ("./" + parent) if parent else "./", name
+
+
+def update(
+    db: Dict[str, List[str]], added: List[str] = (), removed: List[str] = ()
+) -> Dict[str, List[str]]:
+    """
+    Updates a database from read() in place with added and removed files, so the database doesn't have to be
+    generated again by walking the whole tree. Parent directories of added files are added as well, and
+    directories that become empty are removed.
+
+    Parameters:
+    -----------
+    db: dict
+        database from read().
+    added: list
+        file paths relative to the folder of the database, i.e. "tex/latex/geometry/geometry.sty".
+    removed: list
+        file paths relative to the folder of the database.
+    """
+    # membership sets of the directories that are changed
+    members = {}
+
+    def entries(directory):
+        if directory not in members:
+            members[directory] = set(db.setdefault(directory, []))
+        return members[directory]
+
+    for path in added:
+        directory, name = _split(path)
+
+        while name not in entries(directory):
+            entries(directory).add(name)
+            db[directory].append(name)
+
+            if directory == "./":
+                break
+            # register the directory in its parent
+            directory, name = _split(directory[2:])
+
+    for path in removed:
+        directory, name = _split(path)
+
+        while directory in db and name in entries(directory):
+            entries(directory).discard(name)
+            db[directory].remove(name)
+
+            if db[directory] or directory == "./":
+                break
+            # remove the directory from its parent once it is empty
+            del db[directory]
+            del members[directory]
+            directory, name = _split(directory[2:])
+
+    return db
+
+
+def write(db: Dict[str, List[str]], lsr_path: Path):
+    """
+    Writes a database from read() to an ls-R file. The file is replaced atomically so kpathsea never reads a
+    partial database.
+    """
+    lsr_path = Path(lsr_path)
+    tmp_path = lsr_path.with_name(lsr_path.name + ".tmp")
+
+    with open(
+        tmp_path, "w", encoding="utf-8", errors="surrogateescape", newline="\n"
+    ) as f:
+        f.write(HEADER + "\n")
+        for directory in sorted(db):
+            f.write(
+                "{}:\n".format(directory.rstrip("/") if directory != "./" else "./")
+            )
+            f.write("".join(name + "\n" for name in db[directory]))
+            f.write("\n")
+
+    os.replace(tmp_path, lsr_path)
+
+
+def update_file(lsr_path: Path, added: List[str] = (), removed: List[str] = ()):
+    """
+    Updates an ls-R file with added and removed files, see update(). The file is created if it doesn't exist.
+    """
+    db = read(lsr_path) if Path(lsr_path).exists() else {"./": []}
+    write(update(db, added, removed), lsr_path)
+
+
+def verify(db: Dict[str, List[str]], paths: List[str]) -> List[str]:
+    """
+    Returns the paths, relative to the folder of the database, that are not in the database. Used to check the
+    database against the files of the installed packages without reading the file system.
+    """
+    members = {}
+    missing = []
+    for path in paths:
+        directory, name = _split(path)
+        if directory not in members:
+            members[directory] = set(db.get(directory, ()))
+        if name not in members[directory]:
+            missing.append(path)
+
+    return missing
@@ -1,4 +1,4 @@
-__all__ = ("figure", "table")
+__all__ = ("figure", "table", "DeferredFigure")
 
 
 def figure(
@@ -48,6 +48,39 @@ def figure(
     return s
 
 
+class DeferredFigure(object):
+    r"""
+    Matplotlib figure returned from a macro. The preprocessor inserts the LaTeX code for the figure immediately,
+    and saves the figure file in the background before pdflatex is run. Macros can also return a matplotlib
+    Figure directly, which is inserted with a bare \includegraphics.
+
+    Requires:
+    ----------
+    \usepackage{graphicx}
+    """
+
+    def __init__(self, fig, file: str = None, **kwargs):
+        """
+        Parameters:
+        ----------
+        fig: matplotlib.figure.Figure
+            figure to save.
+        file: str, optional
+            file name of the saved figure, relative to the figure folder in the build directory. Defaults to a
+            name generated from the location of the macro call. Raises SyntaxError if another figure of the
+            document has the same name.
+        kwargs:
+            passed to figure(), i.e. caption and width.
+        """
+        self.fig = fig
+        self.file = file
+        self.kwargs = kwargs
+
+    def latex(self, file: str) -> str:
+        """Returns the LaTeX code for the figure saved at file."""
+        return figure(file=file, **self.kwargs)
+
+
 def _check_table_header(row):
     return True if row[0].strip() == "-" * len(row[0].strip()) else False
 
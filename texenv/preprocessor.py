@@ -1,10 +1,168 @@
 from pathlib import Path
-import sys
+import builtins
 import importlib
+import importlib.util
 import os
-from typing import Callable, Union, List
-from io import BytesIO
+import threading
+from types import ModuleType
+from typing import Callable, Union, List, Tuple, IO
+from io import BytesIO, TextIOBase
 import pickle
+import hashlib
+import time
+
+from . import utils, events
+from .macros import DeferredFigure
+from .worker import MacroWorker
+
+# modules loaded from a file on a document's search path, keyed by the resolved file path. The lock is reentrant
+# since modules load their helper files while they are executed.
+_module_cache = {}
+_module_lock = threading.RLock()
+
+
+def find_module_file(name: str, search_paths: List[Path] = None) -> Path:
+    """
+    Returns the resolved path of the first file with the module name in the search paths, or None if the module
+    is not a file in any of the search paths.
+    """
+    search_paths = [] if search_paths is None else search_paths
+
+    for p in search_paths:
+        if (Path(p) / (name + ".py")).is_file():
+            return (Path(p) / (name + ".py")).resolve()
+
+    return None
+
+
+def _folder_import(folder: Path) -> Callable:
+    """
+    Returns an __import__ function for modules loaded by load_module(). Imports of files in folder are loaded with
+    load_module(), all other imports go through the regular import system.
+    """
+
+    def import_(name, globals=None, locals=None, fromlist=(), level=0):
+        if (
+            level == 0
+            and "." not in name
+            and find_module_file(name, [folder]) is not None
+        ):
+            return load_module(name, [folder])
+
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    return import_
+
+
+def load_module(name: str, search_paths: List[Path] = None) -> ModuleType:
+    """
+    Returns the python module with the given name. Modules that are files in one of the search paths are loaded
+    into their own namespace without modifying sys.path or sys.modules, so documents in different folders can use
+    modules with the same name. Helper files imported by these modules from their own folder are loaded the same
+    way. Other modules (i.e. installed packages) are imported normally.
+
+    Parameters:
+    -----------
+    name: str
+        module name.
+    search_paths: list, optional
+        directories to search for a file with the module name, in order.
+    """
+    filepath = find_module_file(name, search_paths)
+
+    if filepath is None:
+        return importlib.import_module(name)
+
+    # reload the module if the file has changed since it was last loaded
+    mtime = filepath.stat().st_mtime_ns
+
+    with _module_lock:
+        if filepath in _module_cache and _module_cache[filepath][0] == mtime:
+            return _module_cache[filepath][1]
+
+        spec = importlib.util.spec_from_file_location(name, filepath)
+        module = importlib.util.module_from_spec(spec)
+
+        # imports in the module, including imports inside its functions, resolve helper files in its own folder
+        module.__builtins__ = dict(
+            vars(builtins), __import__=_folder_import(filepath.parent)
+        )
+
+        # the module is cached before it is executed so circular imports between helper files get the partially
+        # initialized module, like sys.modules does
+        _module_cache[filepath] = (mtime, module)
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del _module_cache[filepath]
+            raise
+
+    return module
+
+
+def _file_hash(filepath: str) -> str:
+    """Returns the sha256 hash of a file, or None if the file does not exist."""
+    try:
+        with open(filepath, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _context_hash(state) -> str:
+    """Returns a hash of the imports and definitions that are visible to an included file."""
+    modules = sorted(
+        (k, v.__name__ if isinstance(v, ModuleType) else v)
+        for k, v in state.imported_modules.items()
+    )
+    context = repr((modules, sorted(state.defined_macros.items())))
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+
+def _read_cache(cache_path: Path) -> dict:
+    """Returns the cache data for an included file, or None if the cache is missing or unreadable."""
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+class _RunState(object):
+    """
+    State of a single preprocessor run. Each run (and each thread) gets its own state so a preprocessor can be
+    shared between threads.
+    """
+
+    def __init__(
+        self,
+        in_stream: IO,
+        out_stream: IO,
+        imported_modules: dict,
+        defined_macros: dict = None,
+        processed: dict = None,
+        input_stack: list = None,
+    ):
+        self.in_stream = in_stream
+        self.out_stream = out_stream
+        self.out_text = isinstance(out_stream, TextIOBase)
+        self.imported_modules = imported_modules
+        self.defined_macros = {} if defined_macros is None else defined_macros
+
+        self.input_line_num = 1
+
+        self.syntex_map = []
+
+        # files included with \input or \include are processed with their own state, but share the imports,
+        # definitions, and the map of processed files (output path -> (input path, line map)) with the parent.
+        self.processed = {} if processed is None else processed
+        self.input_stack = [] if input_stack is None else input_stack
+        # files that the output depends on, other than the input file (i.e. python modules)
+        self.dependencies = set()
+
+        # figures returned from macros are saved in the background by the figure writer of the top level run
+        self.figure_writer = None
+        self.figure_names = set()
 
 
 class TeXPreprocessor(object):
@@ -18,59 +176,165 @@ class TeXPreprocessor(object):
     NEWLINE = "\n"
     BACKSLASH = "\\"
 
-    def __init__(self, filepath: Path):
-        """
+    def __init__(
+        self,
+        filepath: Path = None,
+        modules: dict = None,
+        module_paths: List[Path] = None,
+        figure_dir: Path = None,
+        figure_writer: utils.FigureWriter = None,
+        macro_worker: MacroWorker = None,
+        build_dir: Path = None,
+    ):
+        r"""
         Parameters:
         -----------
-        filepath: Path | str
-            file path of .tex file to parse.
+        filepath: Path | str, optional
+            file path of .tex file to parse. If not provided, the preprocessor runs entirely in memory and the
+            source text must be given with from_string().
+        modules: dict, optional
+            python modules that are visible to the document without an \import statement. Keys are the alias
+            used in the document, values are either module names or module objects.
+        module_paths: list, optional
+            directories searched for modules imported by the document. Defaults to the folder of the .tex file and
+            the current working directory.
+        figure_dir: Path, optional
+            folder where matplotlib figures returned from macros are saved. Defaults to the figures folder in the
+            build directory. Required for in-memory documents that return figures.
+        figure_writer: FigureWriter, optional
+            pool used to save figures returned from macros. Defaults to a process pool that is created for each run.
+        macro_worker: MacroWorker, optional
+            supervised worker process that runs the python macros, with an optional timeout and memory limit for
+            each call. By default, macros are run in the current process.
+        build_dir: Path, optional
+            folder for the preprocessed files. Defaults to the build folder next to the .tex file. A separate build
+            directory for each run isolates concurrent builds of the same file.
         """
+        self._modules = dict(modules) if modules is not None else {}
+        self._source = None
+        self._local = threading.local()
+        self._figure_dir = Path(figure_dir) if figure_dir is not None else None
+        self._figure_writer = figure_writer
+        self._macro_worker = macro_worker
+
+        if filepath is None:
+            self._infile = None
+            self._outfile = None
+            self._syntex_map_path = None
+            self._module_paths = list(module_paths) if module_paths is not None else []
+            return
+
         self._infile = Path(filepath).resolve()
 
-        build_dir = Path(self._infile).parent / "build"
+        if build_dir is None:
+            build_dir = Path(self._infile).parent / "build"
+        build_dir = Path(build_dir).resolve()
 
-        if not build_dir.is_dir():
-            os.mkdir(build_dir)
+        build_dir.mkdir(parents=True, exist_ok=True)
 
         self._outfile = build_dir / (self._infile.stem + ".tex")
         self._syntex_map_path = build_dir / (self._infile.stem + ".syncmap")
 
-        # add current directory to path so processor can manually import modules
-        sys.path.append(str(Path.cwd()).replace("\\", r"\\"))
+        if module_paths is None:
+            module_paths = [self._infile.parent, Path.cwd()]
+        self._module_paths = list(module_paths)
 
-    def reset(self):
+        if self._figure_dir is None:
+            self._figure_dir = build_dir / "figures"
+
+    @classmethod
+    def from_string(
+        cls, text: str, modules: dict = None, module_paths: List[Path] = None, **kwargs
+    ):
+        r"""
+        Returns a preprocessor that reads the document from a string instead of a file. Nothing is written to disk,
+        use process() to get the preprocessed text.
+
+        Parameters:
+        -----------
+        text: str
+            contents of the .tex document.
+        modules: dict, optional
+            python modules that are visible to the document without an \import statement.
+        module_paths: list, optional
+            directories searched for modules imported by the document.
+        kwargs:
+            passed to the constructor, i.e. figure_dir and figure_writer.
+        """
+        texpp = cls(modules=modules, module_paths=module_paths, **kwargs)
+        texpp._source = text.encode("utf-8")
+        return texpp
+
+    @property
+    def _state(self) -> _RunState:
+        """State of the current run in this thread."""
+        return self._local.state
+
+    @property
+    def _syntex_map(self) -> List[int]:
+        """Line map of the last run in this thread."""
+        return self._state.syntex_map
+
+    @property
+    def _processed(self) -> dict:
+        """
+        Files written by the last run in this thread, including files included with \\input or \\include. Maps the
+        output path to a tuple of the input path and line map.
+        """
+        return self._state.processed
+
+    @property
+    def _input_line_num(self) -> int:
+        """Current line number in the input file."""
+        return self._state.input_line_num
+
+    def reset(self, out_stream: IO = None):
         """
         Resets the stream to the beginning of the input file.
+
+        Parameters:
+        -----------
+        out_stream: IO, optional
+            binary or text stream that receives the preprocessed output. Defaults to the output file in the build
+            directory, or an in-memory buffer if the preprocessor was created from a string.
         """
-        self._in_stream = open(self._infile, "rb")
-        self._out_stream = open(self._outfile, "wb+")
-        self._imported_modules = {}
-        self._defined_macros = {}
+        if self._source is not None:
+            in_stream = BytesIO(self._source)
+        else:
+            in_stream = open(self._infile, "rb")
+
+        if out_stream is None:
+            out_stream = (
+                BytesIO() if self._outfile is None else open(self._outfile, "wb+")
+            )
 
-        self._input_line_num = 1
+        self._local.state = _RunState(in_stream, out_stream, dict(self._modules))
 
-        self._syntex_map = []
+        if self._infile is not None:
+            self._state.input_stack.append(self._infile)
 
     def write(self, data: str):
         """Write decoded data to the working output file."""
-        self._out_stream.write(data.encode())
+        self._state.out_stream.write(data if self._state.out_text else data.encode())
 
         # map the preprocessed line number back to the corresponding line in the original file
         for i in range(data.count("\n")):
             # the input has already seen the new line and incremented the line num, so use the last number
-            self._syntex_map.append(self._input_line_num - 1)
+            self._state.syntex_map.append(self._state.input_line_num - 1)
 
     def syntax_error(self, msg: str):
-        raise SyntaxError("Error on line {}. {}".format(self._input_line_num, msg))
+        raise SyntaxError(
+            "Error on line {}. {}".format(self._state.input_line_num, msg)
+        )
 
     def advance(self, stream=None):
         """Returns the next character in the input stream and advances the current position in the stream."""
         if stream is None:
-            stream = self._in_stream
+            stream = self._state.in_stream
 
         ch = stream.read(1).decode("utf-8")
-        if ch == "\n" and stream == self._in_stream:
-            self._input_line_num += 1
+        if ch == "\n" and stream == self._state.in_stream:
+            self._state.input_line_num += 1
         return ch
 
     def advance_if(self, condition: Callable, stream=None):
@@ -79,14 +343,14 @@ class TeXPreprocessor(object):
         does not advance the stream.
         """
         if stream is None:
-            stream = self._in_stream
+            stream = self._state.in_stream
 
         ch = stream.read(1).decode("utf-8")
 
         if condition(ch):
             # if condition is met, advance the line number if character was new line and return character
-            if ch == "\n" and stream == self._in_stream:
-                self._input_line_num += 1
+            if ch == "\n" and stream == self._state.in_stream:
+                self._state.input_line_num += 1
             return ch
 
         else:
@@ -102,13 +366,13 @@ class TeXPreprocessor(object):
         """
 
         if stream is None:
-            stream = self._in_stream
+            stream = self._state.in_stream
 
         ch = stream.read(1).decode("utf-8")
         read_str = ""
         while condition(ch):
-            if ch == "\n" and stream == self._in_stream:
-                self._input_line_num += 1
+            if ch == "\n" and stream == self._state.in_stream:
+                self._state.input_line_num += 1
             read_str += ch
             ch = stream.read(1).decode("utf-8")
 
@@ -121,11 +385,12 @@ class TeXPreprocessor(object):
     def peek(self, n: int = 1, stream=None):
         """Returns the next n characters in the input stream without advancing the current position."""
         if stream is None:
-            stream = self._in_stream
+            stream = self._state.in_stream
 
-        n_ch = stream.read(n).decode("utf-8")
-        stream.seek(-n, os.SEEK_CUR)
-        return n_ch
+        n_bytes = stream.read(n)
+        # rewind only the bytes that were read, fewer than n are returned at the end of the stream
+        stream.seek(-len(n_bytes), os.SEEK_CUR)
+        return n_bytes.decode("utf-8")
 
     def skip_whitespace(self, allow_break=False):
         """
@@ -226,13 +491,163 @@ class TeXPreprocessor(object):
             else:
                 args[i] = v_replaced
 
-        # find the method pointer from the module and method name
-        module = self._imported_modules[module_name]
-        lib = importlib.__import__(module)
-        method = getattr(lib, method_name)
+        if not events.enabled:
+            return self._call_macro(module_name, method_name, args, kwargs)
+
+        source = dict(file=self._current_file(), line=self._state.input_line_num)
+        events.emit(
+            "on_macro_start",
+            module=module_name,
+            method=method_name,
+            args=args,
+            kwargs=kwargs,
+            **source,
+        )
+
+        t_start = time.perf_counter()
+        try:
+            output = self._call_macro(module_name, method_name, args, kwargs)
+        except Exception as e:
+            seconds = time.perf_counter() - t_start
+            events.emit(
+                "on_macro_end",
+                module=module_name,
+                method=method_name,
+                output=None,
+                error=e,
+                seconds=seconds,
+                **source,
+            )
+            raise
+
+        seconds = time.perf_counter() - t_start
+        events.emit(
+            "on_macro_end",
+            module=module_name,
+            method=method_name,
+            output=output,
+            error=None,
+            seconds=seconds,
+            **source,
+        )
+        return output
+
+    def _current_file(self) -> Path:
+        """Input file of the current run in this thread, None for in-memory documents."""
+        return self._state.input_stack[-1] if len(self._state.input_stack) else None
+
+    def _call_macro(
+        self, module_name: str, method_name: str, args: list, kwargs: dict
+    ) -> str:
+        """Calls a macro with the parsed arguments and returns the replacement text."""
+        module = self._state.imported_modules[module_name]
+
+        if self._macro_worker is not None:
+            return self.macro_output(
+                self._call_worker(module, method_name, args, kwargs)
+            )
+
+        # find the method pointer from the module and method name. Modules are loaded on first use and saved
+        # for the remainder of the run.
+        if not isinstance(module, ModuleType):
+            module = load_module(module, self._module_paths)
+            self._state.imported_modules[module_name] = module
+
+        if getattr(module, "__file__", None) is not None:
+            self._state.dependencies.add(module.__file__)
+
+        method = getattr(module, method_name)
 
         # call the method with the arguments and kwargs and return the result
-        return method(*args, **kwargs)
+        return self.macro_output(method(*args, **kwargs))
+
+    def _call_worker(self, module, method_name: str, args: list, kwargs: dict):
+        """
+        Calls the macro in the worker process and returns the result. Modules are never loaded in this process,
+        the worker loads them from the file path or module name.
+        """
+        if isinstance(module, ModuleType):
+            filepath = getattr(module, "__file__", None)
+            name = module.__name__
+        else:
+            filepath = find_module_file(module, self._module_paths)
+            name = module
+
+        if filepath is not None:
+            self._state.dependencies.add(str(filepath))
+
+        macro = "\\{}\\{}".format(name, method_name)
+        line_num = self._state.input_line_num
+
+        try:
+            return self._macro_worker.call(name, filepath, method_name, args, kwargs)
+        except TimeoutError as e:
+            raise TimeoutError(
+                "Error on line {}. Macro {} {}".format(line_num, macro, e)
+            ) from None
+        except RuntimeError as e:
+            raise RuntimeError(
+                "Error on line {}. Macro {} {}".format(line_num, macro, e)
+            ) from None
+
+    def macro_output(self, output) -> str:
+        """
+        Returns the replacement text for the value returned by a macro. Matplotlib figures are queued to be saved
+        in the background and replaced with the LaTeX code that includes the figure file.
+        """
+        if isinstance(output, DeferredFigure):
+            fig, name = output.fig, output.file
+        elif hasattr(output, "savefig"):
+            fig, name = output, None
+        else:
+            return output
+
+        if self._figure_dir is None:
+            self.syntax_error(
+                "Macro returned a figure, but no figure directory was given."
+            )
+
+        # default file name is generated from the input file name and line number of the macro call
+        if name is None:
+            stem = (
+                self._state.input_stack[-1].stem
+                if len(self._state.input_stack)
+                else "fig"
+            )
+            name = "{}-{}.pdf".format(stem, self._state.input_line_num)
+
+            n = 1
+            while name in self._state.figure_names:
+                name = "{}-{}-{}.pdf".format(stem, self._state.input_line_num, n)
+                n += 1
+
+        elif name in self._state.figure_names:
+            self.syntax_error(
+                "Figure file {} is already used by another figure.".format(name)
+            )
+
+        self._state.figure_names.add(name)
+
+        if self._state.figure_writer is None:
+            self._state.figure_writer = (
+                self._figure_writer
+                if self._figure_writer is not None
+                else utils.FigureWriter()
+            )
+
+        filepath = self._figure_dir / name
+        self._state.figure_writer.submit(fig, filepath)
+
+        # paths in the output are relative to the folder of the input file if possible
+        try:
+            file = filepath.relative_to(self._infile.parent).as_posix()
+        except (ValueError, AttributeError):
+            file = filepath.as_posix()
+
+        if isinstance(output, DeferredFigure):
+            return output.latex(file)
+        else:
+            return r"\includegraphics{" + file + "}"
 
     def parse_until(self, delimiter: Union[str, List[str]], stream=None):
         """
@@ -272,7 +687,7 @@ class TeXPreprocessor(object):
         Returns the replacement text for the macro. Stream cursor must be immediately after the macro name.
         """
 
-        if mname in self._imported_modules.keys():
+        if mname in self._state.imported_modules.keys():
             # expect the method name immediately after the module or alias name, i.e. "\pkg\example_method"
             bkslash = self.advance_if(lambda x: x == self.BACKSLASH, stream)
 
@@ -291,16 +706,18 @@ class TeXPreprocessor(object):
             # call the python method and get the replacement string
             return self.call_pymacro(mname, method_name, stream)
 
-        elif mname in self._defined_macros.keys():
+        elif mname in self._state.defined_macros.keys():
             # get the replacement text in place of the defined macro
-            return self._defined_macros[mname]
+            return self._state.defined_macros[mname]
 
         else:
             # preprocessor does not recognize the macro name
             return "\\" + mname
 
-    def run(self) -> Path:
-        self.reset()
+    def parse(self):
+        """
+        Preprocesses the input stream of the current run until the end of the stream.
+        """
 
         g_ch = " "
         comment = False
@@ -345,7 +762,16 @@ class TeXPreprocessor(object):
 
                 # save the imported module name under the alias name. If no alias was given, the key name is the
                 # same as the module.
-                self._imported_modules[alias] = module
+                self._state.imported_modules[alias] = module
+
+                if events.enabled:
+                    events.emit(
+                        "on_import",
+                        alias=alias,
+                        module=module,
+                        file=self._current_file(),
+                        line=self._state.input_line_num,
+                    )
 
             elif mname == "pydef":
                 # expect another macro call immediately after the \pydef call, i.e. \pydef\test
@@ -361,22 +787,282 @@ class TeXPreprocessor(object):
 
                 # at this point we have read up to "\pydef\test". Now read the assignment string for this variable.
                 # This string can be anything and is a direct replacement for every instance of "\pydef\test".
-                self._defined_macros[varname] = self.advance_while(
+                self._state.defined_macros[varname] = self.advance_while(
                     lambda x: x != self.NEWLINE
                 ).strip()
 
+            elif (
+                mname in ["input", "include"]
+                and self._infile is not None
+                and self.peek() == "{"
+            ):
+                # preprocess included files into the build directory and point the include at the output file
+                self.advance()
+                name = self.parse_until("}")
+                self.advance()
+
+                self.write(
+                    self.BACKSLASH + mname + "{" + self.include_file(name.strip()) + "}"
+                )
+
             else:
                 output = self.get_macro_replacement(mname)
                 self.write(output)
 
-        self._in_stream.close()
-        self._out_stream.close()
+    def include_file(self, name: str) -> str:
+        r"""
+        Preprocesses a file included with \input or \include into the build directory and returns the name of the
+        output file, relative to the folder of the top level .tex file. Returns the name unchanged if the file is not
+        found, i.e. if it is part of the TeX installation.
 
-        # add the last line to the mapping manually since there is no new line character on the last line to trigger the map write
-        self._syntex_map.append(self._input_line_num)
+        Files are not preprocessed again if the content, the imports and definitions visible to the file, and
+        the python modules it uses are all unchanged since the last run.
+        """
+        root_dir = self._infile.parent
+
+        # TeX looks for the file with the .tex extension first
+        filepath = root_dir / (name + ".tex")
+        if not filepath.is_file():
+            filepath = root_dir / name
+
+        if not filepath.is_file():
+            return name
+
+        filepath = filepath.resolve()
+
+        if filepath in self._state.input_stack:
+            self.syntax_error("Recursive include of file: {}.".format(name))
+
+        # mirror the folder structure of the included files inside the build directory
+        try:
+            relative_path = filepath.relative_to(root_dir)
+        except ValueError:
+            relative_path = Path(filepath.name)
+
+        outfile = self._outfile.parent / relative_path
+
+        if outfile.resolve() == self._outfile or outfile.resolve() == filepath:
+            self.syntax_error(
+                "Included file conflicts with the build output: {}.".format(name)
+            )
+
+        self._process_include(filepath, outfile)
+
+        # LaTeX appends the .tex extension to included files. The path is absolute if the build directory is
+        # outside of the document folder, i.e. a scratch directory.
+        try:
+            relative_out = outfile.relative_to(root_dir)
+        except ValueError:
+            relative_out = outfile
+        if relative_out.suffix == ".tex":
+            relative_out = relative_out.with_suffix("")
+
+        return relative_out.as_posix()
+
+    def _process_include(self, filepath: Path, outfile: Path):
+        """
+        Preprocesses an included file with a new state that shares the imports and definitions of the current state.
+        """
+        parent = self._state
+
+        cache_path = outfile.with_suffix(".texcache")
+        syntex_map_path = outfile.with_suffix(".syncmap")
+
+        with open(filepath, "rb") as f:
+            source = f.read()
+
+        cache_key = dict(
+            source=hashlib.sha256(source).hexdigest(), context=_context_hash(parent)
+        )
+
+        cache = _read_cache(cache_path)
+
+        if cache is not None and outfile.exists() and cache["key"] == cache_key:
+            # the output is up to date if none of the python modules or nested includes have changed
+            if all(_file_hash(f) == h for f, h in cache["dependencies"].items()):
+                # restore the imports and definitions made by the file, and the line maps of all written files
+                parent.imported_modules.update(cache["imported_modules"])
+                parent.defined_macros.update(cache["defined_macros"])
+                parent.dependencies.update(cache["dependencies"].keys())
+
+                # the figures of the file were saved by an earlier run, their names are still taken
+                for name in cache.get("figures", []):
+                    if name in parent.figure_names:
+                        self.syntax_error(
+                            "Figure file {} is already used by another figure.".format(
+                                name
+                            )
+                        )
+                    parent.figure_names.add(name)
+
+                for out, inp in cache["processed"]:
+                    with open(Path(out).with_suffix(".syncmap"), "rb") as f:
+                        parent.processed[Path(out)] = (Path(inp), pickle.load(f))
+                return
+
+        outfile.parent.mkdir(parents=True, exist_ok=True)
+
+        modules_before = dict(parent.imported_modules)
+        defined_before = dict(parent.defined_macros)
+        processed_before = set(parent.processed.keys())
+        figures_before = set(parent.figure_names)
+
+        state = _RunState(
+            BytesIO(source),
+            open(outfile, "wb+"),
+            parent.imported_modules,
+            parent.defined_macros,
+            parent.processed,
+            parent.input_stack + [filepath],
+        )
+
+        state.figure_writer = parent.figure_writer
+        state.figure_names = parent.figure_names
+
+        self._local.state = state
+        try:
+            self.parse()
+        finally:
+            state.in_stream.close()
+            state.out_stream.close()
+            self._local.state = parent
+            parent.figure_writer = state.figure_writer
+
+        state.syntex_map.append(state.input_line_num)
+        parent.processed[outfile] = (filepath, state.syntex_map)
+
+        if events.enabled:
+            events.emit("on_write", path=outfile, source=filepath)
+
+        with open(syntex_map_path, "wb") as f:
+            pickle.dump(state.syntex_map, f)
+
+        # nested includes are dependencies of this file since their imports and definitions are visible here
+        processed = [
+            (out, inp)
+            for out, (inp, _) in parent.processed.items()
+            if out not in processed_before
+        ]
+        state.dependencies.update(str(inp) for out, inp in processed if inp != filepath)
+        parent.dependencies.update(state.dependencies)
+
+        cache = dict(
+            key=cache_key,
+            dependencies={f: _file_hash(f) for f in state.dependencies},
+            processed=[(str(out), str(inp)) for out, inp in processed],
+            # imports are saved by module name since module objects can't be pickled
+            imported_modules={
+                k: (v.__name__ if isinstance(v, ModuleType) else v)
+                for k, v in parent.imported_modules.items()
+                if modules_before.get(k) is not v
+            },
+            defined_macros={
+                k: v
+                for k, v in parent.defined_macros.items()
+                if defined_before.get(k) != v
+            },
+            figures=sorted(parent.figure_names - figures_before),
+        )
+
+        with open(cache_path, "wb") as f:
+            pickle.dump(cache, f)
+
+    def join_figures(self):
+        """
+        Waits for all figures of the current run to be saved.
+        """
+        writer = self._state.figure_writer
+        self._state.figure_writer = None
+
+        if writer is None:
+            return
+        elif writer is self._figure_writer:
+            writer.join()
+        else:
+            writer.close()
+
+    def run(self) -> Path:
+        """
+        Preprocesses the input file and writes the output and line map to the build directory. Returns the path of
+        the preprocessed .tex file.
+        """
+        if self._outfile is None:
+            raise ValueError(
+                "Preprocessor has no input file, use process() for in-memory documents."
+            )
+
+        with open(self._outfile, "wb+") as out_stream:
+            self.process(out_stream)
 
         with open(self._syntex_map_path, "wb") as f:
-            pickle.dump(self._syntex_map, f)
-        # np.save(self._syntex_map_path, np.array(self._syntex_map))
+            pickle.dump(self._state.syntex_map, f)
+
+        if events.enabled:
+            events.emit("on_write", path=self._outfile, source=self._infile)
 
         return self._outfile
+
+    def process(self, stream: IO = None) -> Tuple[str, List[int]]:
+        """
+        Preprocesses the document and returns the expanded text and the line map. The line map holds the line
+        number in the input document for each line of the output.
+
+        Parameters:
+        -----------
+        stream: IO, optional
+            binary or text stream to write the output to. If provided, the returned text is None.
+        """
+        self.reset(BytesIO() if stream is None else stream)
+
+        try:
+            self.parse()
+        finally:
+            self._state.in_stream.close()
+            self.join_figures()
+
+        # add the last line to the mapping manually since there is no new line character on the last line to trigger the map write
+        self._state.syntex_map.append(self._state.input_line_num)
+
+        if self._outfile is not None:
+            self._state.processed[self._outfile] = (
+                self._infile,
+                self._state.syntex_map,
+            )
+
+        text = (
+            None
+            if stream is not None
+            else self._state.out_stream.getvalue().decode("utf-8")
+        )
+
+        return text, self._state.syntex_map
+
+
+def preprocess(
+    text: str,
+    modules: dict = None,
+    stream: IO = None,
+    module_paths: List[Path] = None,
+    **kwargs,
+) -> Tuple[str, List[int]]:
+    r"""
+    Preprocesses a .tex document held in memory. Returns the expanded text and the line map, nothing is written to
+    disk.
+
+    Parameters:
+    -----------
+    text: str
+        contents of the .tex document.
+    modules: dict, optional
+        python modules that are visible to the document without an \import statement. Keys are the alias used in
+        the document, values are either module names or module objects.
+    stream: IO, optional
+        binary or text stream to write the output to. If provided, the returned text is None.
+    module_paths: list, optional
+        directories searched for modules imported by the document.
+    kwargs:
+        passed to the TeXPreprocessor constructor, i.e. figure_dir and figure_writer.
+    """
+    return TeXPreprocessor.from_string(text, modules, module_paths, **kwargs).process(
+        stream
+    )
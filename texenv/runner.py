@@ -1,53 +1,177 @@
-import subprocess
+import os
 import shutil
+import tempfile
+import contextlib
+import time
 import click
-import gzip
-import re
 from pathlib import Path
-import platform
 
-from texenv import TeXPreprocessor, utils, packages
+from texenv import TeXPreprocessor, utils, fileops, tlpdb, archive, locking, telemetry
+from texenv.locking import FileLock
+from texenv.worker import MacroWorker
+from texenv.store import Store
 
 
 @click.command()
 @click.argument("command")
 @click.argument("filepath", required=False)
 @click.option("--prompt", default=".venv")
-def cli(command, filepath=None, prompt=None):
+@click.option(
+    "--link",
+    type=click.Choice(fileops.LINK_MODES),
+    default=None,
+    help="How init populates files from the base TeXLive installation, copy by default. With store, install also moves newly installed files into the store. Defaults to the mode the environment was created with for install and init --refresh.",
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    default=False,
+    help="Update an existing environment from the base TeXLive installation with init, instead of creating it again.",
+)
+@click.option(
+    "--details",
+    is_flag=True,
+    default=False,
+    help="Print the revision and installed size of each package with freeze/list.",
+)
+@click.option(
+    "--prune",
+    is_flag=True,
+    default=False,
+    help="Remove packages that are not in the requirements file with sync.",
+)
+@click.option(
+    "--repository",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default=None,
+    help="Install packages with install/sync from a local TeXLive repository without tlmgr.",
+)
+@click.option(
+    "--auto-install",
+    is_flag=True,
+    default=False,
+    help="Install missing LaTeX packages found by run before calling pdflatex.",
+)
+@click.option(
+    "--isolated",
+    is_flag=True,
+    default=False,
+    help="Build in a new scratch directory with run, so concurrent builds of the same file don't share files.",
+)
+@click.option(
+    "--scratch-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=None,
+    help="Parent folder of the isolated build directories, i.e. a tmpfs mount. Implies --isolated.",
+)
+@click.option(
+    "--timeout", type=float, default=None, help="pdflatex timeout in seconds."
+)
+@click.option(
+    "--macro-timeout",
+    type=float,
+    default=None,
+    help="Run python macros in a worker process, with a timeout in seconds for each macro call.",
+)
+@click.option(
+    "--memory-limit",
+    type=float,
+    default=None,
+    help="Run python macros in a worker process, with a memory limit in MB.",
+)
+def cli(
+    command,
+    filepath=None,
+    prompt=None,
+    link=None,
+    refresh=False,
+    details=False,
+    prune=False,
+    repository=None,
+    auto_install=False,
+    isolated=False,
+    scratch_dir=None,
+    timeout=None,
+    macro_timeout=None,
+    memory_limit=None,
+):
+
+    if command == "import":
+        # the environment may not exist yet, and the base installation is not required
+        if filepath is None:
+            click.echo("archive file argument required, i.e. texenv import env.tar.zst")
+            return
+
+        if "VIRTUAL_ENV" not in os.environ:
+            raise RuntimeError(
+                "This command must be run from a virtual environment. To create one use: python -m venv .venv"
+            )
+
+        texdir = Path(os.environ["VIRTUAL_ENV"]) / "tex"
+        if texdir.exists():
+            response = input(
+                f"TeX installation already exists at {texdir}. Overwrite [y/n]?"
+            )
+            if response != "y":
+                raise RuntimeError(f"TeX installation already exists at {texdir}")
+            shutil.rmtree(texdir, ignore_errors=True)
+
+        manifest = archive.import_(Path(filepath).resolve(), texdir)
+        click.echo("Imported {} files to {}".format(manifest["files"], texdir))
+        return
+
+    if command == "stats":
+        # phase timings of a single document, or of all documents built in the folder. The environment is not
+        # required. Presentations keep their stats in their own build folder.
+        path = Path(filepath).resolve() if filepath is not None else Path.cwd()
+        folder, document = (path, None) if path.is_dir() else (path.parent, path.stem)
+
+        stats_paths = [folder / "build" / telemetry.STATS_NAME] + sorted(
+            folder.glob("*_build/" + telemetry.STATS_NAME)
+        )
+        records = sorted(
+            (r for p in stats_paths for r in telemetry.read_stats(p, document)),
+            key=lambda r: r.get("time", 0),
+        )
+        if not records:
+            click.echo("No builds recorded in {}".format(folder))
+            return
 
+        documents = list(dict.fromkeys(r["document"] for r in records))
+        click.echo(
+            "\n\n".join(
+                telemetry.format_stats([r for r in records if r["document"] == d])
+                for d in documents
+            )
+        )
+        return
+
+    t_start = time.perf_counter()
     texpath = utils.get_env_texpath()
-    tlmgr = texpath / "tlmgr"
-    platform_str = platform.system()
+    t_env = time.perf_counter() - t_start
 
     if command == "init":
-        utils.texenv_init(prompt)
+        utils.texenv_init(prompt, link, refresh)
         print("TeX environement setup complete.")
 
     elif command == "freeze" or command == "list":
-
-        proc = subprocess.run(
-            f"{tlmgr} list --only-installed", stdout=subprocess.PIPE, shell=True
-        )
-
-        # parse list of installed packages
-        all_pkgs = [
-            ln[2 : ln.index(":")]
-            for ln in proc.stdout.decode("utf-8").split("\n")
-            if ":" in ln
-        ]
-        # filter all packages that are installed with texenv_init
-        pkgs = [
-            pkg for pkg in all_pkgs if pkg not in packages.install_pkgs[platform_str]
-        ]
+        lines = []
+        for pkg in utils.installed_packages():
+            if details:
+                # sizes in the database are in 4 kB blocks
+                size = pkg.sizes.get("runfiles", 0) + pkg.sizes.get("binfiles", 0)
+                lines.append(f"{pkg.name} {pkg.revision} {size * 4}kB")
+            else:
+                lines.append(pkg.name)
 
         if filepath is not None:
             filepath = Path(filepath).resolve()
 
             with open(filepath, "w+") as f:
-                f.write("\n".join(pkgs))
+                f.write("\n".join(lines))
 
         else:
-            click.echo("\n".join(pkgs))
+            click.echo("\n".join(lines))
 
     elif command == "sync":
         if filepath is None:
@@ -55,101 +179,213 @@ def cli(command, filepath=None, prompt=None):
             return
 
         filepath = Path(filepath).resolve()
-        utils.sync_from_file(filepath)
+        output = utils.sync_from_file(
+            filepath,
+            lockfile=filepath.with_suffix(".lock"),
+            prune=prune,
+            repository=repository,
+        )
+        click.echo(output)
 
     elif command == "install":
         if filepath is None:
             click.echo("package name argument required.")
             return
 
-        with subprocess.Popen(
-            f"{tlmgr} install " + filepath,
-            shell=True,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            bufsize=1,
-            universal_newlines=True,
-        ) as process:
-
-            output = process.communicate()[0]
+        output = utils.install_packages(filepath.split(), repository)
         click.echo(output)
 
-    elif command == "run":
-        filepath = Path(filepath).resolve()
+        if link is None:
+            link = utils.read_env_config().get("link", "copy")
+
+        if link == "store":
+            count = Store().absorb(texpath.parents[1] / "texmf-dist")
+            click.echo(f"Moved {count} files to the texenv store.")
+
+    elif command == "which":
+        if filepath is None:
+            click.echo("file name argument required, i.e. texenv which geometry.sty")
+            return
+
+        providers = utils.available_packages(repository).providers(filepath)
+        if not providers:
+            click.echo(f"{filepath} not found in the TeXLive package database.")
+            return
 
-        texpp = TeXPreprocessor(filepath)
-        outfile = texpp.run()
+        installed = tlpdb.load(texpath.parents[1] / "tlpkg/texlive.tlpdb")
+        for pkg in providers:
+            click.echo(pkg + (" (installed)" if pkg in installed else ""))
 
-        build_dir = outfile.parent
+    elif command == "verify":
+        missing = utils.verify_lsr(texpath.parents[1])
+        if missing:
+            click.echo("Files missing from texmf-dist/ls-R:\n" + "\n".join(missing))
+        else:
+            click.echo("Filename database is consistent with the installed packages.")
 
-        texpath = utils.get_env_texpath()
+    elif command == "export":
+        if filepath is None:
+            click.echo("archive file argument required, i.e. texenv export env.tar.zst")
+            return
 
-        proc = subprocess.run(
-            '{}//pdflatex --synctex=1 --interaction=nonstopmode --halt-on-error --output-directory="{}" {}'.format(
-                texpath, build_dir, outfile
-            ),
-            stdout=subprocess.PIPE,
-            shell=True,
+        manifest = archive.export(texpath.parents[1], Path(filepath).resolve())
+        click.echo(
+            "Exported {} files ({:.1f} MB, {} duplicates stored as links) to {}".format(
+                manifest["files"],
+                manifest["bytes"] / 1e6,
+                manifest["duplicates"],
+                filepath,
+            )
         )
 
-        if proc.returncode:
-            err = utils.parse_pdflatex_error(proc.stdout.decode("utf-8"))
-            raise RuntimeError(
-                "pdfTEX Error on line: {}. {} {}\n {}\n See full log at: {}".format(
-                    err["line"],
-                    err["msg"],
-                    err["src"],
-                    filepath,
-                    build_dir / (filepath.stem + ".log"),
-                )
+    elif command == "store":
+        if filepath != "gc":
+            click.echo("usage: texenv store gc")
+            return
+
+        stats = Store().gc()
+        click.echo(
+            "Removed {} unreferenced files ({:.1f} MB), {} files remain in the store.".format(
+                stats["removed"], stats["bytes"] / 1e6, stats["remaining"]
             )
+        )
 
-        else:
-            gen_pdf = build_dir / (filepath.stem + ".pdf")
-            gen_syn = build_dir / (filepath.stem + ".synctex.gz")
+    elif command == "run":
+        filepath = Path(filepath).resolve()
 
-            out_pdf = filepath.with_suffix(".pdf")
-            out_syn = filepath.with_suffix(".synctex.gz")
+        timeline = telemetry.Timeline(filepath.stem)
+        timeline.add("env", t_env)
+
+        # run macros in a supervised worker process if any limits are given
+        worker = None
+        if macro_timeout is not None or memory_limit is not None:
+            worker = MacroWorker(timeout=macro_timeout, memory_limit=memory_limit)
+
+        try:
+            out_pdf = build_document(
+                filepath,
+                texpath,
+                timeout=timeout,
+                macro_worker=worker,
+                auto_install=auto_install,
+                repository=repository,
+                isolated=isolated or scratch_dir is not None,
+                scratch_dir=scratch_dir,
+                timeline=timeline,
+            )
+        finally:
+            if worker is not None:
+                worker.close()
+            # the stats are kept in the shared build directory, also for isolated builds
+            timeline.write(filepath.parent / "build")
 
-            # update the synctex file
-            input_file_key = None
-            updated_sync_data = ""
-            with gzip.open(gen_syn, mode="rt") as f:
-                for ln in f.readlines():
-                    # look for the number that synctex assigned to the post-processed tex file.
-                    if input_file_key is None:
-                        m = re.match(
-                            r"^input:(\d+):" + str(outfile).replace("\\", "/").lower(),
-                            ln.lower(),
-                        )
+        print("Output PDF written to {}".format(out_pdf))
 
-                        if m is not None:
-                            input_file_key = int(m.group(1))
-                            ln = re.sub(f"build/{filepath.stem}", filepath.stem, ln)
 
-                    else:
-                        ptn = r"^.{},(\d+):".format(input_file_key)
-                        m = re.match(ptn, ln)
+def build_document(
+    filepath: Path,
+    texpath: Path,
+    timeout: float = None,
+    macro_worker: MacroWorker = None,
+    auto_install: bool = False,
+    repository: Path = None,
+    isolated: bool = False,
+    scratch_dir: Path = None,
+    timeline: telemetry.Timeline = None,
+) -> Path:
+    """
+    Preprocesses a .tex file, runs pdflatex and publishes the PDF and synctex file next to the .tex file. Returns
+    the path of the PDF.
+
+    Builds of the same file are serialized with a lock on the build directory. Isolated builds run in a new
+    scratch directory instead and are not serialized. In both cases the PDF and synctex file are replaced
+    atomically.
+
+    Parameters:
+    -----------
+    filepath: Path
+        .tex file.
+    texpath: Path
+        bin folder of the TeX environment.
+    timeout: float, optional
+        pdflatex timeout in seconds.
+    macro_worker: MacroWorker, optional
+        worker process for the python macros.
+    auto_install: bool, default: False
+        install missing LaTeX packages before running pdflatex, see utils.preflight().
+    repository: Path, optional
+        local repository to install missing packages from.
+    isolated: bool, default: False
+        build in a new scratch directory that is removed after a successful build.
+    scratch_dir: Path, optional
+        parent folder of the isolated build directories, i.e. a tmpfs mount. Defaults to the system temp folder.
+    timeline: telemetry.Timeline, optional
+        records the duration of each phase of the build.
+    """
+    timeline = timeline if timeline is not None else telemetry.Timeline(filepath.stem)
+
+    if isolated:
+        build_dir = Path(tempfile.mkdtemp(prefix=filepath.stem + "-", dir=scratch_dir))
+        lock = contextlib.nullcontext()
+    else:
+        build_dir = filepath.parent / "build"
+        lock = FileLock(build_dir / ".texenv.lock")
+
+    with contextlib.ExitStack() as stack:
+        with timeline.phase("lock_wait"):
+            stack.enter_context(lock)
+
+        with timeline.phase("preprocess"):
+            texpp = TeXPreprocessor(
+                filepath, macro_worker=macro_worker, build_dir=build_dir
+            )
+            outfile = texpp.run()
+
+        # check for missing packages before pdflatex runs into them one at a time
+        with timeline.phase("preflight"):
+            utils.preflight(
+                list(texpp._processed),
+                auto_install,
+                repository,
+                search_dirs=[filepath.parent],
+            )
 
-                        if m is not None:
-                            # line number of the postprocessed tex file
-                            output_tex_lnum = int(m.group(1))
-                            # line number of the input tex file before preprocessing
-                            input_tex_lnum = texpp._syntex_map[output_tex_lnum - 1]
+        # run from the folder of the .tex file so included files resolve to the build directory
+        with timeline.phase("pdflatex", file=str(outfile)):
+            proc = utils.run_pdflatex(
+                '{}//pdflatex --synctex=1 --interaction=nonstopmode --halt-on-error --output-directory="{}" {}'.format(
+                    texpath, build_dir, outfile
+                ),
+                cwd=filepath.parent,
+                timeout=timeout,
+            )
 
-                            sub_match = re.sub(
-                                f",{output_tex_lnum}", f",{input_tex_lnum}", m.group(0)
-                            )
+            if proc.returncode:
+                err = utils.parse_pdflatex_error(proc.stdout.decode("utf-8"))
+                raise RuntimeError(
+                    "pdfTEX Error on line: {}. {} {}\n {}\n See full log at: {}".format(
+                        err["line"],
+                        err["msg"],
+                        err["src"],
+                        filepath,
+                        build_dir / (filepath.stem + ".log"),
+                    )
+                )
 
-                            ln = sub_match + ln[m.span()[1] :]
+        gen_pdf = build_dir / (filepath.stem + ".pdf")
+        gen_syn = build_dir / (filepath.stem + ".synctex.gz")
 
-                    updated_sync_data += ln
+        out_pdf = filepath.with_suffix(".pdf")
+        out_syn = filepath.with_suffix(".synctex.gz")
 
-            cmp_data = gzip.compress(updated_sync_data.encode("utf-8"))
-            with open(out_syn, "wb+") as f:
-                f.write(cmp_data)
+        # update the synctex file so it points to the original files instead of the preprocessed files
+        with timeline.phase("synctex"):
+            utils.rewrite_synctex(gen_syn, out_syn, texpp._processed, filepath.parent)
 
-            shutil.copyfile(gen_pdf, out_pdf)
+        with timeline.phase("publish"):
+            locking.publish(gen_pdf, out_pdf)
 
-        print("Output PDF written to {}".format(out_pdf))
+    if isolated:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    return out_pdf
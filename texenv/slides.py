@@ -1,15 +1,128 @@
 from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.transforms import TransformNode
+import matplotlib
 import numpy as np
 from pathlib import Path
 import shutil
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 
 import subprocess
 import webbrowser
 
-from . import utils
+from . import utils, telemetry
+from .locking import FileLock, publish
 
 dir_ = Path(__file__).parent
 
+# figures are saved without a creation date so unchanged figures produce identical files
+FIGURE_METADATA = {"CreationDate": None}
+
+# image formats that are downsampled to the image resolution of the presentation, other formats (i.e. PDF) are
+# copied as they are.
+RASTER_SUFFIXES = (".png", ".jpg", ".jpeg")
+
+# plain pdfTeX file that concatenates the pages of the slide PDFs in incremental mode, each page keeps the size of
+# the slide it came from.
+ASSEMBLY_HEADER = r"""\pdfoutput=1
+\pdfhorigin=0pt
+\pdfvorigin=0pt
+\pdfsuppresswarningpagegroup=1
+\newcount\slidepages
+\newcount\slidepage
+\def\slide#1{%
+  \pdfximage{#1}\slidepages=\pdflastximagepages \slidepage=0
+  \loop\ifnum\slidepage<\slidepages \advance\slidepage by 1
+    \pdfximage page \slidepage {#1}%
+    \setbox0=\hbox{\pdfrefximage\pdflastximage}%
+    \pdfpagewidth=\wd0 \pdfpageheight=\ht0
+    \shipout\box0
+  \repeat}
+"""
+
+
+class _FingerprintPickler(pickle.Pickler):
+    """Pickles a figure without the state that differs between identical figures, see figure_fingerprint()."""
+
+    def reducer_override(self, obj):
+        if not isinstance(obj, (Figure, TransformNode)):
+            return NotImplemented
+
+        rv = obj.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+        if len(rv) < 3 or not isinstance(rv[2], dict):
+            return NotImplemented
+
+        state = dict(rv[2])
+        # pyplot figure number
+        state.pop("_number", None)
+        # transforms reference their parents by id()
+        if "_parents" in state:
+            state["_parents"] = {}
+
+        return rv[:2] + (state,) + rv[3:]
+
+
+def figure_fingerprint(fig: Figure) -> str:
+    """
+    Returns a hash of the artists, size and styling of a figure and the matplotlib settings used to save it.
+    Figures with the same fingerprint produce the same file, so a saved file can be reused. Returns None if the
+    figure can't be pickled, i.e. if it holds a lambda function.
+    """
+    buffer = io.BytesIO()
+    try:
+        _FingerprintPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(fig)
+    except Exception:
+        return None
+
+    h = hashlib.sha256(buffer.getvalue())
+    h.update(matplotlib.__version__.encode("utf-8"))
+    h.update(repr(sorted(matplotlib.rcParams.items())).encode("utf-8"))
+    h.update(repr(FIGURE_METADATA).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _tmp_path(filepath: Path) -> Path:
+    """Temporary file next to filepath with the same extension, so savefig picks the same format."""
+    return filepath.with_name("tmp-{}-{}".format(os.getpid(), filepath.name))
+
+
+def _file_hash(filepath: Path) -> str:
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _resample_image(src: Path, dst: Path, size: tuple):
+    """Saves a copy of the image src resized to size (width, height) in pixels, in the same format."""
+    # PIL is imported on first use, like utils.get_image_size
+    from PIL import Image
+
+    tmp_path = _tmp_path(dst)
+    try:
+        with Image.open(src) as img:
+            fmt = img.format
+            params = (
+                dict(icc_profile=img.info["icc_profile"])
+                if "icc_profile" in img.info
+                else {}
+            )
+            if fmt == "JPEG":
+                params["quality"] = 90
+
+            img.resize(size, Image.LANCZOS).save(tmp_path, format=fmt, **params)
+
+        os.replace(tmp_path, dst)
+    finally:
+        if tmp_path.exists():
+            os.unlink(tmp_path)
+
 
 def datatable(
     data: np.ndarray,
@@ -87,7 +200,15 @@ def datatable(
 
 class Presentation(object):
     def __init__(
-        self, filepath: str, fontsize=tuple((18, 20)), template_path: Path = None
+        self,
+        filepath: str,
+        fontsize=tuple((18, 20)),
+        template_path: Path = None,
+        deferred: bool = False,
+        figure_writer: utils.FigureWriter = None,
+        incremental: bool = False,
+        max_workers: int = None,
+        image_dpi: float = 300,
     ):
         """
         Creates a powerpoint PDF using LaTeX. Requires pdflatex to be installed on the system with the following
@@ -106,6 +227,22 @@ class Presentation(object):
             2-tuple of the text font size and the line spacing, default is (18pt, 20pt)
         template_path: Path, optional
             path to a template .tex file
+        deferred: bool, default: False
+            if True, add_slide only records the figures and save() renders all of them in parallel. Figures must
+            not be changed after they are added to a slide.
+        figure_writer: FigureWriter, optional
+            pool used to render deferred figures. Defaults to a process pool that is created for each save.
+        incremental: bool, default: False
+            if True, each slide is compiled to its own PDF and cached in the build directory by the hash of its
+            LaTeX code and images. save() only compiles the slides that changed since the last save and joins the
+            pages into the output PDF. The first save is slower since pdflatex runs once for each slide.
+        max_workers: int, optional
+            number of slides compiled in parallel in incremental mode, and of images downsampled in parallel.
+            Defaults to the executor default.
+        image_dpi: float, default: 300
+            resolution of PNG and JPEG images on the slides, in pixels per inch of their size on the slide. Larger
+            images are downsampled by save(), smaller images are used as they are. If None, images are never
+            downsampled.
         """
         # width and height of the usuable content area of each slide, in inches
         self.width_in = 12
@@ -121,6 +258,29 @@ class Presentation(object):
         self.build_dir = self.filepath.parent / (self.filepath.stem + "_build")
         self.build_dir.mkdir(parents=True, exist_ok=True)
 
+        # phase timings of the next save, figures are saved as the slides are added
+        self._timeline = telemetry.Timeline(self.filepath.stem, kind="presentation")
+
+        # figures and their output paths that are rendered by the next save in deferred mode
+        self._deferred = deferred
+        self._figure_writer = figure_writer
+        self._pending_figures = []
+
+        # figures are saved once in the cache by their fingerprint, and images are copied once by the hash of their
+        # content. Both are reused by later runs of the same script.
+        self._figure_cache = self.build_dir / "cache" / "figures"
+        self._image_cache = self.build_dir / "cache" / "images"
+        self._cache_files = set()
+        # content hashes of the source images, keyed by path, size and modification time
+        self._image_hashes = {}
+
+        # downsampled images that are saved by the next save, the source path and pixel size keyed by cached path
+        self._image_dpi = image_dpi
+        self._pending_images = {}
+
+        self._incremental = incremental
+        self._max_workers = max_workers
+
         # template file
         if template_path is None:
             template_path = dir_ / "templates/default.tex"
@@ -136,34 +296,220 @@ class Presentation(object):
             r"\graphicspath{{" + template_dir + "}}\n\n\\begin{document}",
         )
 
-    def save(self, clean: bool = True):
+        # document up to the first slide, and the LaTeX code of each slide, used to compile slides separately
+        self._preamble = self.data
+        self._slides = []
+
+    def save(self, clean: bool = True, timeout: float = None):
         """
         Writes the slide data to a temporary .tex file and generates the PDF.
 
         Parameters:
         -----------
         clean: bool
-            If true, remove the temporary build directory after a successful save.
-            If save fails, the temporary directory is not removed, even if clean is True.
+            If true, remove the temporary files in the build directory after a successful save. The figure and
+            slide caches are kept for the next run. If save fails, the temporary files are not removed, even if
+            clean is True.
+        timeout: float, optional
+            pdflatex timeout in seconds. Defaults to no limit.
+        """
+
+        timeline, self._timeline = self._timeline, telemetry.Timeline(
+            self.filepath.stem, kind="presentation"
+        )
+
+        try:
+            with timeline.phase("figures"):
+                self.render_figures()
+
+            with timeline.phase("images"):
+                self.resample_images()
+
+            plt.close("all")
+            self._compile(timeline, clean, timeout)
+        finally:
+            # the stats file is kept when the build directory is cleaned. Time spent between adding slides is not
+            # part of the build.
+            timeline.write(self.build_dir, total=sum(timeline.phases.values()))
+
+    def render_figures(self):
+        """
+        Saves the figures of the slides added in deferred mode. Called by save(). The figures are written to
+        temporary files first, so a failed save never leaves a partial file in the figure cache.
+        """
+        # figures with the same fingerprint are only saved once
+        pending = dict((filepath, fig) for fig, filepath in self._pending_figures)
+        self._pending_figures = []
+        if not len(pending):
+            return
+
+        writer = (
+            self._figure_writer
+            if self._figure_writer is not None
+            else utils.FigureWriter()
+        )
+        try:
+            for filepath, fig in pending.items():
+                writer.submit(fig, _tmp_path(filepath), metadata=FIGURE_METADATA)
+            writer.join()
+
+            for filepath in pending:
+                os.replace(_tmp_path(filepath), filepath)
+        finally:
+            if writer is not self._figure_writer:
+                writer.close()
+
+            for filepath in pending:
+                if _tmp_path(filepath).exists():
+                    os.unlink(_tmp_path(filepath))
+
+    def resample_images(self):
+        """
+        Saves the downsampled images of the slides in a thread pool. Called by save(). PIL releases the GIL while
+        decoding and resizing, so the images are resampled in parallel.
+        """
+        pending, self._pending_images = self._pending_images, {}
+        if not len(pending):
+            return
+
+        with ThreadPoolExecutor(self._max_workers) as pool:
+            futures = [
+                pool.submit(_resample_image, src, dst, size)
+                for dst, (src, size) in pending.items()
+            ]
+            for future in futures:
+                future.result()
+
+    def _image_size(
+        self, filepath: Path, w_px: int, h_px: int, w_col: float, h_row: float
+    ) -> tuple:
+        """
+        Returns the size in pixels an image is downsampled to, so it has image_dpi pixels per inch in a minipage of
+        w_col by h_row inches, or None if the image is already small enough.
+        """
+        if (
+            self._image_dpi is None
+            or Path(filepath).suffix.lower() not in RASTER_SUFFIXES
+        ):
+            return None
+
+        # same rule as the width or height set on includegraphics in _generate_slide_data
+        if w_px / w_col > h_px / h_row:
+            scale = w_col * self._image_dpi / w_px
+        else:
+            scale = h_row * self._image_dpi / h_px
+
+        if scale >= 1:
+            return None
+
+        return max(1, round(w_px * scale)), max(1, round(h_px * scale))
+
+    def _figure_path(self, fig: Figure, default: Path) -> Path:
+        """
+        Returns the path of a figure in the figure cache, or the default path if the figure has no fingerprint.
+        """
+        fingerprint = figure_fingerprint(fig)
+        if fingerprint is None:
+            return default
+
+        self._figure_cache.mkdir(parents=True, exist_ok=True)
+        filepath = self._figure_cache / (fingerprint + ".pdf")
+        self._cache_files.add(filepath)
+        return filepath
+
+    def _image_path(self, filepath: Path, size: tuple = None) -> Path:
+        """
+        Copies an image to the image cache, named by the hash of its content, and returns the cached path. Images
+        that are used on several slides, or copies of the same image, are only copied once. If size is given, the
+        cached image is downsampled to size (width, height) in pixels by the next save().
         """
+        st = os.stat(filepath)
+        key = (str(Path(filepath).resolve()), st.st_size, st.st_mtime_ns)
+        if key not in self._image_hashes:
+            self._image_hashes[key] = _file_hash(filepath)
+
+        if size is not None:
+            cached = self._image_cache / "{}-{}x{}{}".format(
+                self._image_hashes[key], *size, Path(filepath).suffix
+            )
+        else:
+            cached = self._image_cache / (
+                self._image_hashes[key] + Path(filepath).suffix
+            )
+        self._cache_files.add(cached)
+
+        if size is not None:
+            self._image_cache.mkdir(parents=True, exist_ok=True)
+            if not cached.exists():
+                self._pending_images[cached] = (filepath, size)
+        elif not cached.exists():
+            self._image_cache.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(filepath, _tmp_path(cached))
+            os.replace(_tmp_path(cached), cached)
+
+        return cached
+
+    def _prune_cache(self):
+        """Removes figures and images from previous runs that are not used by this presentation."""
+        for cache_dir in (self._figure_cache, self._image_cache):
+            if not cache_dir.exists():
+                continue
+
+            for filepath in cache_dir.iterdir():
+                # temporary files may belong to another process that is saving figures
+                if filepath not in self._cache_files and not filepath.name.startswith(
+                    "tmp-"
+                ):
+                    os.unlink(filepath)
+
+    def _compile(self, timeline: telemetry.Timeline, clean: bool, timeout: float):
+        """Runs pdflatex on the slide data and copies the PDF to the output path, see save()."""
+        # serialize saves of the same presentation, they share the build directory
+        with contextlib.ExitStack() as stack:
+            with timeline.phase("lock_wait"):
+                stack.enter_context(
+                    FileLock(
+                        self.filepath.parent / (self.filepath.stem + "_build.lock")
+                    )
+                )
+
+            self.build_dir.mkdir(parents=True, exist_ok=True)
+
+            with timeline.phase("env"):
+                texpath = utils.get_env_texpath()
+
+            if self._incremental and len(self._slides):
+                self._compile_slides(timeline, texpath, timeout)
+            else:
+                texfilepath = self.build_dir / (self.filepath.stem + ".tex")
+
+                with open(texfilepath, "w+") as output:
+                    output.write(self.data + "\n\\end{document}")
 
-        plt.close("all")
+                # generate PDF by running pdflatex
+                with timeline.phase("pdflatex"):
+                    self._run_pdflatex(texpath, texfilepath.name, timeout)
 
-        texfilepath = self.build_dir / (self.filepath.stem + ".tex")
+            # copy the generated PDF from the build directory to the specified path, readers never see a partial file
+            with timeline.phase("publish"):
+                publish(self.build_dir / self.filepath.name, self.filepath)
 
-        with open(texfilepath, "w+") as output:
-            output.write(self.data + "\n\\end{document}")
+            self._prune_cache()
 
-        texpath = utils.get_env_texpath()
+            print(f"Presentation saved to: {self.filepath}")
+            if clean:
+                self._clean()
 
-        # generate PDF by running pdflatex
-        proc = subprocess.run(
-            "{}//pdflatex --interaction=nonstopmode --halt-on-error {}".format(
-                texpath, self.filepath.stem + ".tex"
+    def _run_pdflatex(
+        self, texpath: Path, texname: str, timeout: float, program: str = "pdflatex"
+    ):
+        """Runs pdflatex on a .tex file in the build directory, raises a RuntimeError if it fails."""
+        proc = utils.run_pdflatex(
+            "{}//{} --interaction=nonstopmode --halt-on-error {}".format(
+                texpath, program, texname
             ),
-            stdout=subprocess.PIPE,
             cwd=self.build_dir,
-            shell=True,
+            timeout=timeout,
         )
 
         if proc.returncode:
@@ -173,20 +519,95 @@ class Presentation(object):
                     err["line"],
                     err["msg"],
                     err["src"],
-                    self.build_dir / (self.filepath.stem + ".log"),
+                    self.build_dir / (Path(texname).stem + ".log"),
                 )
             )
 
-        else:
-            # copy the generated PDF from the build directory to the specified path
-            shutil.copyfile(self.build_dir / self.filepath.name, self.filepath)
-            print(f"Presentation saved to: {self.filepath}")
-            if clean:
-                # remove the temporary directory
-                try:
-                    shutil.rmtree(self.build_dir)
-                except Exception:
-                    pass
+    def _slide_tex(self, index: int) -> str:
+        """Returns a standalone document with a single slide, numbered as in the full presentation."""
+        page = "\n\\setcounter{page}{" + str(index + 1) + "}\n"
+        return self._preamble + page + self._slides[index] + "\n\\end{document}"
+
+    def _slide_hash(self, index: int, tex: str) -> str:
+        """Returns the hash of the LaTeX code of a slide and the images and figures in its folder."""
+        h = hashlib.sha256(tex.encode("utf-8"))
+
+        slide_dir = self.build_dir / f"slide{index}"
+        if slide_dir.exists():
+            for filepath in sorted(slide_dir.rglob("*")):
+                if filepath.is_file():
+                    h.update(filepath.relative_to(slide_dir).as_posix().encode("utf-8"))
+                    h.update(_file_hash(filepath).encode("utf-8"))
+
+        return h.hexdigest()
+
+    def _compile_slides(
+        self, timeline: telemetry.Timeline, texpath: Path, timeout: float
+    ):
+        """
+        Compiles the slides that are not in the slide cache in parallel, and joins the cached slide PDFs into the
+        presentation PDF in the build directory. Slides from previous saves that are no longer used are removed
+        from the cache.
+        """
+        cache_dir = self.build_dir / "cache" / "slides"
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        slides = []
+        for i in range(len(self._slides)):
+            tex = self._slide_tex(i)
+            slides.append((i, tex, cache_dir / (self._slide_hash(i, tex) + ".pdf")))
+
+        def compile_slide(i, tex, cached):
+            name = f"{self.filepath.stem}-slide{i}"
+            with open(self.build_dir / (name + ".tex"), "w") as f:
+                f.write(tex)
+
+            try:
+                self._run_pdflatex(texpath, name + ".tex", timeout)
+            except RuntimeError as e:
+                raise RuntimeError("Slide {}: {}".format(i + 1, e)) from None
+
+            os.replace(self.build_dir / (name + ".pdf"), cached)
+
+        changed = [slide for slide in slides if not slide[2].exists()]
+        with timeline.phase("pdflatex"):
+            with ThreadPoolExecutor(self._max_workers) as pool:
+                # raise the first error after all slides finished
+                for future in [pool.submit(compile_slide, *slide) for slide in changed]:
+                    future.result()
+
+        # join the pages of all slides with plain pdfTeX, the slides are not compiled again
+        with timeline.phase("assemble"):
+            with open(self.build_dir / (self.filepath.stem + ".tex"), "w") as f:
+                f.write(ASSEMBLY_HEADER)
+                for _, _, cached in slides:
+                    f.write(
+                        "\\slide{"
+                        + cached.relative_to(self.build_dir).as_posix()
+                        + "}\n"
+                    )
+                f.write("\\bye\n")
+
+            self._run_pdflatex(
+                texpath, self.filepath.stem + ".tex", timeout, program="pdftex"
+            )
+
+        used = set(cached for _, _, cached in slides)
+        for cached in cache_dir.glob("*.pdf"):
+            if cached not in used:
+                os.unlink(cached)
+
+    def _clean(self):
+        """Removes the files in the build directory, except for the caches used by the next save and the stats."""
+        keep = (self.build_dir / "cache", self.build_dir / telemetry.STATS_NAME)
+
+        for path in self.build_dir.iterdir():
+            if path in keep:
+                continue
+            elif path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink()
 
     def open(self):
         self.save()
@@ -295,7 +716,8 @@ class Presentation(object):
             + r"}"
         )
         # add slide data to the presentation
-        self.data += title_data + "\n" + slide_data + "\n\n\\pagebreak\n\n"
+        self._slides.append(title_data + "\n" + slide_data + "\n\n\\pagebreak\n\n")
+        self.data += self._slides[-1]
         self.slide_counter += 1
 
     def _generate_slide_data(self, content, width_columns, height_rows):
@@ -351,25 +773,54 @@ class Presentation(object):
                         continue
 
                     elif isinstance(item, Path):
-                        # if item is a path to an image file, copy the image to the temporary build directory
+                        # if item is a path to an image file, copy the image to the image cache in the build directory
                         # and insert into the doc with includegraphics macro. This macro sets the height or width,
-                        shutil.copyfile(item, slide_img_path / item.name)
-
-                        w_im, h_im = utils.get_image_size(item, normalize=True)
-                        relative_path = f"slide{self.slide_counter}/" + item.stem
+                        # large images are downsampled to the size of the minipage.
+                        with self._timeline.phase("images"):
+                            w_px, h_px = utils.get_image_size(item)
+                            cached = self._image_path(
+                                item, self._image_size(item, w_px, h_px, w_col, h_row)
+                            )
+
+                        w_im, h_im = utils.normalize_dimensions(w_px, h_px)
+                        # every slide that shows the same image references the same file
+                        relative_path = (
+                            cached.relative_to(self.build_dir)
+                            .with_suffix("")
+                            .as_posix()
+                        )
                     elif isinstance(item, plt.Figure):
                         # if item is a mpl Figure, get the fig size and save to the build folder
                         w_im, h_im = utils.get_figure_size(item, normalize=True)
 
-                        try:
-                            item.tight_layout()
-                        except Exception:
-                            pass
-
-                        item.savefig(slide_img_path / f"fig{fig_counter}.pdf")
-                        relative_path = (
-                            f"slide{self.slide_counter}/fig{fig_counter}.pdf"
+                        filepath = self._figure_path(
+                            item, slide_img_path / f"fig{fig_counter}.pdf"
                         )
+
+                        if filepath.exists() and filepath.parent == self._figure_cache:
+                            # saved by a previous run, or by an earlier slide
+                            pass
+                        elif self._deferred:
+                            # the layout is applied when the figure is rendered by save()
+                            try:
+                                item.set_layout_engine("tight")
+                            except Exception:
+                                pass
+
+                            self._pending_figures.append((item, filepath))
+                        else:
+                            try:
+                                item.tight_layout()
+                            except Exception:
+                                pass
+
+                            with self._timeline.phase("figures"):
+                                item.savefig(
+                                    _tmp_path(filepath), metadata=FIGURE_METADATA
+                                )
+                                os.replace(_tmp_path(filepath), filepath)
+
+                        relative_path = filepath.relative_to(self.build_dir).as_posix()
                         fig_counter += 1
                     else:
                         raise ValueError(f"Unrecognized content type: {type(item)}")
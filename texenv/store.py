@@ -0,0 +1,204 @@
+from pathlib import Path
+import hashlib
+import os
+import pickle
+import shutil
+import stat
+import threading
+
+# files are hashed in chunks so large fonts and binaries are never read into memory at once
+CHUNK_SIZE = 1 << 20
+
+
+class Store(object):
+    """
+    Per-user content-addressed store of TeX files. Each file is stored once by the hash of its content, and
+    environments are populated with hard links to the stored objects, so environments created from the same
+    base installation share their files on disk.
+
+    An object is unreferenced when its link count drops to one (the store itself), i.e. after all environments
+    that used it are deleted. Unreferenced objects are removed with gc().
+    """
+
+    def __init__(self, root: Path = None):
+        """
+        Parameters:
+        -----------
+        root: Path, optional
+            store directory. Defaults to the "store" folder in the texenv cache directory.
+        """
+        # utils imports this module through fileops, so it is imported on first use
+        from . import utils
+
+        self.root = Path(root) if root is not None else utils.cache_dir() / "store"
+        self.objects = self.root / "objects"
+
+        self._lock = threading.Lock()
+        self._hashes = None
+
+    @property
+    def _hashes_path(self) -> Path:
+        return self.root / "hashes.pickle"
+
+    def _load_hashes(self) -> dict:
+        """
+        Returns the hashes of source files from previous runs, keyed by path and validated by size and
+        modification time, so the base installation is only hashed once.
+        """
+        if self._hashes is None:
+            try:
+                with open(self._hashes_path, "rb") as f:
+                    self._hashes = pickle.load(f)
+            except Exception:
+                self._hashes = {}
+        return self._hashes
+
+    def save(self):
+        """
+        Writes the source file hashes to disk. Called after populating an environment.
+        """
+        with self._lock:
+            if self._hashes is None:
+                return
+            hashes = dict(self._hashes)
+
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first so other processes never read a partial file
+            tmp_path = self._hashes_path.with_suffix(".{}.tmp".format(os.getpid()))
+            with open(tmp_path, "wb") as f:
+                pickle.dump(hashes, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._hashes_path)
+        except OSError:
+            # the hashes are only an optimization
+            pass
+
+    def file_hash(self, filepath: Path, st: os.stat_result = None) -> str:
+        """
+        Returns the sha256 hash of a file. The executable bit is part of the hash since objects share their mode
+        with every link.
+        """
+        filepath = str(Path(filepath).resolve())
+        st = os.stat(filepath) if st is None else st
+        key = (st.st_size, st.st_mtime_ns)
+
+        with self._lock:
+            entry = self._load_hashes().get(filepath)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        h = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+
+        digest = h.hexdigest() + ("x" if st.st_mode & stat.S_IXUSR else "")
+
+        with self._lock:
+            self._hashes[filepath] = (key, digest)
+
+        return digest
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def add(self, filepath: Path) -> Path:
+        """
+        Adds a file to the store if its content is not stored yet, and returns the path of the stored object.
+        """
+        st = os.stat(filepath)
+        obj = self.object_path(self.file_hash(filepath, st))
+
+        if obj.exists():
+            return obj
+
+        obj.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = obj.with_name(
+            "{}.{}.{}.tmp".format(obj.name, os.getpid(), threading.get_ident())
+        )
+        shutil.copy2(filepath, tmp_path)
+
+        # objects are shared by all environments, so they are made read-only to prevent edits in place
+        os.chmod(
+            tmp_path,
+            stat.S_IMODE(st.st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH),
+        )
+
+        try:
+            # another process may have stored the same content in the meantime, keep the existing object so
+            # links to it stay valid.
+            os.link(tmp_path, obj)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+
+        return obj
+
+    def link(self, src: Path, dst: Path):
+        """
+        Adds src to the store and creates dst as a hard link to the stored object. Raises OSError if hard links
+        are not supported, i.e. if dst is on a different filesystem than the store.
+        """
+        os.link(self.add(src), dst)
+
+    def absorb(self, root: Path) -> int:
+        """
+        Replaces the files in a directory tree with hard links to the store, i.e. after packages were installed
+        into an environment. Files that are already linked are skipped. Returns the number of files absorbed.
+        """
+        count = 0
+        try:
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    filepath = Path(dirpath) / name
+                    st = os.lstat(filepath)
+
+                    if not stat.S_ISREG(st.st_mode) or st.st_nlink > 1:
+                        continue
+
+                    tmp_path = filepath.with_name(name + ".texenv.tmp")
+                    os.link(self.add(filepath), tmp_path)
+                    os.replace(tmp_path, filepath)
+                    count += 1
+
+        except OSError:
+            # the tree is on a different filesystem than the store, the remaining files stay copies
+            pass
+
+        self.save()
+        return count
+
+    def gc(self) -> dict:
+        """
+        Removes objects that are not linked from any environment.
+
+        Returns:
+        --------
+        dict:
+            number of removed objects and freed bytes, and number of remaining objects.
+        """
+        removed, freed, remaining = 0, 0, 0
+
+        if self.objects.exists():
+            for dirpath, _, filenames in os.walk(self.objects):
+                for name in filenames:
+                    filepath = Path(dirpath) / name
+                    st = os.lstat(filepath)
+
+                    # leftovers of interrupted writes are never linked
+                    if st.st_nlink == 1 or name.endswith(".tmp"):
+                        os.unlink(filepath)
+                        removed += 1
+                        freed += st.st_size
+                    else:
+                        remaining += 1
+
+        # forget hashes of source files that no longer exist
+        with self._lock:
+            hashes = self._load_hashes()
+            for filepath in [k for k in hashes if not os.path.exists(k)]:
+                del hashes[filepath]
+        self.save()
+
+        return dict(removed=removed, bytes=freed, remaining=remaining)
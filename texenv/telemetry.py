@@ -0,0 +1,237 @@
+from pathlib import Path
+import contextlib
+import json
+import statistics
+import time
+from typing import Callable, List
+
+# phase timings of every build are appended to this file in the build directory
+STATS_NAME = "texenv-stats.jsonl"
+
+# number of previous builds the latest build is compared against
+WINDOW = 10
+# a phase regressed if it is this much slower than the median of the previous builds
+THRESHOLD = 1.25
+# phases shorter than this are too noisy to compare
+MIN_SECONDS = 0.05
+
+# callables that return a context manager wrapped around each phase, see add_span_hook()
+_span_hooks = []
+
+
+def add_span_hook(hook: Callable):
+    """
+    Registers a hook that is called with the phase name and a dictionary of attributes when a phase starts, and
+    returns a context manager that is exited when the phase ends. This matches the OpenTelemetry tracer API, so
+    spans are exported with:
+
+        tracer = opentelemetry.trace.get_tracer("texenv")
+        telemetry.add_span_hook(lambda name, attributes: tracer.start_as_current_span(name, attributes=attributes))
+    """
+    _span_hooks.append(hook)
+
+
+def remove_span_hook(hook: Callable):
+    """Removes a hook registered with add_span_hook()."""
+    _span_hooks.remove(hook)
+
+
+class Timeline(object):
+    """
+    Records the duration of the phases of a single build. Phases that run more than once, i.e. saving each
+    figure of a presentation, are added up.
+    """
+
+    def __init__(self, document: str, kind: str = "run"):
+        """
+        Parameters:
+        -----------
+        document: str
+            name of the built document, used to tell builds of different documents apart in the stats file.
+        kind: str, default: "run"
+            type of build, "run" for texenv run and "presentation" for Presentation.save.
+        """
+        self.document = document
+        self.kind = kind
+        self.phases = {}
+        self.status = "ok"
+        self._t_start = time.perf_counter()
+
+    def add(self, name: str, seconds: float):
+        """Adds the duration of a phase that was measured elsewhere."""
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def phase(self, name: str, **attributes):
+        """
+        Context manager that times a phase. Keyword arguments are passed to the span hooks as attributes.
+        """
+        with contextlib.ExitStack() as spans:
+            for hook in _span_hooks:
+                spans.enter_context(
+                    hook(name, dict(attributes, document=self.document))
+                )
+
+            t_start = time.perf_counter()
+            try:
+                yield
+            except BaseException:
+                self.status = "error"
+                raise
+            finally:
+                self.add(name, time.perf_counter() - t_start)
+
+    def record(self, total: float = None) -> dict:
+        return dict(
+            time=time.time(),
+            document=self.document,
+            kind=self.kind,
+            status=self.status,
+            total=total if total is not None else time.perf_counter() - self._t_start,
+            phases=self.phases,
+        )
+
+    def write(self, build_dir: Path, total: float = None):
+        """
+        Appends the phase timings as a single line to the stats file in build_dir. Errors are ignored since the
+        stats must never fail a build.
+
+        Parameters:
+        -----------
+        build_dir: Path
+            folder of the stats file.
+        total: float, optional
+            total duration of the build. Defaults to the time since the timeline was created.
+        """
+        try:
+            Path(build_dir).mkdir(parents=True, exist_ok=True)
+            # a single write call per line, so concurrent builds don't interleave lines
+            with open(Path(build_dir) / STATS_NAME, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.record(total)) + "\n")
+        except OSError:
+            pass
+
+
+def read_stats(stats_path: Path, document: str = None) -> List[dict]:
+    """
+    Returns the records from a stats file, oldest first. Lines that can't be parsed, i.e. from an interrupted
+    write, are skipped.
+
+    Parameters:
+    -----------
+    stats_path: Path
+        stats file written by Timeline.write().
+    document: str, optional
+        only return the records of this document.
+    """
+    records = []
+    if not Path(stats_path).exists():
+        return records
+
+    with open(stats_path, "r", encoding="utf-8") as f:
+        for ln in f:
+            try:
+                rec = json.loads(ln)
+            except ValueError:
+                continue
+            if document is None or rec.get("document") == document:
+                records.append(rec)
+
+    return records
+
+
+def regressions(
+    records: List[dict],
+    window: int = WINDOW,
+    threshold: float = THRESHOLD,
+    min_seconds: float = MIN_SECONDS,
+) -> List[tuple]:
+    """
+    Compares the phases of the latest successful build against the rolling median of the previous successful
+    builds of the same document.
+
+    Parameters:
+    -----------
+    records: list
+        records from read_stats() of a single document, oldest first.
+    window: int, default: 10
+        number of previous builds in the median.
+    threshold: float, default: 1.25
+        ratio to the median above which a phase is reported.
+    min_seconds: float, default: 0.05
+        phases faster than this are not reported.
+
+    Returns:
+    --------
+    list:
+        tuples of the phase name, latest duration and median duration in seconds.
+    """
+    records = [r for r in records if r.get("status") == "ok"]
+    if len(records) < 2:
+        return []
+
+    latest, previous = records[-1], records[-window - 1 : -1]
+    found = []
+    for name, seconds in sorted(dict(latest["phases"], total=latest["total"]).items()):
+        history = [
+            r["total"] if name == "total" else r["phases"].get(name) for r in previous
+        ]
+        history = [s for s in history if s is not None]
+        if not history:
+            continue
+
+        median = statistics.median(history)
+        if seconds >= min_seconds and seconds > median * threshold:
+            found.append((name, seconds, median))
+
+    return found
+
+
+def format_stats(
+    records: List[dict], window: int = WINDOW, threshold: float = THRESHOLD
+) -> str:
+    """
+    Returns a table with the duration of each phase in the latest build of a document, the median and range of
+    the previous builds, and the phases that regressed.
+    """
+    ok = [r for r in records if r.get("status") == "ok"]
+    if not ok:
+        return "No successful builds recorded."
+
+    latest, previous = ok[-1], ok[-window - 1 : -1]
+    regressed = {
+        name: median for name, _, median in regressions(records, window, threshold)
+    }
+
+    lines = [
+        "{}: {} builds, {} failed".format(
+            latest["document"], len(records), len(records) - len(ok)
+        ),
+        "recent totals: "
+        + " ".join("{:.2f}s".format(r["total"]) for r in ok[-window:]),
+        "{:<20} {:>9} {:>9} {:>9} {:>9}".format(
+            "phase", "latest", "median", "min", "max"
+        ),
+    ]
+    for name, current in list(latest["phases"].items()) + [("total", latest["total"])]:
+        history = [
+            r["total"] if name == "total" else r["phases"].get(name) for r in previous
+        ]
+        history = [s for s in history if s is not None]
+
+        if history:
+            ln = "{:<20} {:>8.3f}s {:>8.3f}s {:>8.3f}s {:>8.3f}s".format(
+                name, current, statistics.median(history), min(history), max(history)
+            )
+        else:
+            ln = "{:<20} {:>8.3f}s {:>9} {:>9} {:>9}".format(
+                name, current, "-", "-", "-"
+            )
+
+        if name in regressed:
+            ln += "  regressed, {:.0f}% slower than median".format(
+                (current / regressed[name] - 1) * 100
+            )
+        lines.append(ln)
+
+    return "\n".join(lines)
@@ -0,0 +1,339 @@
+from pathlib import Path
+import hashlib
+import os
+import pickle
+import threading
+from collections import deque
+from collections.abc import Mapping
+from typing import List, Tuple
+
+from . import utils
+
+# file lists in a package listing. Each is followed by lines of file paths that start with a space.
+FILE_KEYS = ("runfiles", "binfiles", "srcfiles", "docfiles")
+
+# bump when the format of the parsed index changes so old caches are not used
+INDEX_VERSION = 1
+
+# parsed databases of this process, keyed by the resolved file path
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class Package(object):
+    """
+    Entry of the TeXLive package database. File lists are stored as a single string in the index, and split on
+    first access.
+    """
+
+    def __init__(self, name: str, data: tuple):
+        self.name = name
+        (
+            self.revision,
+            self.relocated,
+            self.depends,
+            self.sizes,
+            self._files,
+            self._span,
+        ) = data
+        self._split = {}
+
+    def files(self, key: str) -> List[str]:
+        """
+        Returns the file paths of a file list, i.e. runfiles. Paths are relative to the TeXLive installation
+        directory, or to texmf-dist if the package is relocated.
+        """
+        if key not in self._split:
+            files = self._files.get(key, "")
+            self._split[key] = files.split("\n") if files else []
+        return self._split[key]
+
+    @property
+    def runfiles(self) -> List[str]:
+        return self.files("runfiles")
+
+    @property
+    def binfiles(self) -> List[str]:
+        return self.files("binfiles")
+
+    @property
+    def srcfiles(self) -> List[str]:
+        return self.files("srcfiles")
+
+    @property
+    def docfiles(self) -> List[str]:
+        return self.files("docfiles")
+
+
+class TLPDB(Mapping):
+    """
+    Parsed TeXLive Package Database, maps package names to Package objects. Packages are created on first access.
+    """
+
+    def __init__(self, pdb_path: Path, packages: dict):
+        self.pdb_path = Path(pdb_path)
+        self._packages = packages
+        self._cache = {}
+        self._text = None
+        self._providers = None
+
+    def __getitem__(self, name: str) -> Package:
+        if name not in self._cache:
+            self._cache[name] = Package(name, self._packages[name])
+        return self._cache[name]
+
+    def __iter__(self):
+        return iter(self._packages)
+
+    def __len__(self):
+        return len(self._packages)
+
+    def __contains__(self, name):
+        return name in self._packages
+
+    def providers(self, filename: str) -> List[str]:
+        """
+        Returns the names of the packages with a run file of the given name, i.e. "geometry.sty". The reverse index
+        of file names is built on first use.
+        """
+        if self._providers is None:
+            providers = {}
+            for name, data in self._packages.items():
+                runfiles = data[4].get("runfiles")
+                if not runfiles:
+                    continue
+                for path in runfiles.split("\n"):
+                    providers.setdefault(path.rpartition("/")[2], []).append(name)
+            self._providers = providers
+
+        return self._providers.get(filename, [])
+
+    def listing(self, name: str) -> str:
+        """
+        Returns all lines of the package listing after the name line. The listing is read from the database file,
+        which is expected to be unchanged since it was parsed.
+        """
+        if self._text is None:
+            with open(self.pdb_path, "r", encoding="utf-8") as f:
+                self._text = f.read()
+
+        start, end = self._packages[name][5]
+        listing = self._text[start:end]
+        return listing if listing[-1:] in ["\n", ""] else listing + "\n"
+
+
+def parse(pdb_path: Path) -> TLPDB:
+    """
+    Parses the TeXLive Package Database file in a single pass. Returns a TLPDB mapping of package names to
+    Package objects with the attributes:
+
+    revision: int
+        package revision.
+    relocated: bool
+        True if the file paths are relative to the texmf-dist tree.
+    depends: tuple
+        names of the packages this package depends on.
+    runfiles, binfiles, srcfiles, docfiles: list
+        file paths, relative to the TeXLive installation directory.
+    sizes: dict
+        size attributes of the package, i.e. runfiles, binfiles, and containersize.
+    """
+    with open(pdb_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    packages = {}
+
+    name = None
+    files = {}
+    filelist = None
+    is_doc = False
+    pos = 0
+    start = 0
+
+    def pkg_data():
+        return (
+            revision,
+            relocated,
+            tuple(depends),
+            sizes,
+            {k: "\n".join(v) for k, v in files.items()},
+            (start, pos),
+        )
+
+    for ln in text.splitlines(True):
+        if ln[0] == " ":
+            # file path in the current file list. Doc files can have attributes after the path.
+            if filelist is not None:
+                filelist.append(ln.split(" ", 2)[1].strip() if is_doc else ln.strip())
+
+        elif not ln.strip():
+            # a blank line ends the current package listing
+            if name is not None:
+                packages[name] = pkg_data()
+            name, filelist = None, None
+
+        else:
+            key, _, value = ln.rstrip("\n").partition(" ")
+            filelist = None
+
+            if key == "name":
+                if name is not None:
+                    packages[name] = pkg_data()
+
+                name = value.strip()
+                revision, relocated, depends, sizes, files = 0, False, [], {}, {}
+                # the listing starts after the name line
+                start = pos + len(ln)
+
+            elif name is None:
+                pass
+
+            elif key in FILE_KEYS:
+                filelist = files.setdefault(key, [])
+                is_doc = key == "docfiles"
+
+                # attributes on the file list line, i.e. "binfiles arch=x86_64-linux size=2"
+                for attr in value.split():
+                    attr_name, _, attr_value = attr.partition("=")
+                    if attr_name == "size":
+                        sizes[key] = int(attr_value)
+
+            elif key == "depend":
+                depends.append(value.strip())
+            elif key == "revision":
+                revision = int(value)
+            elif key == "relocated":
+                relocated = value.strip() == "1"
+            elif key.endswith("containersize"):
+                sizes[key] = int(value)
+
+        pos += len(ln)
+
+    if name is not None:
+        packages[name] = pkg_data()
+
+    return TLPDB(pdb_path, packages)
+
+
+def _cache_key(pdb_path: Path) -> tuple:
+    """Key of the parsed index, changes when the database file changes."""
+    stat = os.stat(pdb_path)
+    return (INDEX_VERSION, stat.st_mtime_ns, stat.st_size)
+
+
+def _cache_path(pdb_path: Path) -> Path:
+    """Path of the cached index for a database file."""
+    path_hash = hashlib.sha256(str(pdb_path).encode("utf-8")).hexdigest()[:16]
+    return utils.cache_dir() / "tlpdb" / (path_hash + ".pickle")
+
+
+def load(pdb_path: Path) -> TLPDB:
+    """
+    Returns the parsed TeXLive Package Database (see parse()). The index is cached on disk, keyed by the
+    modification time and size of the database file, so the database is only parsed again after it changes.
+    Indexes are also kept in memory for the lifetime of the process.
+    """
+    pdb_path = Path(pdb_path).resolve()
+    key = _cache_key(pdb_path)
+
+    with _indexes_lock:
+        if pdb_path in _indexes and _indexes[pdb_path][0] == key:
+            return _indexes[pdb_path][1]
+
+    cache_path = _cache_path(pdb_path)
+
+    packages = None
+    try:
+        with open(cache_path, "rb") as f:
+            cache_key, cache_packages = pickle.load(f)
+        if cache_key == key:
+            packages = TLPDB(pdb_path, cache_packages)
+    except Exception:
+        pass
+
+    if packages is None:
+        packages = parse(pdb_path)
+
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first so other processes never read a partial cache
+            tmp_path = cache_path.with_suffix(".{}.tmp".format(os.getpid()))
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    (key, packages._packages), f, protocol=pickle.HIGHEST_PROTOCOL
+                )
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # the cache is only an optimization
+            pass
+
+    with _indexes_lock:
+        _indexes[pdb_path] = (key, packages)
+
+    return packages
+
+
+def closure(index: TLPDB, names: List[str], arch: str) -> Tuple[List[str], List[str]]:
+    """
+    Returns the dependency closure of packages from the depend entries of the database. Collections are expanded
+    like any other package, and the ".ARCH" suffix of dependencies is replaced with the platform, i.e.
+    "pdftex.ARCH" becomes "pdftex.x86_64-linux".
+
+    Parameters:
+    -----------
+    index: TLPDB
+        parsed database with the available packages.
+    names: list
+        requested package names.
+    arch: str
+        TeXLive platform name, i.e. "x86_64-linux" or "windows".
+
+    Returns:
+    --------
+    tuple:
+        names of all packages in the closure in breadth-first order, and the requested names that are not in
+        the database.
+    """
+    resolved = []
+    unknown = []
+    requested = set(names)
+    seen = set()
+    queue = deque(names)
+
+    while queue:
+        name = queue.popleft()
+        if name in seen:
+            continue
+        seen.add(name)
+
+        if name not in index:
+            if name in requested:
+                unknown.append(name)
+            # dependencies that are not packages, i.e. "release/2024" of 00texlive.config
+            continue
+
+        resolved.append(name)
+        for dep in index[name].depends:
+            if dep.endswith(".ARCH"):
+                dep = dep[: -len("ARCH")] + arch
+            if dep not in seen:
+                queue.append(dep)
+
+    return resolved, unknown
+
+
+def find_remote(texdir: Path) -> Path:
+    """
+    Returns the newest copy of the remote database that tlmgr keeps in the tlpkg folder of an installation, i.e.
+    "texlive.tlpdb.main.<hash>", or None if tlmgr has not contacted a repository yet.
+    """
+    candidates = [
+        p
+        for p in (Path(texdir) / "tlpkg").glob("texlive.tlpdb.*")
+        if p.suffix not in (".xz", ".sha512", ".md5", ".tmp") and p.is_file()
+    ]
+
+    if not candidates:
+        return None
+
+    return max(candidates, key=lambda p: p.stat().st_mtime)
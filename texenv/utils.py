@@ -2,10 +2,32 @@ import subprocess
 from pathlib import Path
 import os
 import re
+import signal
+import gzip
 import shutil
-from PIL import Image
+import pickle
+import hashlib
+import json
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import platform
-from . import packages
+from . import packages, tlpdb, fileops, localrepo, lsr, events
+
+
+def cache_dir() -> Path:
+    """
+    Returns the per-user cache directory of texenv. Can be changed with the TEXENV_CACHE_DIR environment variable.
+    """
+    if os.environ.get("TEXENV_CACHE_DIR"):
+        return Path(os.environ["TEXENV_CACHE_DIR"])
+    elif platform.system() == "Windows" and os.environ.get("LOCALAPPDATA"):
+        return Path(os.environ["LOCALAPPDATA"]) / "texenv"
+    elif os.environ.get("XDG_CACHE_HOME"):
+        return Path(os.environ["XDG_CACHE_HOME"]) / "texenv"
+    else:
+        return Path.home() / ".cache/texenv"
 
 
 def normalize_dimensions(w, h):
@@ -21,9 +43,13 @@ def get_image_size(filepath, normalize=False):
     """
     Return width and height of an image file.
     """
+    # PIL is imported on first use to keep the startup time of the command line interface low
+    from PIL import Image
+
     try:
-        img = Image.open(filepath)
-        w_im, h_im = img.size
+        # only the header is read, the pixel data is not decoded
+        with Image.open(filepath) as img:
+            w_im, h_im = img.size
 
         if normalize:
             # normalize the width and height so the largest dimension is 1.
@@ -46,26 +72,308 @@ def get_figure_size(fig, normalize=False):
     return w_im, h_im
 
 
-def sync_from_file(filepath):
+def _save_pickled_figure(data: bytes, filepath: Path, kwargs: dict):
+    """Saves a pickled matplotlib figure, runs in a worker process of FigureWriter."""
+    from matplotlib import pyplot as plt
 
-    with open(filepath, "r") as f:
-        all_pkgs = f.read().split("\n")
-        # filter out base packages if they somehow made it onto the file
-        pkgs = [
-            pkg.strip()
-            for pkg in all_pkgs
-            if pkg not in packages.install_pkgs[platform.system()]
-        ]
+    fig = pickle.loads(data)
+    fig.savefig(filepath, **kwargs)
+    plt.close(fig)
 
-    if "VIRTUAL_ENV" not in dict(os.environ).keys():
-        raise RuntimeError(
-            "This command must be run from a virtual environment. To create one use: python -m venv .venv"
+
+class FigureWriter(object):
+    """
+    Saves matplotlib figures in a background process or thread pool.
+    """
+
+    def __init__(self, max_workers: int = None, processes: bool = True):
+        """
+        Parameters:
+        -----------
+        max_workers: int, optional
+            number of workers in the pool. Defaults to the executor default.
+        processes: bool, default: True
+            if True, figures are pickled and saved in a process pool. Figures that can't be pickled, i.e. figures
+            that hold a lambda function, are saved in a thread instead. If False, all figures are saved in threads.
+            matplotlib is not thread-safe, so figures must not be created or changed while threads save figures.
+        """
+        self.max_workers = max_workers
+        self.processes = processes
+
+        # the pools are created on first use, so a writer that saves no figures never starts any workers
+        self._threads = None
+        self._processes = None
+        self._pending = []
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            # spawn fresh interpreters, forking a process with running threads (i.e. concurrent preprocessor runs,
+            # or the thread pool of this writer) can deadlock the workers
+            self._processes = ProcessPoolExecutor(
+                self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._processes
+
+    def _thread_pool(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(self.max_workers)
+        return self._threads
+
+    def submit(self, fig, filepath: Path, **kwargs):
+        """
+        Queues the figure to be saved to filepath. Keyword arguments are passed to savefig.
+        """
+        Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+
+        future = None
+        if self.processes:
+            try:
+                future = self._process_pool().submit(
+                    _save_pickled_figure, pickle.dumps(fig), filepath, kwargs
+                )
+            except Exception:
+                future = None
+
+        if future is None:
+            future = self._thread_pool().submit(fig.savefig, filepath, **kwargs)
+
+        self._pending.append((fig, future))
+
+    def join(self):
+        """
+        Waits for all queued figures to be saved and closes them. Raises the first error from the workers.
+        """
+        pending, self._pending = self._pending, []
+
+        error = None
+        for fig, future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                error = e if error is None else error
+
+        if len(pending):
+            from matplotlib import pyplot as plt
+
+            for fig, _ in pending:
+                plt.close(fig)
+
+        if error is not None:
+            raise error
+
+    def close(self):
+        """
+        Waits for all queued figures and shuts down the pool.
+        """
+        try:
+            self.join()
+        finally:
+            if self._threads is not None:
+                self._threads.shutdown()
+            if self._processes is not None:
+                self._processes.shutdown()
+            self._threads = None
+            self._processes = None
+
+
+def installed_packages() -> list:
+    """
+    Returns the packages installed in the environment, excluding the base packages installed by texenv init. The
+    packages are read from the environment's package database instead of tlmgr, so this returns in milliseconds.
+
+    Returns:
+    --------
+    list:
+        tlpdb.Package objects sorted by name.
+    """
+    env_texdir = get_env_texpath().parents[1]
+    index = tlpdb.load(env_texdir / "tlpkg/texlive.tlpdb")
+
+    base = set(packages.install_pkgs[platform.system()])
+    return [index[k] for k in sorted(index) if k not in base]
+
+
+def available_packages(repository: Path = None) -> "tlpdb.TLPDB":
+    """
+    Returns the database of the packages available for installation. This is the local repository if given, or
+    the copy of the remote database that tlmgr keeps in the environment, or the database of the base installation
+    if tlmgr has not contacted a repository yet.
+    """
+    if repository is not None:
+        return tlpdb.load(localrepo.database_path(repository))
+
+    remote = tlpdb.find_remote(get_env_texpath().parents[1])
+    if remote is not None:
+        return tlpdb.load(remote)
+
+    texpath_base, _ = get_base_texpath()
+    return tlpdb.load(texpath_base / "tlpkg/texlive.tlpdb")
+
+
+def find_tex_requirements(filepaths: list) -> list:
+    """
+    Returns the file names of the packages and classes loaded by \\usepackage, \\RequirePackage and
+    \\documentclass in the given .tex files, i.e. ["article.cls", "geometry.sty"].
+    """
+    names = []
+    for filepath in filepaths:
+        with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+            # remove comments, but not escaped percent signs
+            text = re.sub(r"(?<!\\)%.*", "", f.read())
+
+        for cmd, arg in re.findall(
+            r"\\(usepackage|RequirePackage|documentclass)\s*(?:\[[^\]]*\])?\s*\{([^}]*)\}",
+            text,
+        ):
+            ext = ".cls" if cmd == "documentclass" else ".sty"
+            for name in arg.split(","):
+                name = name.strip()
+                # skip arguments built from macros, they can't be resolved without running TeX
+                if name and "\\" not in name and name + ext not in names:
+                    names.append(name + ext)
+
+    return names
+
+
+def _kpsewhich(names: list, cwd: Path = None) -> set:
+    """
+    Returns the names that kpsewhich of the environment finds outside of the filename database, i.e. on TEXMFHOME
+    or TEXINPUTS. Returns an empty set if kpsewhich can't be run.
+    """
+    try:
+        proc = subprocess.run(
+            [str(get_env_texpath() / "kpsewhich")] + list(names),
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
         )
+    except OSError:
+        return set()
 
+    # kpsewhich prints the path of each file it found, and exits with an error if any file is missing
+    found = set(
+        Path(ln.strip()).name
+        for ln in proc.stdout.decode("utf-8", errors="replace").splitlines()
+    )
+    return set(k for k in names if Path(k).name in found)
+
+
+def preflight(
+    filepaths: list,
+    auto_install: bool = False,
+    repository: Path = None,
+    search_dirs: list = None,
+):
+    """
+    Checks that every package and class loaded by the .tex files is in the filename database (ls-R) of the
+    environment before pdflatex is run. Files that are not in the database are also searched for in search_dirs and
+    with kpsewhich, so local packages next to the document and files on TEXMFHOME or TEXINPUTS are found. Raises a
+    RuntimeError with the TeXLive packages that provide the missing files, or installs them if auto_install is
+    True. The check is skipped if the environment has no ls-R.
+
+    Parameters:
+    -----------
+    filepaths: list
+        .tex files to check, i.e. the preprocessed files.
+    auto_install: bool, default: False
+        install the packages that provide missing files.
+    repository: Path, optional
+        local repository to install from, see install_packages().
+    search_dirs: list, optional
+        folders pdflatex also loads files from, i.e. the folder of the document. The first folder is the working
+        directory of kpsewhich. The folders of filepaths are always searched.
+    """
+    texdir = get_env_texpath().parents[1]
+    lsr_paths = [texdir / "texmf-dist/ls-R", texdir / "texmf-var/ls-R"]
+
+    if not (texdir / "texmf-dist/ls-R").exists():
+        return
+
+    available = set()
+    for lsr_path in lsr_paths:
+        if lsr_path.exists():
+            available |= lsr.names(lsr.read(lsr_path))
+
+    missing = [k for k in find_tex_requirements(filepaths) if k not in available]
+    if not missing:
+        return
+
+    search_dirs = list(search_dirs or []) + [Path(f).parent for f in filepaths]
+    missing = [
+        k for k in missing if not any((Path(d) / k).exists() for d in search_dirs)
+    ]
+    if not missing:
+        return
+
+    # kpsewhich is only run for the few files that are not in the database
+    found = _kpsewhich(missing, cwd=search_dirs[0])
+    missing = [k for k in missing if k not in found]
+    if not missing:
+        return
+
+    index = available_packages(repository)
+    providers = {k: index.providers(k) for k in missing}
+    unknown = [k for k, v in providers.items() if not v]
+
+    if auto_install and not unknown:
+        print(
+            install_packages(sorted(set(v[0] for v in providers.values())), repository)
+        )
+        return
+
+    msg = "\n".join(
+        " {}: {}".format(
+            k,
+            (
+                "texenv install " + v[0]
+                if v
+                else "not found in the TeXLive package database"
+            ),
+        )
+        for k, v in providers.items()
+    )
+    raise RuntimeError("Files not found in the TeX environment:\n" + msg)
+
+
+def resolve_install(pkgs: list, repository: Path = None) -> tuple:
+    """
+    Resolves the packages to install into the environment from the dependency closure of the requested packages.
+    Dependencies are read from the copy of the remote database that tlmgr keeps in the environment, or from the
+    base installation if tlmgr has not contacted a repository yet.
+
+    Parameters:
+    -----------
+    pkgs: list
+        requested package names.
+    repository: Path, optional
+        local repository to read the dependencies from instead, see localrepo.install().
+
+    Returns:
+    --------
+    tuple:
+        packages of the closure that are not installed in the environment, and requested packages that are not in
+        the database. Unknown packages may still be available from the repository.
+    """
+    _, tl_platform = get_base_texpath()
+    env_texdir = get_env_texpath().parents[1]
+
+    index = available_packages(repository)
+    installed = tlpdb.load(env_texdir / "tlpkg/texlive.tlpdb")
+
+    closure, unknown = tlpdb.closure(index, pkgs, tl_platform)
+    missing = [k for k in closure if k not in installed]
+
+    return missing, [k for k in unknown if k not in installed]
+
+
+def run_tlmgr(args: str) -> str:
+    """
+    Runs tlmgr of the environment with the given arguments and returns the output.
+    """
     tlmgr = get_env_texpath() / "tlmgr"
 
     with subprocess.Popen(
-        f"{tlmgr} install " + " ".join(pkgs),
+        f"{tlmgr} " + args,
         shell=True,
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
@@ -79,9 +387,213 @@ def sync_from_file(filepath):
     return output
 
 
-def texenv_init(prompt=".venv"):
+def install_packages(pkgs: list, repository: Path = None) -> str:
+    """
+    Installs packages and their dependencies into the environment with a single tlmgr call. Returns the tlmgr
+    output, tlmgr is not run if all packages are already installed.
+
+    If a local repository is given, the packages are extracted from the repository archives instead of calling
+    tlmgr, and the filename database is updated afterwards.
+    """
+    missing, unknown = resolve_install(pkgs, repository)
+
+    if not missing and not unknown:
+        return "All packages are already installed."
+
+    print("Installing: " + " ".join(missing + unknown))
+
+    if repository is None:
+        return run_tlmgr("install " + " ".join(missing + unknown))
+
+    if unknown:
+        raise RuntimeError(
+            "Packages not found in repository {}: {}".format(
+                repository, " ".join(unknown)
+            )
+        )
+
+    texdir = get_env_texpath().parents[1]
+    added, removed = localrepo.install(repository, missing, texdir)
+
+    # update the filename database with the changed files instead of walking the whole tree with mktexlsr
+    update_lsr(texdir, added, removed)
+
+    return "Installed {} packages ({} files) from {}.".format(
+        len(missing), len(added), repository
+    )
+
+
+def update_lsr(texdir: Path, added: list = (), removed: list = ()):
+    """
+    Updates the filename database of the texmf-dist tree with added and removed files.
+
+    Parameters:
+    -----------
+    texdir: Path
+        TeXLive installation directory.
+    added, removed: list
+        file paths relative to texdir, i.e. "texmf-dist/tex/latex/geometry/geometry.sty". Paths outside of
+        texmf-dist (binaries) are ignored.
+    """
+    prefix = "texmf-dist/"
+    lsr.update_file(
+        Path(texdir) / "texmf-dist/ls-R",
+        [p[len(prefix) :] for p in added if p.startswith(prefix)],
+        [p[len(prefix) :] for p in removed if p.startswith(prefix)],
+    )
+
+
+def verify_lsr(texdir: Path) -> list:
+    """
+    Returns the run files of the installed packages that are missing from the filename database of the texmf-dist
+    tree. The check only reads the package database and ls-R, not the file system.
+    """
+    texdir = Path(texdir)
+    prefix = "texmf-dist/"
+    installed = tlpdb.load(texdir / "tlpkg/texlive.tlpdb")
+    db = lsr.read(texdir / "texmf-dist/ls-R")
+
+    runfiles = [
+        p[len(prefix) :]
+        for k in installed
+        for p in installed[k].runfiles
+        if p.startswith(prefix)
+    ]
+    return [prefix + p for p in lsr.verify(db, runfiles)]
+
+
+def _lock_matches(lock: dict, req_hash: str, pdb_path: Path, prune: bool) -> bool:
+    """
+    Returns True if the lockfile was written for the same requirements and the environment has every locked package
+    at the locked revision. Only package names and revisions are compared, so a lockfile that is committed with the
+    requirements also matches on other machines, i.e. a fresh CI runner.
+    """
+    if lock.get("requirements") != req_hash or not lock.get("packages"):
+        return False
+
+    installed = tlpdb.load(pdb_path)
+    for k, revision in lock["packages"].items():
+        if k not in installed or installed[k].revision != revision:
+            return False
+
+    # with prune, installed packages that are not locked still have to be removed
+    return not prune or all(k in lock["packages"] for k in installed)
+
+
+def sync_from_file(filepath, lockfile=None, prune=False, repository=None):
+    """
+    Installs the packages of a requirements file that are missing from the environment.
+
+    Parameters:
+    -----------
+    filepath: Path
+        requirements file with one package name per line.
+    lockfile: Path, optional
+        lockfile with the hash of the requirements and the installed package revisions. If the requirements are
+        unchanged and the environment has all locked packages at the locked revisions, the sync returns without
+        calling tlmgr. The lockfile is written after each sync.
+    prune: bool, default: False
+        remove installed packages that are not required by the requirements file or the base installation.
+    repository: Path, optional
+        local repository to install the packages from, see install_packages().
+    """
+    with open(filepath, "r") as f:
+        all_pkgs = f.read().split("\n")
+        # filter out base packages if they somehow made it onto the file
+        # lines can have the revision and size after the name, see texenv freeze --details
+        pkgs = [pkg.split()[0] for pkg in all_pkgs if pkg.strip()]
+        pkgs = [
+            pkg for pkg in pkgs if pkg not in packages.install_pkgs[platform.system()]
+        ]
+
+    if "VIRTUAL_ENV" not in dict(os.environ).keys():
+        raise RuntimeError(
+            "This command must be run from a virtual environment. To create one use: python -m venv .venv"
+        )
+
+    env_texdir = get_env_texpath().parents[1]
+    pdb_path = env_texdir / "tlpkg/texlive.tlpdb"
+    req_hash = hashlib.sha256("\n".join(sorted(set(pkgs))).encode("utf-8")).hexdigest()
+
+    if lockfile is not None and Path(lockfile).exists():
+        try:
+            with open(lockfile, "r") as f:
+                lock = json.load(f)
+        except ValueError:
+            lock = {}
+
+        if _lock_matches(lock, req_hash, pdb_path, prune):
+            return "Environment is up to date."
+
+    output = install_packages(pkgs, repository)
+
+    _, tl_platform = get_base_texpath()
+    required, _ = tlpdb.closure(
+        tlpdb.load(pdb_path),
+        pkgs + packages.install_pkgs[platform.system()],
+        tl_platform,
+    )
+
+    if prune:
+        installed = tlpdb.load(pdb_path)
+        required_set = set(required)
+        extras = [k for k in installed if k not in required_set]
+
+        if extras:
+            print("Removing: " + " ".join(extras))
+            output += "\n" + run_tlmgr("remove --no-depends " + " ".join(extras))
+
+    if lockfile is not None:
+        installed = tlpdb.load(pdb_path)
+        revisions = {
+            k: installed[k].revision for k in sorted(required) if k in installed
+        }
+
+        lock = dict(
+            requirements=req_hash,
+            hash=hashlib.sha256(
+                json.dumps(revisions, sort_keys=True).encode("utf-8")
+            ).hexdigest(),
+            packages=revisions,
+        )
+
+        with open(lockfile, "w") as f:
+            json.dump(lock, f, indent=2, sort_keys=True)
+
+    return output
+
+
+def _base_plan(index: "tlpdb.TLPDB", texpath_base: Path, newtexpath: Path) -> list:
+    """Returns the file operations that populate an environment with the base packages, see fileops.plan_files()."""
+    plan = []
+    for k in packages.install_pkgs[platform.system()]:
+        if k not in index:
+            raise RuntimeError(
+                f'package {k} not found in base TeXLive installation. Ensure at least the "basic" TeXLive scheme is installed on the system.'
+            )
+
+        plan += fileops.plan_files(
+            texpath_base, newtexpath, index[k].binfiles, binary=True
+        )
+        plan += fileops.plan_files(texpath_base, newtexpath, index[k].runfiles)
+
+    return plan
+
+
+def texenv_init(prompt=".venv", link=None, refresh=False):
     """
     Initializes the texenv environment and TeX installation.
+
+    Parameters:
+    -----------
+    prompt: str
+        name of the virtual environment.
+    link: str, optional
+        how files are populated from the base installation, one of "copy", "hard", "symlink", "reflink" or "store".
+        See fileops.execute(). Defaults to "copy", or on refresh to the mode the environment was created with.
+    refresh: bool, default: False
+        update an existing environment from the base installation instead of creating it again, see
+        texenv_refresh().
     """
     # create python virtual environment if we aren't already in one
     if "VIRTUAL_ENV" not in dict(os.environ).keys():
@@ -93,13 +605,22 @@ def texenv_init(prompt=".venv"):
 
     cwd = Path(os.environ["VIRTUAL_ENV"])
 
-    texpath_base, _ = get_base_texpath()
+    # search the PATH for the base installation, it may have changed since the environment was created
+    texpath_base, tl_platform = get_base_texpath(use_config=False)
 
     print(f"Found system TeXLive installation at: {texpath_base}")
 
     # copy tex binaries to venv folder
     newtexpath = cwd / "tex"
 
+    if newtexpath.exists() and refresh:
+        if link is None:
+            link = read_env_config().get("link", "copy")
+        return texenv_refresh(texpath_base, tl_platform, newtexpath, link)
+
+    if link is None:
+        link = "copy"
+
     if newtexpath.exists():
         # prompt to overwrite existing venv Tex installation
         response = input(
@@ -114,31 +635,29 @@ def texenv_init(prompt=".venv"):
     pdb_dest = newtexpath / "tlpkg/texlive.tlpdb"
 
     print(f"Setting up TeX environment...")
-    pkg_listings, pkg_files = tlpdb_parse(pdb_home)
+    index = tlpdb.load(pdb_home)
 
-    # install packages
-    for k in packages.install_pkgs[platform.system()]:
-        if k not in pkg_files:
-            raise RuntimeError(
-                f'package {k} not found in base TeXLive installation. Ensure at least the "basic" TeXLive scheme is installed on the system.'
-            )
+    # plan all files of the base packages, then populate them in parallel
+    plan = _base_plan(index, texpath_base, newtexpath)
 
-        for v in pkg_files[k]["binfiles"] + pkg_files[k]["runfiles"]:
-            os.makedirs((newtexpath / v).parent, exist_ok=True)
-            try:
-                shutil.copy(texpath_base / v, newtexpath / v)
-            except IsADirectoryError:
-                shutil.copytree(texpath_base / v, newtexpath / v, dirs_exist_ok=True)
+    stats = fileops.execute(plan, mode=link)
+    print(f"Populated {fileops.format_stats(stats)}")
+
+    # generated files in texmf-var are rewritten by the environment, so they are never linked
+    fileops.execute(fileops.plan_files(texpath_base, newtexpath, ["texmf-var"]))
 
     with open(pdb_dest, "w+") as f:
         for k in packages.install_pkgs[platform.system()]:
-            f.write(f"name {k}\n" + pkg_listings[k] + "\n")
+            f.write(f"name {k}\n" + index.listing(k) + "\n")
 
     os.makedirs(newtexpath / "tlpkg/backups", exist_ok=True)
 
-    shutil.copy(texpath_base / "texmf-dist/ls-R", newtexpath / "texmf-dist/ls-R")
-    shutil.copytree(
-        texpath_base / "texmf-var", newtexpath / "texmf-var", dirs_exist_ok=True
+    _write_init_config(texpath_base, tl_platform, newtexpath, link)
+
+    # generate the filename database from the installed files, the ls-R of the base installation lists files of
+    # packages that are not installed in the environment.
+    update_lsr(
+        newtexpath, [dst.relative_to(newtexpath).as_posix() for _, dst, _ in plan]
     )
 
     texpath_env = get_env_texpath()
@@ -154,6 +673,150 @@ def texenv_init(prompt=".venv"):
     sync_from_file(slide_file)
 
 
+def _write_init_config(
+    texpath_base: Path, tl_platform: str, newtexpath: Path, link: str
+):
+    """Records the paths so later commands don't have to search the PATH environment variable."""
+    write_env_config(
+        dict(
+            base_texpath=str(texpath_base),
+            platform=tl_platform,
+            env_texpath=str(newtexpath / "bin" / tl_platform),
+            link=link,
+        )
+    )
+
+
+def texenv_refresh(
+    texpath_base: Path, tl_platform: str, newtexpath: Path, link: str = "copy"
+) -> dict:
+    """
+    Updates the base packages of an existing environment from the base installation, i.e. after the system
+    TeXLive was updated. Only missing files, and files that differ in size or modification time from the base
+    installation are copied, and files that were removed from the base packages are deleted. Packages installed
+    by the user are kept, and tlmgr is not updated.
+
+    Parameters:
+    -----------
+    texpath_base: Path
+        base TeXLive installation directory.
+    tl_platform: str
+        TeXLive platform name.
+    newtexpath: Path
+        tex folder of the environment.
+    link: str, default: "copy"
+        how changed files are populated, see fileops.execute().
+
+    Returns:
+    --------
+    dict:
+        names of the updated base packages, and the number of copied and removed files.
+    """
+    print(f"Refreshing TeX environment at {newtexpath}...")
+    index = tlpdb.load(texpath_base / "tlpkg/texlive.tlpdb")
+    pdb_dest = newtexpath / "tlpkg/texlive.tlpdb"
+    installed = tlpdb.load(pdb_dest)
+
+    base_pkgs = packages.install_pkgs[platform.system()]
+    plan = _base_plan(index, texpath_base, newtexpath)
+
+    updated = [
+        k
+        for k in base_pkgs
+        if k not in installed or installed[k].revision != index[k].revision
+    ]
+    changed = fileops.changed_files(plan)
+
+    stats = fileops.execute(changed, mode=link)
+    print(f"Updated {fileops.format_stats(stats)}")
+
+    fileops.execute(
+        fileops.changed_files(
+            fileops.plan_files(texpath_base, newtexpath, ["texmf-var"])
+        )
+    )
+
+    # files of the installed base packages that are no longer in the base installation
+    current = set(dst.relative_to(newtexpath).as_posix() for _, dst, _ in plan)
+    removed = []
+    for k in base_pkgs:
+        if k in installed:
+            for path in installed[k].runfiles + installed[k].binfiles:
+                if path not in current and os.path.lexists(newtexpath / path):
+                    os.remove(newtexpath / path)
+                    removed.append(path)
+
+    # base packages are replaced by the base installation, user packages are kept
+    listings = {k: index.listing(k) for k in base_pkgs}
+    listings.update({k: installed.listing(k) for k in installed if k not in listings})
+
+    tmp_path = pdb_dest.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        for k in sorted(listings):
+            f.write(f"name {k}\n" + listings[k] + "\n")
+    os.replace(tmp_path, pdb_dest)
+
+    _write_init_config(texpath_base, tl_platform, newtexpath, link)
+
+    update_lsr(
+        newtexpath,
+        [dst.relative_to(newtexpath).as_posix() for _, dst, _ in changed],
+        removed,
+    )
+
+    print("Updated base packages: " + (" ".join(updated) if updated else "none"))
+
+    return dict(packages=updated, copied=len(changed), removed=len(removed))
+
+
+def run_command(command: str, cwd: Path = None, timeout: float = None):
+    """
+    Runs a shell command and returns the completed process with the captured stdout. The command, and any
+    processes it started, are killed if it doesn't finish within the timeout.
+    """
+    # start the shell in a new process group so the whole group can be killed on timeout
+    session = dict(start_new_session=True) if platform.system() != "Windows" else {}
+
+    with subprocess.Popen(
+        command, stdout=subprocess.PIPE, cwd=cwd, shell=True, **session
+    ) as proc:
+        try:
+            stdout, _ = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            if platform.system() != "Windows":
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+            proc.communicate()
+            raise TimeoutError(
+                "Command did not finish within {} seconds: {}".format(timeout, command)
+            )
+
+    return subprocess.CompletedProcess(command, proc.returncode, stdout)
+
+
+def run_pdflatex(command: str, cwd: Path = None, timeout: float = None):
+    """
+    Runs a pdflatex command with run_command() and emits the on_compile_start and on_compile_end events.
+    """
+    if not events.enabled:
+        return run_command(command, cwd=cwd, timeout=timeout)
+
+    events.emit("on_compile_start", command=command, cwd=cwd)
+    t_start = time.perf_counter()
+
+    proc = run_command(command, cwd=cwd, timeout=timeout)
+
+    events.emit(
+        "on_compile_end",
+        command=command,
+        cwd=cwd,
+        returncode=proc.returncode,
+        seconds=time.perf_counter() - t_start,
+    )
+    return proc
+
+
 def parse_pdflatex_error(output):
     lines = output.split("\n")
 
@@ -175,10 +838,119 @@ def parse_pdflatex_error(output):
     return dict(msg=error_msg, line=error_ln, src=error_src)
 
 
-def get_base_texpath():
+def _synctex_path_key(filepath, root_dir):
+    """Normalized path used to compare file names in the synctex file."""
+    filepath = Path(filepath)
+    if not filepath.is_absolute():
+        filepath = Path(root_dir) / filepath
+    return os.path.normpath(str(filepath)).replace("\\", "/").lower()
+
+
+def rewrite_synctex(gen_syn: Path, out_syn: Path, processed: dict, root_dir: Path):
     """
-    Returns the base TeXLive installation directory.
+    Rewrites a synctex file generated from preprocessed .tex files so it points to the original files.
+
+    Parameters:
+    -----------
+    gen_syn: Path
+        synctex file written by pdflatex.
+    out_syn: Path
+        path of the updated synctex file.
+    processed: dict
+        maps each preprocessed file to a tuple of the original file and the line map.
+    root_dir: Path
+        working directory of pdflatex, relative file names in the synctex file are relative to this directory.
     """
+    processed = {
+        _synctex_path_key(out, root_dir): (inp, line_map)
+        for out, (inp, line_map) in processed.items()
+    }
+    # line maps of each preprocessed file, keyed by the number synctex assigned to the file
+    input_maps = {}
+
+    updated_sync_data = ""
+    with gzip.open(gen_syn, mode="rt") as f:
+        for ln in f.readlines():
+            m = re.match(r"^Input:(\d+):(.*)$", ln)
+
+            if m is not None:
+                key = _synctex_path_key(m.group(2).strip(), root_dir)
+
+                if key in processed:
+                    inp, line_map = processed[key]
+                    input_maps[int(m.group(1))] = line_map
+                    ln = "Input:{}:{}\n".format(m.group(1), Path(inp).as_posix())
+
+            else:
+                m = re.match(r"^.(\d+),(\d+):", ln)
+
+                if m is not None and int(m.group(1)) in input_maps:
+                    line_map = input_maps[int(m.group(1))]
+                    # line number of the postprocessed tex file
+                    output_tex_lnum = int(m.group(2))
+                    # line number of the input tex file before preprocessing
+                    input_tex_lnum = line_map[min(output_tex_lnum, len(line_map)) - 1]
+
+                    ln = "{}{},{}:{}".format(
+                        ln[0], m.group(1), input_tex_lnum, ln[m.span()[1] :]
+                    )
+
+            updated_sync_data += ln
+
+    cmp_data = gzip.compress(updated_sync_data.encode("utf-8"))
+
+    # replace the file atomically so concurrent builds and synctex readers never see a partial file
+    out_syn = Path(out_syn)
+    tmp_path = out_syn.with_name(
+        ".{}.{}.{}.tmp".format(out_syn.name, os.getpid(), threading.get_ident())
+    )
+    with open(tmp_path, "wb+") as f:
+        f.write(cmp_data)
+    os.replace(tmp_path, out_syn)
+
+    if events.enabled:
+        events.emit("on_synctex_rewrite", gen_syn=Path(gen_syn), out_syn=out_syn)
+
+
+def env_config_path() -> Path:
+    """
+    Returns the path of the config file of the current virtual environment, written by texenv init.
+    """
+    return Path(os.environ["VIRTUAL_ENV"]) / "tex/texenv.json"
+
+
+def read_env_config() -> dict:
+    """
+    Returns the config of the current virtual environment, or an empty dictionary if there is no virtual
+    environment or it was initialized by an older version of texenv.
+    """
+    if "VIRTUAL_ENV" not in os.environ:
+        return {}
+
+    try:
+        with open(env_config_path(), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_env_config(config: dict):
+    """
+    Writes the config of the current virtual environment.
+    """
+    with open(env_config_path(), "w") as f:
+        json.dump(config, f, indent=2, sort_keys=True)
+
+
+def get_base_texpath(use_config: bool = True):
+    """
+    Returns the base TeXLive installation directory and the TeXLive platform name. The paths are read from the
+    config of the virtual environment if it exists, instead of searching the PATH environment variable.
+    """
+    config = read_env_config() if use_config else {}
+    if "base_texpath" in config:
+        return Path(config["base_texpath"]), config["platform"]
+
     path = os.environ["PATH"]
 
     # windows Path variable uses backslashes, unix uses forward slashes
@@ -212,6 +984,10 @@ def get_env_texpath():
     """
     Returns the venv TeXLive installation directory.
     """
+    config = read_env_config()
+    if "env_texpath" in config:
+        return Path(config["env_texpath"])
+
     # usually the virtual env path should be in the env variables
     if "VIRTUAL_ENV" in os.environ.keys():
         # get the platform from the base path
@@ -242,37 +1018,12 @@ def tlpdb_parse(pdb_path: Path):
     Parses the TexLive Package Database file and returns the
     paths to the bin and run files associated with each package.
     """
-    pkg_listings = {}
-
-    with open(pdb_path, "r", encoding="utf-8") as f:
-        ln = 1
-        while ln:
-            ln = f.readline()
-            if ln[:4] == "name" and ln[4:].strip():
-                pkg_name = ln[4:].strip()
-                pkg_listings[pkg_name] = ""
-
-                ln = f.readline()
-                while ln != "\n":
-                    pkg_listings[pkg_name] += ln
-                    ln = f.readline()
-
-    pkg_files = {}
-    curlisting = ""
-    for k, v in pkg_listings.items():
-        pkg_files[k] = {}
-        pkg_files[k]["runfiles"] = []
-        pkg_files[k]["binfiles"] = []
-        pkg_files[k]["srcfiles"] = []
-        for ln in v.split("\n"):
-            if ln[:8] in ["runfiles", "binfiles", "srcfiles"]:
-                curlisting = ln[:8]
-                continue
-            elif not len(ln) or ln[0] != " ":
-                curlisting = ""
-                continue
-
-            if curlisting and len(ln):
-                pkg_files[k][curlisting].append(ln.strip())
+    index = tlpdb.load(pdb_path)
+
+    pkg_listings = {k: index.listing(k) for k in index}
+    pkg_files = {
+        k: dict(runfiles=v.runfiles, binfiles=v.binfiles, srcfiles=v.srcfiles)
+        for k, v in index.items()
+    }
 
     return pkg_listings, pkg_files
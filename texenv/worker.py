@@ -0,0 +1,184 @@
+from pathlib import Path
+import multiprocessing
+import threading
+import traceback
+
+try:
+    import resource
+except ImportError:
+    # resource limits are only available on unix platforms
+    resource = None
+
+
+def _worker_main(conn, memory_limit: int):
+    """
+    Entry point of the worker process. Receives macro calls from the connection until the connection is closed.
+    """
+    from .preprocessor import load_module
+
+    if memory_limit is not None and resource is not None:
+        # RLIMIT_RSS is not enforced by linux, limit the address space of the worker instead.
+        limit = int(memory_limit * 1024 * 1024)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    # the timeout of the first call starts after the interpreter has started and texenv is imported
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+
+        name, filepath, method_name, args, kwargs = request
+
+        try:
+            if filepath is not None:
+                module = load_module(Path(filepath).stem, [Path(filepath).parent])
+            else:
+                module = load_module(name)
+
+            method = getattr(module, method_name)
+            conn.send(("ok", method(*args, **kwargs)))
+
+        except MemoryError:
+            conn.send(("memory", None))
+        except BaseException:
+            conn.send(("error", traceback.format_exc()))
+
+
+class MacroWorker(object):
+    """
+    Runs python macros in a supervised worker process. Each call has a wall-clock timeout, and the memory of the
+    worker is limited with setrlimit, so a runaway macro can't hang or take down the process running texenv.
+
+    The worker is started on the first call, and is restarted after a timeout or crash. The startup time of the
+    worker does not count against the timeout. Calls from several threads are run one at a time.
+    """
+
+    def __init__(self, timeout: float = None, memory_limit: float = None):
+        """
+        Parameters:
+        -----------
+        timeout: float, optional
+            maximum time in seconds for each macro call. Defaults to no limit.
+        memory_limit: float, optional
+            maximum memory of the worker process in MB. Only supported on unix platforms. Defaults to no limit.
+        """
+        if memory_limit is not None and resource is None:
+            raise ValueError("Memory limits are not supported on this platform.")
+
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+
+        self._process = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker process if it is not running, and waits until it is ready to receive calls.
+        """
+        if self._process is not None and self._process.is_alive():
+            return
+
+        # spawn a fresh interpreter, forking a process with running threads (i.e. the figure writer) is unsafe
+        ctx = multiprocessing.get_context("spawn")
+        self._conn, child_conn = ctx.Pipe()
+
+        self._process = ctx.Process(
+            target=_worker_main, args=(child_conn, self.memory_limit), daemon=True
+        )
+        self._process.start()
+        child_conn.close()
+
+        try:
+            self._conn.recv()
+        except (EOFError, OSError):
+            exitcode = self._process.exitcode
+            self._kill()
+            raise RuntimeError(
+                "worker process failed to start (exit code {}).".format(exitcode)
+            )
+
+    def close(self):
+        """
+        Stops the worker process.
+        """
+        if self._process is None:
+            return
+
+        self._conn.close()
+        self._process.join(1)
+
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+
+        self._process = None
+        self._conn = None
+
+    def _kill(self):
+        self._process.kill()
+        self._process.join()
+        self._conn.close()
+        self._process = None
+        self._conn = None
+
+    def call(
+        self, name: str, filepath: Path, method_name: str, args: list, kwargs: dict
+    ):
+        """
+        Calls the method of a module in the worker process and returns the result.
+
+        Parameters:
+        -----------
+        name: str
+            module name, used if filepath is None.
+        filepath: Path
+            file path of the module, or None for installed modules.
+        method_name: str
+            name of the method to call.
+        args: list
+            positional arguments of the method.
+        kwargs: dict
+            keyword arguments of the method.
+        """
+        with self._lock:
+            self.start()
+
+            filepath = str(filepath) if filepath is not None else None
+            self._conn.send((name, filepath, method_name, args, kwargs))
+
+            # the worker is killed and restarted on the next call if it doesn't respond in time
+            if not self._conn.poll(self.timeout):
+                self._kill()
+                raise TimeoutError(
+                    "did not finish within {} seconds.".format(self.timeout)
+                )
+
+            try:
+                status, result = self._conn.recv()
+            except EOFError:
+                exitcode = self._process.exitcode
+                self._kill()
+                raise RuntimeError(
+                    "worker process exited unexpectedly (exit code {}).".format(
+                        exitcode
+                    )
+                )
+
+        if status == "memory":
+            raise RuntimeError(
+                "exceeded the memory limit of {} MB.".format(self.memory_limit)
+            )
+        elif status == "error":
+            raise RuntimeError("raised an exception:\n{}".format(result))
+
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()